@@ -1,57 +1,120 @@
-import os
-import logging
-from logging.handlers import SMTPHandler
-from logging.handlers import RotatingFileHandler
 from flask import Flask
-from flask_mail import Mail
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager
 
 from config import Config
+from app.database import configure_engines
+from app.database import ReplicaPinning
+from app.database import RoutingSession
+from app.database import SqliteTuning
 
-# application instance
-app = Flask(__name__)
-# loading application configurations
-app.config.from_object(Config)
-# create database instance
-db = SQLAlchemy(app)
-# set up application for migration
-migrate = Migrate(app, db)
-# configure application for enabling smart login state
-login = LoginManager(app)
+# database instance, GET requests read from the replica bind when configured
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+# PRAGMAs of new SQLite connections
+sqlite_tuning = SqliteTuning()
+# read your own writes when a replica lags
+replica_pinning = ReplicaPinning()
+# smart login state
+login = LoginManager()
 # register the login endpoint
-login.login_view = 'login'
-# Instantiate flask mail
-mail = Mail(app)
-
-
-from app import models, errors, routes
-
-if not app.debug:
-    if app.config['MAIL_SERVER']:
-        auth = None
-        if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
-            auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-        secure = None
-        if app.config['MAIL_USE_TLS']:
-            secure = ()
-        mail_handler = SMTPHandler(
-            mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
-            fromaddr='no-reply@' + app.config['MAIL_SERVER'],
-            toaddrs=app.config['ADMINS'], subject='Infographics Failure',
-            credentials=auth, secure=secure)
-        mail_handler.setLevel(logging.ERROR)
-        app.logger.addHandler(mail_handler)
-
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    file_handler = RotatingFileHandler(
-        'logs/infographics.log', maxBytes=10240, backupCount=10)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s - %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-    ))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.setLevel(logging.INFO)
-    app.logger.info('Infographics startup')
+login.login_view = 'main.login'
+
+from app.email import MailQueue
+# send mail from a background thread, Flask-Mail is loaded on first send
+outbox = MailQueue()
+
+from app.passwords import PasswordHasher
+# password hashing off the request thread
+passwords = PasswordHasher()
+
+from app.metrics import Metrics
+# per endpoint request, SQL and template timings
+metrics = Metrics()
+
+from app.identity import IdentityCache
+# skip the user SELECT behind current_user on most requests
+identities = IdentityCache()
+
+from app.availability import NameIndex
+# usernames and emails in use, checked without a query
+names = NameIndex()
+
+from app.fragments import FragmentCache
+# rendered post snippets shared by list pages
+fragments = FragmentCache()
+
+from app.timeline import TimelineFanout
+# deliver new posts into materialized home timelines
+timelines = TimelineFanout()
+
+from app.recent import RecentPosts
+# newest posts of explore kept in memory
+recent_posts = RecentPosts()
+
+from app.presence import LastSeenBuffer
+# coalesce last seen writes of authenticated requests
+last_seen = LastSeenBuffer()
+
+from app.broker import Broker
+# new posts pushed to live timeline streams
+broker = Broker()
+
+from app.trending import TrendingTags
+# hashtag counts of the trending panel
+trending = TrendingTags()
+
+from app.profiler import RequestProfiler
+# stack samples of requests asked for by an admin or sampled at random
+profiler = RequestProfiler()
+
+
+def create_app(config_class=Config):
+    """
+    Application configured from config_class with its extensions and blueprints.
+
+    Flask-Migrate, Flask-Mail and the log handlers are only imported when
+    a command, a mail or a production logger needs them.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+    configure_engines(app.config)
+    db.init_app(app)
+    sqlite_tuning.init_app(app)
+    replica_pinning.init_app(app)
+    login.init_app(app)
+    outbox.init_app(app)
+    passwords.init_app(app)
+    # before the extensions that register collectors
+    metrics.init_app(app)
+    identities.init_app(app)
+    names.init_app(app)
+    fragments.init_app(app)
+    timelines.init_app(app)
+    recent_posts.init_app(app)
+    last_seen.init_app(app)
+    broker.init_app(app)
+    trending.init_app(app)
+    # hooks in before the other before request functions
+    profiler.init_app(app)
+
+    from app.errors import bp as errors_bp
+    app.register_blueprint(errors_bp)
+
+    from app.routes import bp as main_bp
+    app.register_blueprint(main_bp)
+
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp)
+
+    from app.cli import register_commands
+    register_commands(app)
+
+    # mail and file logging on a listener thread
+    if not app.debug and not app.testing:
+        from app.log import configure_logging
+        configure_logging(app)
+        app.logger.info('Infographics startup')
+    return app
+
+
+from app import models
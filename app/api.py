@@ -0,0 +1,209 @@
+import json
+from functools import wraps
+
+from flask import request
+from flask import Blueprint
+from flask import current_app
+from flask_login import current_user
+
+from app import db, names, broker
+from app.bulk import chunked
+from app.models import gravatar, User
+from app.feeds import author_feed, explore_feed, home_feed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+API_PREFIX = '/api/v1'
+
+bp = Blueprint('api', __name__, url_prefix=API_PREFIX)
+
+
+def dumps(data):
+    """
+    JSON bytes of data, naive datetimes written as UTC
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NAIVE_UTC)
+    return json.dumps(data, separators=(',', ':'),
+        default=lambda value: value.isoformat() + '+00:00').encode('utf-8')
+
+def api_response(data, status=200):
+    return current_app.response_class(dumps(data), status=status, mimetype='application/json')
+
+class ApiError(Exception):
+    """
+    Error answered with a JSON body and status
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+@bp.errorhandler(ApiError)
+def api_error(error):
+    """
+    JSON error response
+    """
+    return api_response({'error': error.message}, error.status)
+
+def api_login_required(view):
+    """
+    Answer 401 instead of redirecting anonymous clients to the login page
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not current_user.is_authenticated:
+            raise ApiError(401, 'Authentication required')
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def _id_argument(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value.isdigit():
+        raise ApiError(400, '{} must be a positive integer'.format(name))
+    return int(value)
+
+def serialize_posts(rows):
+    """
+    Plain dicts of rows selected with POST_COLUMNS, one avatar digest per author
+    """
+    avatars = {}
+    posts = []
+    for id, body, timestamp, author_id, username, email in rows:
+        avatar = avatars.get(author_id)
+        if avatar is None:
+            avatar = avatars[author_id] = gravatar(email, 36)
+        posts.append({'id': id, 'body': body, 'timestamp': timestamp,
+            'author': {'id': author_id, 'username': username, 'avatar': avatar}})
+    return posts
+
+def feed_page(feed):
+    """
+    Newest posts of feed between the since_id and max_id query arguments.
+
+    Posts are ordered by id, newest first: since_id excludes a post and
+    everything older, max_id keeps a post and everything older. A client
+    polls with since_id set to the newest_id of its previous response, an
+    empty poll is one range lookup on an index ending in the post id. Pages
+    reaching past the oldest hot post go on in the archive, since_id polls
+    only ask for new posts and never read it.
+    """
+    since_id = _id_argument('since_id')
+    max_id = _id_argument('max_id')
+    count = _id_argument('count') or current_app.config['API_PAGE_SIZE']
+    count = min(count, current_app.config['API_MAX_PAGE_SIZE'])
+    rows = []
+    for tier in (feed, feed.archive if since_id is None else None):
+        if tier is None or len(rows) > count:
+            break
+        query = tier.query.order_by(None)
+        if since_id is not None:
+            query = query.filter(tier.id_column > since_id)
+        if max_id is not None:
+            query = query.filter(tier.id_column <= max_id)
+        rows += query.order_by(tier.id_column.desc()).limit(count + 1 - len(rows)).all()
+    posts = serialize_posts(rows[:count])
+    return {
+        'posts': posts,
+        'newest_id': posts[0]['id'] if posts else since_id,
+        'oldest_id': posts[-1]['id'] if posts else None,
+        # more posts than count matched, fetch them with max_id = oldest_id - 1
+        'has_more': len(rows) > count,
+    }
+
+def post_event(post, author):
+    """
+    Broker event of a new post, its JSON document encoded once for every stream
+    """
+    document = serialize_posts([(post.id, post.body, post.timestamp,
+        author.id, author.username, author.email)])[0]
+    return {'author_id': author.id, 'id': post.id, 'data': dumps(document).decode('utf-8')}
+
+
+@bp.route('/available')
+def available():
+    """
+    Whether the username and email query arguments are free, for checks as the user types
+    """
+    fields = [field for field in names.fields if request.args.get(field)]
+    if not fields:
+        raise ApiError(400, 'username or email is required')
+    return api_response({field: {'value': request.args[field],
+        'available': not names.taken(field, request.args[field])} for field in fields})
+
+@bp.route('/timeline')
+@api_login_required
+def timeline():
+    """
+    Home timeline of the authenticated user
+    """
+    return api_response(feed_page(home_feed(current_user)))
+
+@bp.route('/explore')
+@api_login_required
+def explore():
+    """
+    Posts of every user
+    """
+    return api_response(feed_page(explore_feed()))
+
+@bp.route('/users/<username>/posts')
+@api_login_required
+def user_posts(username):
+    """
+    Posts written by username
+    """
+    page = feed_page(author_feed(
+        db.select(User.id).where(User.username == username).scalar_subquery()))
+    # only an empty page could stand for a missing user
+    if not page['posts'] and User.query.filter_by(username=username).first() is None:
+        raise ApiError(404, 'User {} not found'.format(username))
+    return api_response(page)
+
+@bp.route('/follow', methods=['POST'])
+@api_login_required
+def follow_many():
+    """
+    Follow the users of the usernames and emails lists of a JSON body, to import contacts.
+
+    Users are looked up and followed in batches of API_FOLLOW_BATCH_SIZE,
+    all in one transaction. A JSON body can not be posted by a form of
+    another site, so no CSRF token is asked for.
+    """
+    body = request.get_json(silent=True) if request.is_json else None
+    if not isinstance(body, dict):
+        raise ApiError(400, 'A JSON object body is required')
+    values = {}
+    for field in names.fields:
+        given = body.get(field + 's', [])
+        if not isinstance(given, list) or not all(isinstance(value, str) for value in given):
+            raise ApiError(400, '{}s must be a list of strings'.format(field))
+        values[field] = list(dict.fromkeys(given))
+    if sum(len(given) for given in values.values()) > current_app.config['API_FOLLOW_MANY_MAX']:
+        raise ApiError(400, 'At most {} users can be followed at once'.format(
+            current_app.config['API_FOLLOW_MANY_MAX']))
+    batch_size = current_app.config['API_FOLLOW_BATCH_SIZE']
+    ids, not_found = set(), []
+    for field, given in values.items():
+        column = getattr(User, field)
+        for batch in chunked(given, batch_size):
+            found = dict(db.session.query(column, User.id).filter(column.in_(batch)))
+            not_found += [value for value in batch if value not in found]
+            ids.update(found.values())
+    follower_id = current_user.id
+    followed = current_user.follow_many(sorted(ids), batch_size)
+    # contacts found by email are answered with their usernames too
+    usernames = []
+    for batch in chunked(followed, batch_size):
+        usernames += [username for username, in db.session.query(User.username).filter(
+            User.id.in_(batch)).order_by(User.id)]
+    db.session.commit()
+    if followed:
+        broker.follow(follower_id, followed)
+    return api_response({'followed': usernames, 'not_found': not_found})
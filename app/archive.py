@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import post_tag, Post, PostArchive, Timeline
+
+# columns copied from post to post_archive
+ARCHIVE_COLUMNS = ('id', 'body', 'timestamp', 'user_id')
+
+
+def archive_cutoff(days, now=None):
+    """
+    Timestamp before which posts belong in the archive
+    """
+    return (now or datetime.utcnow()) - timedelta(days=days)
+
+def archive_posts(cutoff, batch_size=1000, report=None):
+    """
+    Moves posts older than cutoff to post_archive, lowest id first.
+
+    Each batch is copied, dropped from the materialized timelines and
+    deleted from post in one transaction, so an interrupted run leaves
+    every post in exactly one table and the next run resumes with what is
+    left. Only posts below the lowest id of a post newer than cutoff are
+    moved, which keeps every archived id below every hot one: feeds page
+    by id from the hot table into the archive. An old post written after
+    a newer one stays hot until that one is archived too. The post with
+    the highest id always stays, post ids are not AUTOINCREMENT and SQLite
+    would hand out archived ids again to an empty table. Like search,
+    the tag index only covers hot posts. report(moved) is called after
+    each batch, returns how many posts were moved.
+    """
+    moved = 0
+    hot, newest = db.session.query(
+        db.select(db.func.min(Post.id)).where(Post.timestamp >= cutoff).scalar_subquery(),
+        db.select(db.func.max(Post.id)).scalar_subquery()).one()
+    if newest is None:
+        return moved
+    hot = newest if hot is None else min(hot, newest)
+    while True:
+        ids = [id for id, in db.session.query(Post.id).filter(Post.id < hot).order_by(
+            Post.id).limit(batch_size)]
+        if not ids:
+            return moved
+        db.session.execute(db.insert(PostArchive).from_select(list(ARCHIVE_COLUMNS),
+            db.select(*[getattr(Post, column) for column in ARCHIVE_COLUMNS]).where(
+                Post.id.in_(ids))))
+        db.session.execute(db.delete(Timeline).where(Timeline.post_id.in_(ids)))
+        db.session.execute(db.delete(post_tag).where(post_tag.c.post_id.in_(ids)))
+        # the search index trigger forgets the deleted posts
+        db.session.execute(db.delete(Post).where(Post.id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+        if report is not None:
+            report(moved)
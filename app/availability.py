@@ -0,0 +1,172 @@
+import math
+import threading
+from time import monotonic
+from hashlib import blake2b
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import User
+
+
+class BloomFilter(object):
+    """
+    Set membership in a bit array: no false negatives, error_rate false
+    positives once capacity values were added
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        """
+        Bit positions of value, by double hashing one 128 bit digest
+        """
+        digest = blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value))
+
+
+class NameIndex(object):
+    """
+    Usernames and emails in use, kept in one Bloom filter per column.
+
+    A value the filter has never seen is free without a query, a possible
+    hit is confirmed with a lookup on the unique index. Names flushed by
+    this process are added at once, those of other workers by a sync of
+    new and renamed users run at most every NAME_INDEX_SYNC_INTERVAL
+    seconds. Until then the unique constraints have the last word.
+    """
+    fields = ('username', 'email')
+    # renames committed a little after their profile_updated are synced again
+    SYNC_OVERLAP = timedelta(minutes=1)
+
+    def __init__(self, app=None):
+        self.app = None
+        self.filters = None
+        self.skipped = 0
+        self.lookups = 0
+        self._synced_id = 0
+        self._synced_since = None
+        self._synced_at = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Size filters from configuration and watch sessions for new names
+        """
+        app.config.setdefault('NAME_INDEX_CAPACITY', 100000)
+        app.config.setdefault('NAME_INDEX_ERROR_RATE', 0.01)
+        app.config.setdefault('NAME_INDEX_SYNC_INTERVAL', 5)
+        app.extensions['name_index'] = self
+        self.app = app
+        if not event.contains(Session, 'after_flush', self._after_flush):
+            event.listen(Session, 'after_flush', self._after_flush)
+        metrics = app.extensions.get('metrics')
+        if metrics is not None:
+            metrics.register_collector(self.expose)
+
+    def _add(self, filters, rows):
+        with self._lock:
+            for username, email in rows:
+                if username:
+                    filters['username'].add(username)
+                if email:
+                    filters['email'].add(email)
+
+    def build(self):
+        """
+        Fill new filters with every user, sized for twice as many
+        """
+        started = datetime.utcnow()
+        count, newest_id = db.session.query(db.func.count(User.id), db.func.max(User.id)).one()
+        capacity = max(self.app.config['NAME_INDEX_CAPACITY'], 2 * count)
+        filters = {field: BloomFilter(capacity, self.app.config['NAME_INDEX_ERROR_RATE'])
+            for field in self.fields}
+        self._add(filters, db.session.query(User.username, User.email).filter(
+            User.id <= (newest_id or 0)).yield_per(1000))
+        self.filters = filters
+        self._synced_id = newest_id or 0
+        self._synced_since = started - self.SYNC_OVERLAP
+        self._synced_at = monotonic()
+
+    def sync(self):
+        """
+        Build the filters on first use, then add users created or renamed elsewhere
+        """
+        if self.filters is None:
+            return self.build()
+        if monotonic() - self._synced_at < self.app.config['NAME_INDEX_SYNC_INTERVAL']:
+            return
+        started = datetime.utcnow()
+        rows = db.session.query(User.id, User.username, User.email).filter(db.or_(
+            User.id > self._synced_id, User.profile_updated >= self._synced_since)).all()
+        if self.filters['username'].count + len(rows) > self.filters['username'].capacity:
+            return self.build()
+        self._add(self.filters, [(username, email) for id, username, email in rows])
+        self._synced_id = max([self._synced_id] + [id for id, username, email in rows])
+        self._synced_since = started - self.SYNC_OVERLAP
+        self._synced_at = monotonic()
+
+    def confirm(self, field, value):
+        """
+        True if a user has value in field, by a lookup on its unique index
+        """
+        self.lookups += 1
+        return db.session.query(db.exists().where(getattr(User, field) == value)).scalar()
+
+    def taken(self, field, value):
+        """
+        True if a user has value in field, without a query for most free values
+        """
+        self.sync()
+        if value not in self.filters[field]:
+            self.skipped += 1
+            return False
+        return self.confirm(field, value)
+
+    def clear(self):
+        """
+        Drop the filters, they are built again on next use
+        """
+        self.filters = None
+        self._synced_id = 0
+        self._synced_at = 0
+
+    def _after_flush(self, session, flush_context):
+        # names of a transaction rolled back later are only false positives
+        filters = self.filters
+        if filters is None:
+            return
+        self._add(filters, [(obj.username, obj.email)
+            for obj in session.new.union(session.dirty) if isinstance(obj, User)])
+
+    def expose(self):
+        """
+        Skipped and confirmed lookups in the Prometheus text exposition format
+        """
+        return ['# HELP infographics_name_index_skipped_total Availability checks answered '
+                'by the Bloom filter',
+            '# TYPE infographics_name_index_skipped_total counter',
+            'infographics_name_index_skipped_total {}'.format(self.skipped),
+            '# HELP infographics_name_index_lookups_total Availability checks confirmed '
+                'in the database',
+            '# TYPE infographics_name_index_lookups_total counter',
+            'infographics_name_index_lookups_total {}'.format(self.lookups)]
@@ -0,0 +1,259 @@
+import os
+import json
+import sqlite3
+import threading
+from time import time
+from collections import defaultdict, deque
+
+
+class Subscriber(object):
+    """
+    Bounded queue of events for one stream, the oldest dropped when full.
+
+    Streams wait on a threading.Condition. Served by serve.py, or any
+    gevent worker, monkey patching turns that wait into a greenlet switch,
+    so an idle stream costs a greenlet rather than a thread.
+    """
+    def __init__(self, user_id, authors, maxsize):
+        self.user_id = user_id
+        self.authors = set(authors) | {user_id}
+        self.events = deque(maxlen=maxsize)
+        self.dropped = 0
+        self._ready = threading.Condition()
+
+    def put(self, event):
+        with self._ready:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append(event)
+            self._ready.notify()
+
+    def get_all(self, timeout):
+        """
+        Every queued event, waiting up to timeout seconds for one
+        """
+        with self._ready:
+            if not self.events:
+                self._ready.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+            return events
+
+
+class LocalTransport(object):
+    """
+    Events only reach the subscribers of this process
+    """
+    def __init__(self):
+        self.deliver = None
+
+    def start(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, event):
+        # nobody subscribed yet
+        if self.deliver is not None:
+            self.deliver(event)
+
+    def stop(self):
+        pass
+
+
+class SqliteTransport(object):
+    """
+    Events shared by every worker of a host through a SQLite table.
+
+    Publishing appends a row, a thread per process polls for rows past the
+    last one it saw. Rows older than retention seconds are deleted.
+    Connections are opened on first use by each thread of each process,
+    so workers forked after create_app never share one.
+    """
+    def __init__(self, path, interval=0.25, retention=60):
+        self.path = path
+        self.interval = interval
+        self.retention = retention
+        self._local = threading.local()
+        self._stopped = threading.Event()
+        self._poller = None
+        self._pid = None
+        self.last_id = None
+
+    def _connect(self):
+        """
+        Connection of the calling thread, opened by the process using it
+        """
+        pid = os.getpid()
+        connection = getattr(self._local, 'connection', None)
+        # a forked child sees the thread locals of the thread that forked it
+        if connection is None or self._local.pid != pid:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            with connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS event (id INTEGER PRIMARY KEY '
+                    'AUTOINCREMENT, created REAL NOT NULL, data TEXT NOT NULL)')
+            self._local.connection, self._local.pid = connection, pid
+        return connection
+
+    def start(self, deliver):
+        """
+        Deliver rows published from now on, the poll thread starts per process
+        """
+        self.deliver = deliver
+        if self._pid == os.getpid() and self._poller is not None and self._poller.is_alive():
+            return
+        self._pid = os.getpid()
+        self.last_id = self._connect().execute('SELECT COALESCE(MAX(id), 0) FROM event').fetchone()[0]
+        self._stopped.clear()
+        self._poller = threading.Thread(target=self._run, name='event-poller', daemon=True)
+        self._poller.start()
+
+    def publish(self, event):
+        with self._connect() as connection:
+            connection.execute('INSERT INTO event (created, data) VALUES (?, ?)',
+                (time(), json.dumps(event)))
+
+    def poll(self):
+        """
+        Deliver rows published since the last poll, returns how many
+        """
+        connection = self._connect()
+        rows = connection.execute('SELECT id, data FROM event WHERE id > ? ORDER BY id',
+            (self.last_id,)).fetchall()
+        for id, data in rows:
+            self.last_id = id
+            self.deliver(json.loads(data))
+        return len(rows)
+
+    def trim(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM event WHERE created < ?', (time() - self.retention,))
+
+    def _run(self):
+        polls = 0
+        while not self._stopped.wait(self.interval):
+            self.poll()
+            polls += 1
+            if polls * self.interval >= self.retention:
+                polls = 0
+                self.trim()
+
+    def stop(self):
+        self._stopped.set()
+
+
+class Broker(object):
+    """
+    Publish/subscribe of new posts for live timelines.
+
+    A subscriber is interested in the posts of the users it follows and
+    its own. Delivery looks subscribers up by author, and never blocks on
+    a slow stream: its queue drops the oldest event instead. Follow
+    changes travel through the transport like posts, so the streams of
+    every worker pick them up.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self.transport = None
+        self.dropped = 0
+        self._by_author = defaultdict(set)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Pick the transport from configuration
+        """
+        app.config.setdefault('STREAM_TRANSPORT', 'local')
+        app.config.setdefault('STREAM_TRANSPORT_PATH', os.path.join(app.instance_path, 'events.db'))
+        app.config.setdefault('STREAM_QUEUE_SIZE', 100)
+        app.config.setdefault('STREAM_HEARTBEAT', 15)
+        app.extensions['broker'] = self
+        self.app = app
+        if app.config['STREAM_TRANSPORT'] == 'sqlite':
+            self.transport = SqliteTransport(app.config['STREAM_TRANSPORT_PATH'])
+        else:
+            self.transport = LocalTransport()
+        metrics = app.extensions.get('metrics')
+        if metrics is not None:
+            metrics.register_collector(self.expose)
+
+    def subscribe(self, user_id, authors):
+        """
+        New subscriber of the posts of authors and user_id
+        """
+        self.transport.start(self.deliver)
+        subscriber = Subscriber(user_id, authors, self.app.config['STREAM_QUEUE_SIZE'])
+        with self._lock:
+            self._subscribers.add(subscriber)
+            for author in subscriber.authors:
+                self._by_author[author].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber not in self._subscribers:
+                return
+            self._subscribers.remove(subscriber)
+            self.dropped += subscriber.dropped
+            for author in subscriber.authors:
+                subscribers = self._by_author.get(author)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._by_author[author]
+
+    def follow(self, user_id, authors, following=True):
+        """
+        Start or stop delivering posts of authors to the streams of user_id in
+        every worker, one event for the whole list
+        """
+        self.transport.publish({'follower_id': user_id, 'author_ids': list(authors),
+            'following': following})
+
+    def _follow(self, user_id, authors, following):
+        with self._lock:
+            for subscriber in [s for s in self._subscribers if s.user_id == user_id]:
+                for author in authors:
+                    if following:
+                        subscriber.authors.add(author)
+                        self._by_author[author].add(subscriber)
+                    elif author != user_id:
+                        subscriber.authors.discard(author)
+                        self._by_author[author].discard(subscriber)
+
+    def publish(self, event):
+        """
+        Send an event with an author_id to the subscribers of every worker
+        """
+        self.transport.publish(event)
+
+    def deliver(self, event):
+        """
+        Queue an event for the subscribers of this process interested in its author,
+        or apply a follow change to the streams of its follower
+        """
+        if 'follower_id' in event:
+            self._follow(event['follower_id'], event['author_ids'], event['following'])
+            return
+        with self._lock:
+            subscribers = list(self._by_author.get(event['author_id'], ()))
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def expose(self):
+        """
+        Stream gauges and drop counter in the Prometheus text exposition format
+        """
+        with self._lock:
+            subscribers = len(self._subscribers)
+            dropped = self.dropped + sum(s.dropped for s in self._subscribers)
+        return ['# HELP infographics_stream_subscribers Open live timeline streams',
+            '# TYPE infographics_stream_subscribers gauge',
+            'infographics_stream_subscribers {}'.format(subscribers),
+            '# HELP infographics_stream_dropped_total Events dropped from full stream queues',
+            '# TYPE infographics_stream_dropped_total counter',
+            'infographics_stream_dropped_total {}'.format(dropped)]
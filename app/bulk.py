@@ -0,0 +1,177 @@
+import csv
+import json
+from time import perf_counter
+from datetime import datetime
+from itertools import islice
+
+from app import db
+from app.models import follows, Post, User
+
+# exported tables in dependency order, with the columns that round trip
+TABLES = {
+    'users': (User.__table__, ('id', 'username', 'email', 'password_hash', 'about_me',
+        'last_seen', 'profile_updated')),
+    'posts': (Post.__table__, ('id', 'body', 'timestamp', 'user_id')),
+    'follows': (follows, ('follower_id', 'followed_id')),
+}
+# NDJSON records carry their kind in a type field
+RECORD_TYPES = {'users': 'user', 'posts': 'post', 'follows': 'follow'}
+KINDS = {record_type: kind for kind, record_type in RECORD_TYPES.items()}
+
+
+def chunked(iterable, size):
+    """
+    Lists of up to size consecutive items of iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _columns(kind):
+    table, names = TABLES[kind]
+    return table, [table.c[name] for name in names]
+
+def _to_text(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _parser(column):
+    """
+    Function of a serialized value of column to its Python value
+    """
+    if isinstance(column.type, db.DateTime):
+        convert = datetime.fromisoformat
+    elif isinstance(column.type, db.Integer):
+        convert = int
+    else:
+        convert = str
+    # CSV has no null, an empty field stands for one
+    return lambda value: None if value is None or value == '' else convert(value)
+
+
+def export_rows(kind, batch_size):
+    """
+    Streams rows of a table as dicts, batch_size rows in memory at a time
+    """
+    table, columns = _columns(kind)
+    statement = db.select(*columns).order_by(*table.primary_key.columns)
+    result = db.session.execute(statement, execution_options={'stream_results': True})
+    for partition in result.partitions(batch_size):
+        for row in partition:
+            yield {key: _to_text(value) for key, value in row._mapping.items()}
+
+def write_ndjson(stream, kinds, batch_size):
+    """
+    Writes every row of kinds as one JSON object per line, returns the row count
+    """
+    written = 0
+    for kind in kinds:
+        record_type = RECORD_TYPES[kind]
+        for row in export_rows(kind, batch_size):
+            row['type'] = record_type
+            stream.write(json.dumps(row, separators=(',', ':')))
+            stream.write('\n')
+            written += 1
+    return written
+
+def write_csv(stream, kind, batch_size):
+    """
+    Writes every row of kind as CSV with a header, returns the row count
+    """
+    writer = csv.DictWriter(stream, fieldnames=TABLES[kind][1], lineterminator='\n')
+    writer.writeheader()
+    written = 0
+    for row in export_rows(kind, batch_size):
+        writer.writerow(row)
+        written += 1
+    return written
+
+
+def read_ndjson(stream):
+    """
+    (kind, row) pairs of an NDJSON stream
+    """
+    for line in stream:
+        if line.strip():
+            row = json.loads(line)
+            yield KINDS[row.pop('type')], row
+
+def read_csv(stream, kind):
+    """
+    (kind, row) pairs of a CSV stream holding rows of kind
+    """
+    for row in csv.DictReader(stream):
+        yield kind, row
+
+
+class ImportProgress(object):
+    """
+    Rows imported per kind and throughput since the import started
+    """
+    def __init__(self):
+        self.start = perf_counter()
+        self.counts = {kind: 0 for kind in TABLES}
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    @property
+    def elapsed(self):
+        return perf_counter() - self.start
+
+    def __str__(self):
+        elapsed = self.elapsed
+        return '{} rows in {:.1f}s ({:.0f} rows/s): {}'.format(
+            self.total, elapsed, self.total / elapsed if elapsed else 0,
+            ', '.join('{} {}'.format(count, kind) for kind, count in self.counts.items()))
+
+
+def import_rows(records, batch_size, report=None):
+    """
+    Inserts (kind, row) records with one executemany per kind and batch.
+
+    Rows go straight to the tables, bypassing the ORM and its identity map.
+    Each batch is committed so a failed import keeps what was loaded. SQLite
+    skips fsync on those commits, an import cut short by a power loss is
+    rerun from a backup rather than trusted.
+    """
+    progress = ImportProgress()
+    statements = {kind: table.insert() for kind, (table, names) in TABLES.items()}
+    parsers = {kind: [(column.key, _parser(column)) for column in _columns(kind)[1]]
+        for kind in TABLES}
+    sqlite = db.engine.dialect.name == 'sqlite'
+    # one connection for the whole import, so the PRAGMA is set and restored
+    # on the connection that ran it before the pool hands it to requests
+    with db.engine.connect() as connection:
+        if sqlite:
+            synchronous = connection.execute(db.text('PRAGMA synchronous')).scalar()
+            connection.execute(db.text('PRAGMA synchronous = OFF'))
+        try:
+            for chunk in chunked(records, batch_size):
+                rows = {}
+                for kind, row in chunk:
+                    rows.setdefault(kind, []).append(
+                        {name: parse(row.get(name)) for name, parse in parsers[kind]})
+                with connection.begin():
+                    # users first so a batch never references rows inserted after it
+                    for kind in TABLES:
+                        if kind in rows:
+                            connection.execute(statements[kind], rows[kind])
+                            progress.counts[kind] += len(rows[kind])
+                if report is not None:
+                    report(progress)
+        finally:
+            if sqlite:
+                connection.execute(db.text('PRAGMA synchronous = {:d}'.format(synchronous)))
+    return progress
+
+def drop_search_triggers():
+    """
+    Stop indexing posts one by one, Post.reindex_search() restores the triggers
+    """
+    for name in ('post_fts_insert', 'post_fts_delete', 'post_fts_update'):
+        db.session.execute(db.text('DROP TRIGGER IF EXISTS {}'.format(name)))
+    db.session.commit()
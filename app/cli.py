@@ -0,0 +1,220 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app import db
+from app import bulk
+from app.archive import archive_cutoff, archive_posts
+from app.models import Post, User
+from app.timeline import rebuild_timelines
+from app.trending import backfill_tags, rebuild_tag_counts
+from app.suggestions import refresh_suggestions
+
+
+@click.group(cls=AppGroup)
+def timeline():
+    """
+    Materialized home timeline commands
+    """
+    pass
+
+@timeline.command()
+@click.option('--username', default=None, help='Only rebuild the timeline of this user.')
+def rebuild(username):
+    """
+    Rebuild materialized timelines from follows and posts
+    """
+    user_id = None
+    if username is not None:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.ClickException('User {} not found'.format(username))
+        user_id = user.id
+    inserted = rebuild_timelines(user_id)
+    click.echo('Rebuilt timelines with {} entries'.format(inserted))
+
+@click.group(cls=AppGroup)
+def counters():
+    """
+    Denormalized counter commands
+    """
+    pass
+
+@counters.command()
+def reconcile():
+    """
+    Recompute follower and following counters of every user
+    """
+    fixed = User.reconcile_follow_counts()
+    click.echo('Reconciled follow counters of {} users'.format(fixed))
+
+@click.group(cls=AppGroup)
+def search():
+    """
+    Full-text search commands
+    """
+    pass
+
+@search.command()
+def reindex():
+    """
+    Rebuild the full-text index of posts
+    """
+    Post.reindex_search()
+    click.echo('Reindexed {} posts'.format(Post.query.count()))
+
+@click.group(cls=AppGroup)
+def data():
+    """
+    Bulk export and import of users, posts and follows
+    """
+    pass
+
+def _kinds(kind, format):
+    if kind == 'all':
+        if format == 'csv':
+            raise click.UsageError('CSV holds a single kind, pass --kind')
+        return list(bulk.TABLES)
+    return [kind]
+
+@data.command()
+@click.argument('output', type=click.File('w'), default='-')
+@click.option('--format', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+@click.option('--kind', type=click.Choice(['all'] + list(bulk.TABLES)), default='all')
+@click.option('--batch-size', type=click.IntRange(1), default=10000, help='Rows fetched at a time.')
+def export(output, format, kind, batch_size):
+    """
+    Stream rows to OUTPUT, stdout by default
+    """
+    kinds = _kinds(kind, format)
+    if format == 'csv':
+        written = bulk.write_csv(output, kinds[0], batch_size)
+    else:
+        written = bulk.write_ndjson(output, kinds, batch_size)
+    click.echo('Exported {} rows'.format(written), err=True)
+
+@data.command('import')
+@click.argument('input', type=click.File('r'), default='-')
+@click.option('--format', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+@click.option('--kind', type=click.Choice(['all'] + list(bulk.TABLES)), default='all')
+@click.option('--batch-size', type=click.IntRange(1), default=10000, help='Rows inserted at a time.')
+@click.option('--skip-derived', is_flag=True,
+    help='Leave timelines, counters, hashtags and the search index to be rebuilt later.')
+def import_(input, format, kind, batch_size, skip_derived):
+    """
+    Bulk insert rows streamed from INPUT, stdin by default.
+
+    Posts are indexed for search in one pass after the import rather than
+    by trigger on every insert.
+    """
+    kinds = _kinds(kind, format)
+    if format == 'csv':
+        records = bulk.read_csv(input, kinds[0])
+    else:
+        records = (record for record in bulk.read_ndjson(input) if record[0] in kinds)
+    if 'posts' in kinds:
+        bulk.drop_search_triggers()
+    try:
+        progress = bulk.import_rows(records, batch_size,
+            report=lambda progress: click.echo(str(progress), err=True))
+    finally:
+        if 'posts' in kinds:
+            Post.reindex_search()
+    click.echo('Imported {}'.format(progress))
+    if not skip_derived:
+        User.reconcile_follow_counts()
+        click.echo('Rebuilt timelines with {} entries'.format(rebuild_timelines()))
+        if 'posts' in kinds:
+            backfill_tags()
+            rebuild_tag_counts()
+
+@click.group(cls=AppGroup)
+def archive():
+    """
+    Hot and archived post commands
+    """
+    pass
+
+@archive.command()
+@click.option('--days', type=click.IntRange(0), default=None,
+    help='Archive posts older than this, POST_ARCHIVE_DAYS by default.')
+@click.option('--batch-size', type=click.IntRange(1), default=1000, help='Posts moved at a time.')
+def posts(days, batch_size):
+    """
+    Move old posts to the archive in resumable batches
+    """
+    if days is None:
+        days = current_app.config['POST_ARCHIVE_DAYS']
+    cutoff = archive_cutoff(days)
+    moved = archive_posts(cutoff, batch_size,
+        report=lambda moved: click.echo('Moved {} posts'.format(moved), err=True))
+    click.echo('Archived {} posts older than {:%Y-%m-%d %H:%M}'.format(moved, cutoff))
+
+@click.group(cls=AppGroup)
+def tags():
+    """
+    Hashtag index and trending counter commands
+    """
+    pass
+
+@tags.command()
+@click.option('--batch-size', type=click.IntRange(1), default=1000, help='Posts read at a time.')
+def backfill(batch_size):
+    """
+    Index the hashtags of existing posts and recount the trending buckets
+    """
+    read = backfill_tags(batch_size,
+        report=lambda read: click.echo('Read {} posts'.format(read), err=True))
+    click.echo('Indexed hashtags of {} posts'.format(read))
+    click.echo('Rebuilt {} trending buckets'.format(rebuild_tag_counts()))
+
+@click.group(cls=AppGroup)
+def suggestions():
+    """
+    Who to follow commands
+    """
+    pass
+
+@suggestions.command()
+@click.option('--workers', type=click.IntRange(0), default=None,
+    help='Scoring processes, SUGGESTIONS_WORKERS by default, 0 scores inline.')
+@click.option('--chunk-size', type=click.IntRange(1), default=None,
+    help='Users scored at a time, SUGGESTIONS_CHUNK_SIZE by default.')
+def compute(workers, chunk_size):
+    """
+    Score two hop follows of every user and store the best suggestions
+    """
+    config = current_app.config
+    stored = refresh_suggestions(config['SUGGESTIONS_PER_USER'],
+        config['SUGGESTIONS_WORKERS'] if workers is None else workers,
+        chunk_size or config['SUGGESTIONS_CHUNK_SIZE'],
+        report=lambda users: click.echo('Scored {} users'.format(users), err=True))
+    click.echo('Stored {} suggestions'.format(stored))
+
+
+class MigrationGroup(click.MultiCommand):
+    """
+    The flask db commands of Flask-Migrate, alembic is only imported when one runs
+    """
+    def _commands(self):
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as commands
+        app = current_app._get_current_object()
+        if 'migrate' not in app.extensions:
+            Migrate(app, db)
+        return commands
+
+    def list_commands(self, ctx):
+        return self._commands().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._commands().get_command(ctx, name)
+
+
+def register_commands(app):
+    """
+    Add the command groups to the flask command of app
+    """
+    for group in (timeline, counters, search, data, archive, tags, suggestions):
+        app.cli.add_command(group)
+    app.cli.add_command(MigrationGroup('db', help='Perform database migrations.'))
@@ -0,0 +1,127 @@
+from time import time
+from hashlib import md5
+from functools import wraps
+from datetime import timezone
+
+from flask import session
+from flask import request
+from flask import current_app
+from flask import make_response
+from flask_login import current_user
+
+from app import db
+from app import recent_posts
+from app import trending
+from app.models import follows, Post, Suggestion, Timeline, User
+
+
+def conditional(validators):
+    """
+    Answer If-None-Match/If-Modified-Since with 304 before the view runs.
+
+    validators(**view_args) returns (etag parts, last modified or None) from
+    cheap lookups, or None to always run the view. Last-Modified is only set
+    when it captures every change of the page.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            # flashed messages must be rendered, and consumed, once
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return view(*args, **kwargs)
+            result = validators(**kwargs)
+            if result is None:
+                return view(*args, **kwargs)
+            parts, last_modified = result
+            etag = md5(repr(parts).encode('utf-8')).hexdigest()
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+            if request.if_none_match:
+                fresh = request.if_none_match.contains(etag)
+            else:
+                fresh = last_modified is not None and request.if_modified_since is not None \
+                    and last_modified <= request.if_modified_since
+            response = make_response('', 304) if fresh else make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # browsers keep the page but revalidate it on every visit
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapped
+    return decorator
+
+
+def _viewer():
+    """
+    Parts of every page that depend on who is looking at it
+    """
+    return (current_user.id, current_user.username)
+
+def _form_token_epoch():
+    """
+    Changes twice per CSRF token lifetime so cached forms never hold an expired token
+    """
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    return int(time() // (time_limit // 2)) if time_limit else 0
+
+def _cursor():
+    return (request.args.get('before'), request.args.get('after'))
+
+def _newest_profile_change():
+    """
+    Scalar subquery of the most recent profile edit, renames change every feed
+    """
+    return db.select(db.func.max(User.profile_updated)).scalar_subquery()
+
+def explore_validators():
+    """
+    Newest post and profile edit, from the recent posts buffer when enabled,
+    otherwise answered from the primary key and two indexes, and the
+    trending tags
+    """
+    if recent_posts.enabled:
+        newest_id, newest_timestamp, profile_updated = recent_posts.refresh()
+    else:
+        newest_id, newest_timestamp, profile_updated = db.session.query(
+            db.select(db.func.max(Post.id)).scalar_subquery(),
+            db.select(db.func.max(Post.timestamp)).scalar_subquery(),
+            _newest_profile_change()).one()
+    # the trending panel changes without a new post
+    top = trending.top()
+    last_modified = max(filter(None, (newest_timestamp, profile_updated, trending.changed)),
+        default=None)
+    return (_viewer(), _cursor(), newest_id, profile_updated, top), last_modified
+
+def index_validators():
+    """
+    Newest entry of the materialized timeline of current_user and the
+    version of the users it follows
+    """
+    if not current_app.config['MATERIALIZED_TIMELINE']:
+        return None
+    # the version catches follows that backfilled older posts and unfollows that
+    # pruned some, read from the database as other workers may have changed it
+    row = db.session.query(db.select(db.func.max(Timeline.post_id)).where(
+        Timeline.owner_id == current_user.id).scalar_subquery(), _newest_profile_change(),
+        db.select(User.follows_version).where(User.id == current_user.id).scalar_subquery()).one()
+    return (_viewer(), _cursor(), _form_token_epoch(), tuple(row)), None
+
+def user_validators(username):
+    """
+    Profile row of username, its newest post, whether current_user follows it
+    and the suggestions of current_user on its own profile
+    """
+    row = db.session.query(User.id, User.about_me, User.last_seen, User.profile_updated,
+        User.followers_count, User.following_count,
+        db.select(db.func.max(Post.id)).where(Post.user_id == User.id).scalar_subquery(),
+        db.exists().where(follows.c.follower_id == current_user.id,
+            follows.c.followed_id == User.id),
+        # suggestions only show on the profile of current_user
+        db.select(db.func.group_concat(Suggestion.suggested_id)).where(
+            Suggestion.user_id == current_user.id, User.id == current_user.id).scalar_subquery()
+        ).filter(User.username == username).first()
+    if row is None:
+        return None
+    return (_viewer(), _cursor(), _form_token_epoch(), username, tuple(row)), None
@@ -0,0 +1,175 @@
+import sqlite3
+from time import time
+from importlib import import_module
+
+import sqlalchemy as sa
+from flask import g
+from flask import request
+from flask import session as cookie
+from flask import has_request_context
+from flask_sqlalchemy.session import Session
+
+# read-only methods whose queries may be answered by the replica
+READ_METHODS = ('GET', 'HEAD')
+# dialects with INSERT ... ON CONFLICT DO NOTHING
+ON_CONFLICT_DIALECTS = ('sqlite', 'postgresql')
+
+
+def engine_options(config):
+    """
+    Engine arguments shared by the primary and replica binds.
+
+    A pool keeps SQLite connections, and the PRAGMAs set on them, across
+    requests instead of reconnecting for every transaction.
+    """
+    pool_size = config.get('DATABASE_POOL_SIZE', 5)
+    if not pool_size:
+        return {}
+    return {'poolclass': sa.pool.QueuePool, 'pool_size': pool_size,
+        'max_overflow': config.get('DATABASE_MAX_OVERFLOW', 10),
+        'connect_args': {'check_same_thread': False}}
+
+def configure_engines(config):
+    """
+    Apply engine_options to the primary and to every bind given by url
+    """
+    options = engine_options(config)
+    config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', options)
+    config['SQLALCHEMY_BINDS'] = {key: dict(options, url=value) if isinstance(value, str)
+        else value for key, value in config.get('SQLALCHEMY_BINDS', {}).items()}
+
+def insert_ignore(session, table, rows):
+    """
+    Insert rows into table skipping those whose key is already taken,
+    returns how many were inserted, exact for a single row.
+
+    SQLite and PostgreSQL skip them in one ON CONFLICT DO NOTHING
+    statement, other backends insert each row in its own savepoint and
+    roll back the ones raising IntegrityError.
+    """
+    name = session.get_bind(clause=table).dialect.name
+    if name in ON_CONFLICT_DIALECTS:
+        insert = import_module('sqlalchemy.dialects.' + name).insert
+        return session.execute(insert(table).on_conflict_do_nothing(), rows).rowcount
+    inserted = 0
+    for row in rows:
+        try:
+            with session.begin_nested():
+                session.execute(sa.insert(table).values(**row))
+        except sa.exc.IntegrityError:
+            continue
+        inserted += 1
+    return inserted
+
+def insert_ignore_select(session, table, names, select):
+    """
+    INSERT ... SELECT statement filling names of table, skipping rows whose
+    key is already taken.
+
+    SQLite and PostgreSQL add ON CONFLICT DO NOTHING and MySQL INSERT
+    IGNORE, other backends only select the rows missing from the primary key.
+    """
+    name = session.get_bind(clause=table).dialect.name
+    if name in ON_CONFLICT_DIALECTS:
+        insert = import_module('sqlalchemy.dialects.' + name).insert
+        # a WHERE keeps SQLite from reading ON CONFLICT as a join constraint
+        return insert(table).from_select(names, select.where(sa.true())).on_conflict_do_nothing()
+    if name == 'mysql':
+        return sa.insert(table).prefix_with('IGNORE').from_select(names, select)
+    rows = list(select.subquery().c)
+    taken = sa.exists().where(*(column == rows[names.index(column.name)]
+        for column in table.primary_key))
+    return sa.insert(table).from_select(names, sa.select(*rows).where(~taken))
+
+
+class SqliteTuning(object):
+    """
+    PRAGMAs applied to every new SQLite connection of the application engines
+    """
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Read PRAGMA values from configuration and listen for new connections
+        """
+        app.config.setdefault('SQLITE_JOURNAL_MODE', 'WAL')
+        app.config.setdefault('SQLITE_SYNCHRONOUS', 'NORMAL')
+        app.config.setdefault('SQLITE_CACHE_SIZE', -20000)
+        app.config.setdefault('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+        app.config.setdefault('SQLITE_BUSY_TIMEOUT', 5000)
+        app.extensions['sqlite_tuning'] = self
+        self.app = app
+        sa.event.listen(sa.engine.Engine, 'connect', self.configure)
+
+    def configure(self, dbapi_connection, connection_record):
+        """
+        Tune a fresh connection, other drivers than sqlite3 are left alone
+        """
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        config = self.app.config
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute('PRAGMA busy_timeout = {:d}'.format(config['SQLITE_BUSY_TIMEOUT']))
+            try:
+                cursor.execute('PRAGMA journal_mode = {}'.format(config['SQLITE_JOURNAL_MODE']))
+            except sqlite3.OperationalError:
+                # read-only replicas keep the mode the primary set
+                pass
+            cursor.execute('PRAGMA synchronous = {}'.format(config['SQLITE_SYNCHRONOUS']))
+            cursor.execute('PRAGMA cache_size = {:d}'.format(config['SQLITE_CACHE_SIZE']))
+            cursor.execute('PRAGMA mmap_size = {:d}'.format(config['SQLITE_MMAP_SIZE']))
+        finally:
+            cursor.close()
+
+
+class RoutingSession(Session):
+    """
+    Session sending the SELECTs of GET requests to the replica bind.
+
+    Writes, flushes and every query outside a GET request go to the
+    primary. A client that just wrote reads from the primary for
+    REPLICA_PIN_SECONDS, so a redirect after a POST shows its own change
+    however far the replica lags.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and isinstance(clause, sa.sql.Select) and self._reads_from_replica():
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self):
+        if 'replica' not in self._db.engines or self._flushing or not has_request_context():
+            return False
+        return request.method in READ_METHODS and cookie.get('_primary_until', 0) < time()
+
+
+class ReplicaPinning(object):
+    """
+    Remembers in the session cookie that a client committed a change
+    """
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Watch commits of write requests and pin their client after the response
+        """
+        app.config.setdefault('REPLICA_PIN_SECONDS', 5)
+        app.extensions['replica_pinning'] = self
+        self.app = app
+        sa.event.listen(RoutingSession, 'after_commit', self.committed)
+        app.after_request(self.pin)
+
+    def committed(self, session):
+        if has_request_context() and request.method not in READ_METHODS:
+            g.replica_pin = True
+
+    def pin(self, response):
+        if g.get('replica_pin') and 'replica' in self.app.extensions['sqlalchemy'].engines:
+            cookie['_primary_until'] = time() + self.app.config['REPLICA_PIN_SECONDS']
+        return response
@@ -0,0 +1,96 @@
+import queue
+import atexit
+import threading
+
+
+class MailQueue(object):
+    """
+    Outgoing mail handed to a background thread.
+
+    Requests enqueue a message and return at once, the sender thread opens
+    the SMTP connection in an application context. A message that fails
+    to send is logged and dropped. Flask-Mail is imported by the first
+    message, processes that never send mail do not load it.
+    """
+    def __init__(self, app=None, mail=None):
+        self.app = None
+        self._mail = mail
+        self.queue = queue.Queue()
+        self._sender = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, mail)
+
+    def init_app(self, app, mail=None):
+        """
+        Bind queue to application and its Mail instance, drain it on interpreter shutdown
+        """
+        app.extensions['mail_queue'] = self
+        self.app = app
+        if mail is not None:
+            self._mail = mail
+        atexit.register(self.stop)
+
+    @property
+    def mail(self):
+        """
+        Flask-Mail instance of the application, created on first use
+        """
+        if self._mail is None:
+            from flask_mail import Mail
+            self._mail = Mail(self.app)
+        return self._mail
+
+    def _start_sender(self):
+        """
+        Start the sender thread in this process, on first use so forked workers get their own
+        """
+        if self._sender is not None and self._sender.is_alive():
+            return
+        with self._lock:
+            if self._sender is None or not self._sender.is_alive():
+                self._sender = threading.Thread(target=self._run, name='mail-sender', daemon=True)
+                self._sender.start()
+
+    def _run(self):
+        while True:
+            message = self.queue.get()
+            try:
+                if message is None:
+                    return
+                with self.app.app_context():
+                    self.mail.send(message)
+            except Exception:
+                self.app.logger.exception('Failed to send mail to %s', message.recipients)
+            finally:
+                self.queue.task_done()
+
+    def send(self, message):
+        """
+        Queue a flask_mail Message for sending
+        """
+        self._start_sender()
+        self.queue.put(message)
+
+    def send_email(self, subject, sender, recipients, text_body, html_body=None):
+        """
+        Queue a mail built from its parts
+        """
+        from flask_mail import Message
+        self.send(Message(subject, sender=sender, recipients=recipients, body=text_body,
+            html=html_body))
+
+    def join(self):
+        """
+        Wait until every queued message was handled
+        """
+        self.queue.join()
+
+    def stop(self):
+        """
+        Send what is queued and stop the sender thread
+        """
+        if self._sender is not None and self._sender.is_alive():
+            self.queue.put(None)
+            self._sender.join()
+
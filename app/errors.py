@@ -1,16 +1,19 @@
+from flask import Blueprint
 from flask import render_template
 
-from app import app, db
+from app import db
 
+bp = Blueprint('errors', __name__)
 
-@app.errorhandler(404)
+
+@bp.app_errorhandler(404)
 def not_found_error(error):
     """
     404 error handler
     """
     return render_template('404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def server_error(error):
     """
     Internal server error handler
@@ -0,0 +1,202 @@
+from collections import namedtuple
+
+from flask import current_app
+
+from app import db
+from app.models import follows, gravatar, post_fts, Post, PostArchive, Timeline, User
+from app.pagination import decode_cursor, keyset_rows, paginate_keyset, KeysetPagination
+
+# the only columns _post.html needs, post and author in one row
+POST_COLUMNS = (Post.id, Post.body, Post.timestamp,
+    User.id.label('author_id'), User.username, User.email)
+ARCHIVE_COLUMNS = (PostArchive.id, PostArchive.body, PostArchive.timestamp,
+    User.id.label('author_id'), User.username, User.email)
+
+# cursors of the archive tier: archived posts, along with hot posts no newer
+# than the newest archived one (a post written with an old timestamp, or
+# kept hot as the newest id) so the tiers never overlap in timestamp order
+ARCHIVE_CURSOR_PREFIX = 'a'
+
+# projected query with the columns and direction it is keyset paginated on,
+# and the feed of the same posts in the archive
+Feed = namedtuple('Feed', ['query', 'sort_column', 'id_column', 'descending', 'archive'],
+    defaults=(True, None))
+
+
+class PostAuthor(object):
+    """
+    Author fields rendered next to a post
+    """
+    __slots__ = ('id', 'username', 'email')
+
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+    def avatar(self, size):
+        """
+        Author profile image
+        """
+        return gravatar(self.email, size)
+
+
+class PostView(object):
+    """
+    Read only post with its author, built from a projected row
+    """
+    __slots__ = ('id', 'body', 'timestamp', 'author')
+
+    def __init__(self, id, body, timestamp, author):
+        self.id = id
+        self.body = body
+        self.timestamp = timestamp
+        self.author = author
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Build a view from a row selected with POST_COLUMNS
+        """
+        return cls(row.id, row.body, row.timestamp,
+            PostAuthor(row.author_id, row.username, row.email))
+
+    def __repr__(self):
+        """
+        Representaion of a PostView instance
+        """
+        return '<PostView {}>'.format(self.body)
+
+
+def _posts_with_authors(model=Post):
+    """
+    Projected posts, hot or archived, joined to their authors
+    """
+    columns = ARCHIVE_COLUMNS if model is PostArchive else POST_COLUMNS
+    return db.session.query(*columns).join(User, User.id == model.user_id)
+
+def _followed_posts(user_id, model):
+    """
+    Posts of user_id and of the users it follows, computed from follows
+    """
+    followed = _posts_with_authors(model).join(
+        follows, follows.c.followed_id == model.user_id).filter(follows.c.follower_id == user_id)
+    own = _posts_with_authors(model).filter(model.user_id == user_id)
+    return Feed(followed.union(own), model.timestamp, model.id)
+
+def home_feed(user):
+    """
+    Posts of user and of the users it follows
+    """
+    # archived posts are dropped from the materialized timelines
+    archive = _followed_posts(user.id, PostArchive)
+    if current_app.config['MATERIALIZED_TIMELINE']:
+        query = db.session.query(*POST_COLUMNS).select_from(Timeline).join(
+            Post, Post.id == Timeline.post_id).join(User, User.id == Post.user_id).filter(
+            Timeline.owner_id == user.id)
+        return Feed(query, Timeline.timestamp, Timeline.post_id, archive=archive)
+    return _followed_posts(user.id, Post)._replace(archive=archive)
+
+def explore_feed():
+    """
+    Posts of every user
+    """
+    return Feed(_posts_with_authors(), Post.timestamp, Post.id,
+        archive=Feed(_posts_with_authors(PostArchive), PostArchive.timestamp, PostArchive.id))
+
+def author_feed(user_id):
+    """
+    Posts written by user_id, an id or a scalar subquery
+    """
+    return Feed(_posts_with_authors().filter(Post.user_id == user_id), Post.timestamp, Post.id,
+        archive=Feed(_posts_with_authors(PostArchive).filter(PostArchive.user_id == user_id),
+            PostArchive.timestamp, PostArchive.id))
+
+def user_feed(user):
+    """
+    Posts written by user
+    """
+    return author_feed(user.id)
+
+def search_feed(text):
+    """
+    Posts matching every word of text, best ranked first
+    """
+    expression = Post.match_expression(text)
+    query = db.session.query(*POST_COLUMNS, post_fts.c.rank).select_from(post_fts).join(
+        Post, Post.id == post_fts.c.rowid).join(User, User.id == Post.user_id)
+    if expression is None:
+        query = query.filter(db.false())
+    else:
+        query = query.filter(post_fts.c.post_fts.match(expression))
+    # bm25 ranks are negative, the lower the better
+    return Feed(query, post_fts.c.rank, post_fts.c.rowid, descending=False)
+
+def _tier_cursor(cursor, sort_column):
+    """
+    (tier, key) of a cursor, 1 for the archive and 0 for the hot table
+    """
+    if cursor and cursor.startswith(ARCHIVE_CURSOR_PREFIX):
+        return 1, decode_cursor(cursor[len(ARCHIVE_CURSOR_PREFIX):], sort_column)
+    return 0, decode_cursor(cursor, sort_column)
+
+def _tiers(feed):
+    """
+    Feeds of each tier, the hot posts newer than every archived one, then
+    the archive with the hot posts as old as it
+    """
+    newest = db.select(db.func.max(feed.archive.sort_column)).scalar_subquery()
+    hot = feed.query.filter(db.or_(newest.is_(None), feed.sort_column > newest))
+    stale = feed.query.filter(feed.sort_column <= newest)
+    return (feed._replace(query=hot),), (feed.archive, feed._replace(query=stale))
+
+def _tier_rows(tiers, start, limit, key, backward):
+    """
+    Up to limit (tier, row) pairs from key on, crossing into the next tier when short
+    """
+    rows = []
+    step = -1 if backward else 1
+    for tier in range(start, -1 if backward else len(tiers), step):
+        merged = []
+        for feed in tiers[tier]:
+            merged += keyset_rows(feed.query, feed.sort_column, feed.id_column,
+                limit - len(rows), key, backward=backward, descending=feed.descending)
+        # rows of one tier come from several queries, nearest to key first
+        merged.sort(key=lambda row: (row.timestamp, row.id),
+            reverse=tiers[tier][0].descending != backward)
+        rows += [(tier, row) for row in merged[:limit - len(rows)]]
+        if len(rows) >= limit:
+            break
+    return rows
+
+def paginate_feed(feed, per_page, before=None, after=None):
+    """
+    Keyset paginate a feed into PostView items.
+
+    Pages are read from the hot table, the archive is only queried once a
+    page reaches past the hot posts newer than it. Hot posts as old as the
+    archive are merged into its tier so the feed stays in timestamp order.
+    Cursors of that tier are prefixed so paging back from it starts there.
+    """
+    if feed.archive is None:
+        page = paginate_keyset(feed.query, feed.sort_column, feed.id_column,
+            per_page, before=before, after=after, descending=feed.descending)
+        page.items = [PostView.from_row(row) for row in page.items]
+        return page
+    tiers = _tiers(feed)
+    (before_tier, before), (after_tier, after) = \
+        _tier_cursor(before, feed.sort_column), _tier_cursor(after, feed.sort_column)
+    key = lambda item: (item[1].timestamp, item[1].id)
+    if after is not None:
+        rows = _tier_rows(tiers, after_tier, per_page + 1, after, backward=True)
+        page = KeysetPagination(rows[:per_page][::-1], len(rows) > per_page, True, key)
+    else:
+        rows = _tier_rows(tiers, before_tier if before is not None else 0, per_page + 1,
+            before, backward=False)
+        page = KeysetPagination(rows[:per_page], before is not None, len(rows) > per_page, key)
+    if page.prev_cursor is not None and page.items[0][0]:
+        page.prev_cursor = ARCHIVE_CURSOR_PREFIX + page.prev_cursor
+    if page.next_cursor is not None and page.items[-1][0]:
+        page.next_cursor = ARCHIVE_CURSOR_PREFIX + page.next_cursor
+    page.items = [PostView.from_row(row) for tier, row in page.items]
+    return page
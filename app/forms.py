@@ -3,7 +3,7 @@ from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextA
 from wtforms.validators import ValidationError, DataRequired, Email, EqualTo
 from wtforms.validators import DataRequired, Length
 
-from app.models import User
+from app import names
 
 
 class RegistrationForm(FlaskForm):
@@ -20,16 +20,14 @@ class RegistrationForm(FlaskForm):
         """
         Ensuring unqiue username
         """
-        user = User.query.filter_by(username=username.data).first()
-        if user is not None:
+        if names.taken('username', username.data):
             raise ValidationError('Please provide a different username')
 
     def validate_email(self, email):
         """
         Ensuring unqiue email
         """
-        user = User.query.filter_by(email=email.data).first()
-        if user is not None:
+        if names.taken('email', email.data):
             raise ValidationError('Please provide a different email address')
 
 
@@ -62,10 +60,8 @@ class EditProfileForm(FlaskForm):
         """
         Checks if the new username does not already exist in the database
         """
-        if username.data != self.current_username:
-            user = User.query.filter_by(username=self.username.data).first()
-            if user is not None:
-                raise ValidationError('Please use a different username.')
+        if username.data != self.current_username and names.taken('username', username.data):
+            raise ValidationError('Please use a different username.')
 
 
 class FollowForm(FlaskForm):
@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import threading
+from time import time
+from hashlib import md5
+
+from flask import current_app
+from markupsafe import Markup
+
+from app.cache import TTLCache
+
+
+class MemoryBackend(object):
+    """
+    Fragments kept in this process, least recently used evicted first
+    """
+    def __init__(self, maxsize):
+        self.cache = TTLCache(maxsize)
+
+    def get_many(self, keys):
+        """
+        Mapping of the keys found to their fragment
+        """
+        found = {}
+        for key in keys:
+            value = self.cache.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set_many(self, mapping):
+        """
+        Store fragments by key
+        """
+        for key, value in mapping.items():
+            self.cache.set(key, value)
+
+    def clear(self):
+        """
+        Drop every fragment
+        """
+        self.cache.clear()
+
+
+class SqliteBackend(object):
+    """
+    Fragments kept in a local SQLite file shared by every worker of a host.
+
+    Reads refresh an entry recency at most once a minute, writes trim the
+    least recently used entries beyond maxsize. Connections are opened on
+    first use by each thread of each process, so workers forked after
+    create_app never share one.
+    """
+    TOUCH_AFTER = 60
+
+    def __init__(self, path, maxsize):
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connect(self):
+        """
+        Connection of the calling thread, opened by the process using it
+        """
+        pid = os.getpid()
+        connection = getattr(self._local, 'connection', None)
+        # a forked child sees the thread locals of the thread that forked it
+        if connection is None or self._local.pid != pid:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            with connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS fragment '
+                    '(key TEXT PRIMARY KEY, value TEXT NOT NULL, used REAL NOT NULL)')
+                connection.execute('CREATE INDEX IF NOT EXISTS ix_fragment_used ON fragment (used)')
+            self._local.connection, self._local.pid = connection, pid
+        return connection
+
+    def get_many(self, keys):
+        """
+        Mapping of the keys found to their fragment
+        """
+        if not keys:
+            return {}
+        connection = self._connect()
+        rows = connection.execute('SELECT key, value, used FROM fragment WHERE key IN ({})'.format(
+            ', '.join('?' * len(keys))), list(keys)).fetchall()
+        now = time()
+        stale = [(now, key) for key, value, used in rows if now - used > self.TOUCH_AFTER]
+        if stale:
+            with connection:
+                connection.executemany('UPDATE fragment SET used = ? WHERE key = ?', stale)
+        return {key: value for key, value, used in rows}
+
+    def set_many(self, mapping):
+        """
+        Store fragments by key
+        """
+        if not mapping:
+            return
+        now = time()
+        connection = self._connect()
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO fragment (key, value, used) '
+                'VALUES (?, ?, ?)', [(key, value, now) for key, value in mapping.items()])
+            self._writes += len(mapping)
+            if self._writes >= max(self.maxsize // 100, 1):
+                self._writes = 0
+                connection.execute('DELETE FROM fragment WHERE key IN (SELECT key FROM fragment '
+                    'ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def clear(self):
+        """
+        Drop every fragment
+        """
+        connection = self._connect()
+        with connection:
+            connection.execute('DELETE FROM fragment')
+
+
+class FragmentCache(object):
+    """
+    Cache of rendered _post.html snippets.
+
+    A fragment is keyed by the post id and a digest of the author fields it
+    shows, so renaming a user retires its cached posts without a purge, and
+    by a digest of the template source so deploys never serve old markup.
+    """
+    template_name = '_post.html'
+
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Pick the backend from configuration and expose render_posts to templates
+        """
+        app.config.setdefault('FRAGMENT_CACHE_BACKEND', 'memory')
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 10000)
+        app.config.setdefault('FRAGMENT_CACHE_PATH', os.path.join(app.instance_path, 'fragments.db'))
+        app.extensions['fragment_cache'] = self
+        self.app = app
+        backend = app.config['FRAGMENT_CACHE_BACKEND']
+        if backend == 'memory':
+            self.backend = MemoryBackend(app.config['FRAGMENT_CACHE_SIZE'])
+        elif backend == 'sqlite':
+            self.backend = SqliteBackend(app.config['FRAGMENT_CACHE_PATH'],
+                app.config['FRAGMENT_CACHE_SIZE'])
+        else:
+            self.backend = None
+        source = app.jinja_env.loader.get_source(app.jinja_env, self.template_name)[0]
+        self.template_version = md5(source.encode('utf-8')).hexdigest()[:8]
+        app.jinja_env.globals['render_posts'] = self.render_posts
+        metrics = app.extensions.get('metrics')
+        if metrics is not None:
+            metrics.register_collector(self.expose)
+
+    def key(self, post):
+        """
+        Cache key of the fragment of post
+        """
+        author = post.author
+        author_version = md5('{}\0{}'.format(author.username, author.email).encode('utf-8'))
+        return 'post:{}:{}:{}'.format(self.template_version, post.id, author_version.hexdigest()[:12])
+
+    def render_posts(self, posts):
+        """
+        Concatenated fragments of posts, rendering and storing the missing ones
+        """
+        template = current_app.jinja_env.get_template(self.template_name)
+        if self.backend is None:
+            return Markup(''.join(template.render(post=post) for post in posts))
+        keys = [self.key(post) for post in posts]
+        cached = self.backend.get_many(keys)
+        rendered = {}
+        for key, post in zip(keys, posts):
+            if key not in cached:
+                rendered[key] = template.render(post=post)
+        self.backend.set_many(rendered)
+        self.hits += len(keys) - len(rendered)
+        self.misses += len(rendered)
+        cached.update(rendered)
+        return Markup(''.join(cached[key] for key in keys))
+
+    def clear(self):
+        """
+        Drop every cached fragment
+        """
+        if self.backend is not None:
+            self.backend.clear()
+
+    def expose(self):
+        """
+        Hit and miss counters in the Prometheus text exposition format
+        """
+        return ['# HELP infographics_fragment_cache_hits_total Post fragments served from cache',
+            '# TYPE infographics_fragment_cache_hits_total counter',
+            'infographics_fragment_cache_hits_total {}'.format(self.hits),
+            '# HELP infographics_fragment_cache_misses_total Post fragments rendered',
+            '# TYPE infographics_fragment_cache_misses_total counter',
+            'infographics_fragment_cache_misses_total {}'.format(self.misses)]
@@ -0,0 +1,92 @@
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.cache import TTLCache
+
+
+class IdentityCache(object):
+    """
+    Per process cache of the users Flask-Login rebuilds current_user from.
+
+    Cached users are detached snapshots, each request gets its own session
+    bound copy through merge(load=False) so no SELECT is issued on a hit.
+    Users are evicted when a flush changes them, in this process; other
+    workers see the change once their entry expires.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self.cache = TTLCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Size cache from configuration and watch sessions for user changes
+        """
+        app.config.setdefault('IDENTITY_CACHE_SIZE', 1024)
+        app.config.setdefault('IDENTITY_CACHE_TTL', 60)
+        app.extensions['identity_cache'] = self
+        self.app = app
+        self.cache = TTLCache(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL'])
+        for name, listener in (('after_flush', self._after_flush),
+                ('after_commit', self._after_commit)):
+            if not event.contains(Session, name, listener):
+                event.listen(Session, name, listener)
+        metrics = app.extensions.get('metrics')
+        if metrics is not None:
+            metrics.register_collector(self.expose)
+
+    def load(self, user_id, loader):
+        """
+        Session bound user user_id, from the cache or else from loader
+        """
+        if not self.app.config['IDENTITY_CACHE_TTL']:
+            return loader(user_id)
+        user = self.cache.get(user_id)
+        if user is None:
+            user = loader(user_id)
+            if user is None:
+                return None
+            db.session.expunge(user)
+            self.cache.set(user_id, user)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, *user_ids):
+        """
+        Drop cached users
+        """
+        for user_id in user_ids:
+            self.cache.delete(user_id)
+
+    def clear(self):
+        """
+        Drop every cached user
+        """
+        self.cache.clear()
+
+    def _after_flush(self, session, flush_context):
+        changed = [obj.id for obj in session.dirty.union(session.deleted)
+            if isinstance(obj, UserMixin)]
+        if changed:
+            self.invalidate(*changed)
+            # evict again once committed in case a request cached the old row meanwhile
+            session.info.setdefault('identity_cache_evict', set()).update(changed)
+
+    def _after_commit(self, session):
+        self.invalidate(*session.info.pop('identity_cache_evict', ()))
+
+    def expose(self):
+        """
+        Hit and miss counters in the Prometheus text exposition format
+        """
+        return ['# HELP infographics_identity_cache_hits_total Users loaded from the identity cache',
+            '# TYPE infographics_identity_cache_hits_total counter',
+            'infographics_identity_cache_hits_total {}'.format(self.cache.hits),
+            '# HELP infographics_identity_cache_misses_total Users loaded from the database',
+            '# TYPE infographics_identity_cache_misses_total counter',
+            'infographics_identity_cache_misses_total {}'.format(self.cache.misses),
+            '# HELP infographics_identity_cache_size Users held in the identity cache',
+            '# TYPE infographics_identity_cache_size gauge',
+            'infographics_identity_cache_size {}'.format(len(self.cache))]
@@ -0,0 +1,251 @@
+import os
+import copy
+import json
+import queue
+import atexit
+import logging
+import threading
+from time import monotonic
+from datetime import datetime, timezone
+from logging.handlers import MemoryHandler
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from logging.handlers import SMTPHandler
+from logging.handlers import RotatingFileHandler
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, tracebacks included as text
+    """
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'path': record.pathname,
+            'line': record.lineno,
+            'thread': record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class PicklableQueueHandler(QueueHandler):
+    """
+    QueueHandler that keeps the message template and traceback text.
+
+    The stock handler flattens records into their formatted message, which
+    leaves nothing to deduplicate on or to structure downstream.
+    """
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.template = str(record.msg)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.stack_info = None
+        return record
+
+    def enqueue(self, record):
+        """
+        Drop records rather than block when the listener falls behind
+        """
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class TimedMemoryHandler(MemoryHandler):
+    """
+    MemoryHandler also flushing when its oldest record has waited interval seconds.
+
+    A timer started by the first buffered record flushes once the interval
+    is over, so a lone record is written even if nothing is logged after it.
+    """
+    def __init__(self, capacity, interval, flushLevel=logging.ERROR, target=None):
+        super().__init__(capacity, flushLevel, target)
+        self.interval = interval
+        self.oldest = None
+        self.timer = None
+
+    def shouldFlush(self, record):
+        if self.oldest is None:
+            self.oldest = monotonic()
+            self.timer = threading.Timer(self.interval, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+        return super().shouldFlush(record) or monotonic() - self.oldest >= self.interval
+
+    def _cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = None
+
+    def flush(self):
+        self.acquire()
+        try:
+            super().flush()
+            self.oldest = None
+            self._cancel()
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            self._cancel()
+        finally:
+            self.release()
+        super().close()
+
+
+class BatchingSMTPHandler(SMTPHandler):
+    """
+    SMTPHandler sending one digest per window instead of one mail per record.
+
+    Records logged from the same place with the same message template are
+    counted once, the digest shows the first occurrence of each. smtplib
+    is imported by the first digest.
+    """
+    def __init__(self, *args, window=60, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.window = window
+        self.pending = {}
+        self.timer = None
+
+    def emit(self, record):
+        key = (record.levelno, record.pathname, record.lineno,
+            getattr(record, 'template', record.msg))
+        self.acquire()
+        try:
+            if key in self.pending:
+                self.pending[key][1] += 1
+            else:
+                self.pending[key] = [record, 1]
+            if self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        finally:
+            self.release()
+
+    def compose(self, batch):
+        """
+        Digest message of (record, count) pairs
+        """
+        import email.utils
+        from email.message import EmailMessage
+        message = EmailMessage()
+        message['From'] = self.fromaddr
+        message['To'] = ','.join(self.toaddrs)
+        total = sum(count for record, count in batch)
+        message['Subject'] = '{} ({} errors)'.format(self.subject, total)
+        message['Date'] = email.utils.localtime()
+        message.set_content('\n\n'.join('{}x {}'.format(count, self.format(record))
+            for record, count in batch))
+        return message
+
+    def send(self, message):
+        import smtplib
+        port = self.mailport or smtplib.SMTP_PORT
+        with smtplib.SMTP(self.mailhost, port, timeout=self.timeout) as smtp:
+            if self.username:
+                if self.secure is not None:
+                    smtp.ehlo()
+                    smtp.starttls(*self.secure)
+                    smtp.ehlo()
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+    def flush(self):
+        """
+        Send the digest of the records of the current window
+        """
+        self.acquire()
+        try:
+            batch = list(self.pending.values())
+            self.pending.clear()
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = None
+        finally:
+            self.release()
+        if batch:
+            try:
+                self.send(self.compose(batch))
+            except Exception:
+                self.handleError(batch[0][0])
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+def configure_logging(app):
+    """
+    Route application logs through a queue to mail and file handlers on a listener thread
+    """
+    app.config.setdefault('LOG_DIR', 'logs')
+    app.config.setdefault('LOG_QUEUE_SIZE', 10000)
+    app.config.setdefault('LOG_FILE_MAX_BYTES', 10 * 1024 * 1024)
+    app.config.setdefault('LOG_FILE_BACKUP_COUNT', 10)
+    app.config.setdefault('LOG_BUFFER_CAPACITY', 100)
+    app.config.setdefault('LOG_FLUSH_INTERVAL', 5)
+    app.config.setdefault('ERROR_MAIL_WINDOW', 60)
+    handlers = []
+    if app.config['MAIL_SERVER']:
+        auth = None
+        if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
+            auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
+        secure = None
+        if app.config['MAIL_USE_TLS']:
+            secure = ()
+        mail_handler = BatchingSMTPHandler(
+            mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
+            fromaddr='no-reply@' + app.config['MAIL_SERVER'],
+            toaddrs=app.config['ADMINS'], subject='Infographics Failure',
+            credentials=auth, secure=secure, window=app.config['ERROR_MAIL_WINDOW'])
+        mail_handler.setLevel(logging.ERROR)
+        handlers.append(mail_handler)
+
+    os.makedirs(app.config['LOG_DIR'], exist_ok=True)
+    file_handler = RotatingFileHandler(os.path.join(app.config['LOG_DIR'], 'infographics.log'),
+        maxBytes=app.config['LOG_FILE_MAX_BYTES'],
+        backupCount=app.config['LOG_FILE_BACKUP_COUNT'])
+    file_handler.setFormatter(JsonFormatter())
+    buffered = TimedMemoryHandler(app.config['LOG_BUFFER_CAPACITY'],
+        app.config['LOG_FLUSH_INTERVAL'], target=file_handler)
+    buffered.setLevel(logging.INFO)
+    handlers.append(buffered)
+
+    listener = QueueListener(queue.Queue(app.config['LOG_QUEUE_SIZE']), *handlers,
+        respect_handler_level=True)
+    queue_handler = PicklableQueueHandler(listener.queue)
+    queue_handler.setLevel(logging.INFO)
+    app.logger.addHandler(queue_handler)
+    app.logger.setLevel(logging.INFO)
+    listener.start()
+    app.extensions['log_listener'] = listener
+
+    def stop():
+        """
+        Write out every queued and buffered record, then close the handlers
+        """
+        atexit.unregister(stop)
+        listener.stop()
+        buffered.flush()
+        for handler in handlers:
+            handler.close()
+        # closing the buffer leaves its target open
+        file_handler.close()
+    atexit.register(stop)
+    app.extensions['log_shutdown'] = stop
+    return listener
@@ -0,0 +1,187 @@
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+from flask import g
+from flask import request
+from flask import Response
+from flask import has_app_context
+from flask import template_rendered
+from flask import before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds of histogram buckets, Prometheus client defaults for timings
+SECONDS_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class Histogram(object):
+    """
+    Prometheus style histogram with one series per endpoint
+    """
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        """
+        Record value for endpoint
+        """
+        with self._lock:
+            series = self._series.get(endpoint)
+            if series is None:
+                # one slot per bucket, +Inf, sum
+                series = self._series[endpoint] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def expose(self):
+        """
+        Text exposition lines of the histogram
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted((endpoint, list(values)) for endpoint, values in self._series.items())
+        for endpoint, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append('{}_bucket{{endpoint="{}",le="{}"}} {}'.format(
+                    self.name, endpoint, bound, cumulative))
+            lines.append('{}_sum{{endpoint="{}"}} {}'.format(self.name, endpoint, values[-1]))
+            lines.append('{}_count{{endpoint="{}"}} {}'.format(self.name, endpoint, cumulative))
+        return lines
+
+
+class RequestStats(object):
+    """
+    Costs accumulated while serving one request
+    """
+    __slots__ = ('start', 'queries', 'sql_time', 'render_time', 'render_start', 'render_depth')
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self.render_start = 0.0
+        self.render_depth = 0
+
+
+def _request_stats():
+    """
+    Stats of the request being served, None outside of requests
+    """
+    if has_app_context():
+        return g.get('_request_stats')
+    return None
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info['query_start_time'].pop()
+    stats = _request_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_time += elapsed
+
+def _before_render_template(sender, template, context, **extra):
+    stats = _request_stats()
+    if stats is not None:
+        # nested renders are already covered by the outermost one
+        if stats.render_depth == 0:
+            stats.render_start = perf_counter()
+        stats.render_depth += 1
+
+def _template_rendered(sender, template, context, **extra):
+    stats = _request_stats()
+    if stats is not None and stats.render_depth:
+        stats.render_depth -= 1
+        if stats.render_depth == 0:
+            stats.render_time += perf_counter() - stats.render_start
+
+
+class Metrics(object):
+    """
+    Per endpoint request, SQL and template costs exposed at /metrics.
+
+    Figures are kept per process, Prometheus sums them across workers.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self.request_duration = Histogram('infographics_request_duration_seconds',
+            'Wall time spent serving requests', SECONDS_BUCKETS)
+        self.sql_queries = Histogram('infographics_request_sql_queries',
+            'SQL statements executed per request', COUNT_BUCKETS)
+        self.sql_duration = Histogram('infographics_request_sql_duration_seconds',
+            'Time spent in SQL statements per request', SECONDS_BUCKETS)
+        self.render_duration = Histogram('infographics_request_render_duration_seconds',
+            'Time spent rendering templates per request', SECONDS_BUCKETS)
+        self.collectors = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Hook instrumentation into the application request lifecycle
+        """
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('SLOW_REQUEST_THRESHOLD', 1.0)
+        app.extensions['metrics'] = self
+        self.app = app
+        if not app.config['METRICS_ENABLED']:
+            return
+        for name, listener in (('before_cursor_execute', _before_cursor_execute),
+                ('after_cursor_execute', _after_cursor_execute)):
+            if not event.contains(Engine, name, listener):
+                event.listen(Engine, name, listener)
+        before_render_template.connect(_before_render_template, app)
+        template_rendered.connect(_template_rendered, app)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.expose)
+
+    def register_collector(self, collector):
+        """
+        Add a callable returning more exposition lines to /metrics
+        """
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def _start_request(self):
+        g._request_stats = RequestStats()
+
+    def _finish_request(self, response):
+        stats = g.pop('_request_stats', None)
+        if stats is None:
+            return response
+        wall_time = perf_counter() - stats.start
+        endpoint = request.endpoint or 'unmatched'
+        self.request_duration.observe(endpoint, wall_time)
+        self.sql_queries.observe(endpoint, stats.queries)
+        self.sql_duration.observe(endpoint, stats.sql_time)
+        self.render_duration.observe(endpoint, stats.render_time)
+        if wall_time > self.app.config['SLOW_REQUEST_THRESHOLD']:
+            self.app.logger.warning(
+                'Slow request %s %s: %.3fs, %d queries in %.3fs, rendered in %.3fs',
+                request.method, request.full_path, wall_time, stats.queries,
+                stats.sql_time, stats.render_time)
+        return response
+
+    def expose(self):
+        """
+        Metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for histogram in (self.request_duration, self.sql_queries,
+                self.sql_duration, self.render_duration):
+            lines.extend(histogram.expose())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -1,11 +1,22 @@
+import re
 from hashlib import md5
 from datetime import datetime
 from flask_login import UserMixin
-from werkzeug.security import check_password_hash
-from werkzeug.security import generate_password_hash
 
 from app import db
 from app import login
+from app import identities
+from app import passwords
+from app.database import insert_ignore, insert_ignore_select
+
+def gravatar(email, size):
+    """
+    Gravatar image url of an email address
+    """
+    hashdigest = md5(email.lower().encode('utf-8')).hexdigest()
+    return 'https://www.gravatar.com/avatar/{}?d=identicon&s={}'.format(
+        hashdigest, size
+    )
 
 # User and Post association Table
 follows = db.Table(
@@ -25,6 +36,11 @@ class User(UserMixin, db.Model):
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     about_me = db.Column(db.String(140))
     last_seen = db.Column(db.DateTime, default=datetime.utcnow())
+    profile_updated = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    followers_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # bumped by every change of the users followed, unlike following_count
+    follows_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     followed = db.relationship('User', secondary=follows, lazy='dynamic',
         primaryjoin=(follows.c.follower_id == id), secondaryjoin=(follows.c.followed_id == id),
         backref=db.backref('followers', lazy='dynamic'))
@@ -33,43 +49,121 @@ class User(UserMixin, db.Model):
         """
         Hash user password
         """
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash(password)
 
     def check_password(self, password):
         """
         Validate user password
         """
-        return check_password_hash(self.password_hash, password)
+        return passwords.check(self.password_hash, password)
+
+    def upgrade_password(self, password):
+        """
+        Rehash a verified password made with outdated parameters, True if it was
+        """
+        if not passwords.needs_rehash(self.password_hash):
+            return False
+        self.set_password(password)
+        return True
 
     def avatar(self, size):
         """
         User profile image
         """
-        hashdigest = md5(self.email.lower().encode('utf-8')).hexdigest()
-        return 'https://www.gravatar.com/avatar/{}?d=identicon&s={}'.format(
-            hashdigest, size
-        )
+        return gravatar(self.email, size)
 
     def follow(self, user):
         """
-        Adds user to instance followed list
+        Adds user to instance followed list and backfills instance timeline,
+        True if instance did not follow user yet
         """
-        if not self.following(user):
-            self.followed.append(user)
+        # the primary key of follows ignores a second follow, no check needed
+        if not insert_ignore(db.session, follows, [{'follower_id': self.id,
+                'followed_id': user.id}]):
+            return False
+        User.count_follows(self, [user], 1)
+        db.session.execute(Timeline.backfill_statement(self.id, user.id))
+        return True
 
     def unfollow(self, user):
         """
-        Removes user from instance follwed list
+        Removes user from instance follwed list and prunes instance timeline,
+        True if instance followed user
+        """
+        result = db.session.execute(db.delete(follows).where(
+            follows.c.follower_id == self.id, follows.c.followed_id == user.id))
+        if not result.rowcount:
+            return False
+        User.count_follows(self, [user], -1)
+        db.session.execute(Timeline.prune_statement(self.id, user.id))
+        return True
+
+    def follow_many(self, user_ids, batch_size=500):
+        """
+        Follows every user of user_ids in batches of batch_size, in the
+        transaction of the caller, returns the ids newly followed
+        """
+        followed = []
+        for start in range(0, len(user_ids), batch_size):
+            batch = set(user_ids[start:start + batch_size]) - {self.id}
+            # one primary key range lookup for the users already followed
+            batch -= {id for id, in db.session.query(follows.c.followed_id).filter(
+                follows.c.follower_id == self.id, follows.c.followed_id.in_(batch))}
+            if not batch:
+                continue
+            batch = sorted(batch)
+            insert_ignore(db.session, follows,
+                [{'follower_id': self.id, 'followed_id': id} for id in batch])
+            User.count_follows(self, batch, 1)
+            db.session.execute(Timeline.backfill_statement(self.id, *batch))
+            followed += batch
+        return followed
+
+    @staticmethod
+    def count_follows(follower, followed, step):
+        """
+        Moves the following counter of follower and the followers counter of
+        every followed user or id by step, and bumps the follows version of
+        follower, in one UPDATE
         """
-        if self.following(user):
-            self.followed.remove(user)
+        # counters are incremented by the UPDATE itself, never read-modify-write
+        ids = [getattr(user, 'id', user) for user in followed]
+        db.session.execute(db.update(User).where(User.id.in_([follower.id] + ids)).values(
+            following_count=User.following_count + db.case(
+                (User.id == follower.id, step * len(ids)), else_=0),
+            follows_version=User.follows_version + db.case(
+                (User.id == follower.id, 1), else_=0),
+            followers_count=User.followers_count + db.case(
+                (User.id.in_(ids), step), else_=0)).execution_options(synchronize_session=False))
+        # loaded and cached copies read the new counters on next use
+        for user in [follower] + [user for user in followed if isinstance(user, User)]:
+            if user in db.session:
+                db.session.expire(user, ['following_count', 'follows_version', 'followers_count'])
+        identities.invalidate(follower.id, *ids)
 
     def following(self, user):
         """
-        Checks if instance is following user
+        Checks if instance is following user, one primary key lookup
         """
-        return self.followed.filter(
-            follows.c.followed_id == user.id).count() > 0
+        return db.session.query(db.exists().where(
+            follows.c.follower_id == self.id, follows.c.followed_id == user.id)).scalar()
+
+    @staticmethod
+    def reconcile_follow_counts():
+        """
+        Recomputes every user follower and following counters from follows,
+        returns the number of users whose counters were off
+        """
+        followers = db.select(db.func.count()).where(
+            follows.c.followed_id == User.id).scalar_subquery()
+        following = db.select(db.func.count()).where(
+            follows.c.follower_id == User.id).scalar_subquery()
+        result = db.session.execute(db.update(User).where(db.or_(
+            User.followers_count != followers, User.following_count != following)).values(
+            followers_count=followers, following_count=following).execution_options(
+            synchronize_session=False))
+        db.session.commit()
+        return result.rowcount
 
     def followed_posts(self):
         """
@@ -80,6 +174,13 @@ class User(UserMixin, db.Model):
         instance_posts = Post.query.filter_by(user_id = self.id)
         return followed_posts.union(instance_posts).order_by(Post.timestamp.desc())
 
+    def timeline(self):
+        """
+        Posts of the instance materialized home timeline
+        """
+        return Post.query.join(Timeline, Timeline.post_id == Post.id).filter(
+            Timeline.owner_id == self.id).order_by(Timeline.timestamp.desc())
+
     def __repr__(self):
         """
         Representaion of a User instance
@@ -96,6 +197,45 @@ class Post(db.Model):
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
+    __table_args__ = (
+        db.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp'),
+        # since_id polls of one author
+        db.Index('ix_post_user_id_id', 'user_id', 'id'),
+    )
+
+    @staticmethod
+    def match_expression(text):
+        """
+        FTS5 query matching every word of text, None when it has no words
+        """
+        words = re.findall(r'\w+', text or '')
+        if not words:
+            return None
+        # quoted words can not be parsed as FTS5 operators
+        return ' '.join('"{}"'.format(word) for word in words)
+
+    @staticmethod
+    def search(text):
+        """
+        Posts matching every word of text, best ranked first
+        """
+        expression = Post.match_expression(text)
+        if expression is None:
+            return Post.query.filter(db.false())
+        return Post.query.join(post_fts, post_fts.c.rowid == Post.id).filter(
+            post_fts.c.post_fts.match(expression)).order_by(post_fts.c.rank, Post.id)
+
+    @staticmethod
+    def reindex_search():
+        """
+        Rebuild the full-text index from the post table
+        """
+        db.session.execute(db.text(POST_FTS_TABLE))
+        for trigger in POST_FTS_TRIGGERS:
+            db.session.execute(db.text(trigger))
+        db.session.execute(db.text("INSERT INTO post_fts(post_fts) VALUES ('rebuild')"))
+        db.session.commit()
+
     def __repr__(self):
         """
         Representaion of a Post instance
@@ -103,6 +243,184 @@ class Post(db.Model):
         return '<Post {}>'.format(self.body)
 
 
+class PostArchive(db.Model):
+    """
+    Posts moved out of the post table once older than the archive horizon
+    """
+    __tablename__ = 'post_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    body = db.Column(db.String(140))
+    timestamp = db.Column(db.DateTime, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+    __table_args__ = (
+        db.Index('ix_post_archive_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+    def __repr__(self):
+        """
+        Representaion of a PostArchive instance
+        """
+        return '<PostArchive {}>'.format(self.body)
+
+
+class Tag(db.Model):
+    """
+    Hashtag written in at least one post, lowercase without the #
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), index=True, unique=True)
+
+    def __repr__(self):
+        """
+        Representaion of a Tag instance
+        """
+        return '<Tag {}>'.format(self.name)
+
+# Post and Tag association Table
+post_tag = db.Table(
+    'post_tag',
+    db.Column('post_id', db.Integer, db.ForeignKey('post.id'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    # posts of a tag
+    db.Index('ix_post_tag_tag_id_post_id', 'tag_id', 'post_id'),
+)
+
+
+class TagCount(db.Model):
+    """
+    Posts written with a tag during one bucket of span seconds
+    """
+    __tablename__ = 'tag_count'
+    # primary key order serves the range scan of a trending window
+    span = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), primary_key=True,
+        autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        """
+        Representaion of a TagCount instance
+        """
+        return '<TagCount {} {} {}>'.format(self.tag_id, self.span, self.bucket)
+
+
+class Suggestion(db.Model):
+    """
+    Users suggested to follow, ranked by the followed users following them
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True,
+        autoincrement=False)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    suggested_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+
+    @staticmethod
+    def for_user(user_id):
+        """
+        (username, score) of the suggestions of user_id it does not follow yet, best first
+        """
+        suggested = db.aliased(User)
+        return db.session.query(suggested.username, Suggestion.score).join(
+            suggested, suggested.id == Suggestion.suggested_id).filter(
+            Suggestion.user_id == user_id, ~db.exists().where(
+                follows.c.follower_id == user_id,
+                follows.c.followed_id == Suggestion.suggested_id)).order_by(Suggestion.rank)
+
+    def __repr__(self):
+        """
+        Representaion of a Suggestion instance
+        """
+        return '<Suggestion {} {}>'.format(self.user_id, self.suggested_id)
+
+
+# Full-text index of Post.body, an SQLite FTS5 external content table kept
+# in sync by triggers. It lives outside of db.metadata so create_all and
+# autogenerate leave it alone, the DDL below is attached to the post table.
+POST_FTS_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts "
+    "USING fts5(body, content='post', content_rowid='id')")
+POST_FTS_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN "
+    "INSERT INTO post_fts(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, body) VALUES ('delete', old.id, old.body); END",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF body ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, body) VALUES ('delete', old.id, old.body); "
+    "INSERT INTO post_fts(rowid, body) VALUES (new.id, new.body); END",
+)
+
+post_fts = db.Table(
+    'post_fts', db.MetaData(),
+    db.Column('rowid', db.Integer, primary_key=True),
+    db.Column('post_fts', db.String),
+    db.Column('body', db.String),
+    db.Column('rank', db.Float),
+)
+
+for ddl in (POST_FTS_TABLE,) + POST_FTS_TRIGGERS:
+    db.event.listen(Post.__table__, 'after_create', db.DDL(ddl).execute_if(dialect='sqlite'))
+db.event.listen(Post.__table__, 'before_drop',
+    db.DDL('DROP TABLE IF EXISTS post_fts').execute_if(dialect='sqlite'))
+
+
+class Timeline(db.Model):
+    """
+    Materialized home timeline, one row per post per reader
+    """
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    timestamp = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_timeline_owner_id_timestamp_post_id', 'owner_id', 'timestamp', 'post_id'),
+    )
+
+    @staticmethod
+    def insert_select(select_statement):
+        """
+        INSERT ... SELECT into the timeline, ignoring rows already present
+        """
+        return insert_ignore_select(db.session, Timeline.__table__,
+            ['owner_id', 'post_id', 'timestamp'], select_statement)
+
+    @staticmethod
+    def fan_out_statement(post_id):
+        """
+        Delivers a post to the timelines of its author followers
+        """
+        return Timeline.insert_select(
+            db.select(follows.c.follower_id, Post.id, Post.timestamp)
+            .join(Post, follows.c.followed_id == Post.user_id)
+            .where(Post.id == post_id))
+
+    @staticmethod
+    def backfill_statement(owner_id, *followed_ids):
+        """
+        Copies the posts of newly followed users into owner timeline
+        """
+        return Timeline.insert_select(
+            db.select(db.literal(owner_id), Post.id, Post.timestamp)
+            .where(Post.user_id.in_(followed_ids)))
+
+    @staticmethod
+    def prune_statement(owner_id, followed_id):
+        """
+        Removes the posts of an unfollowed user from owner timeline
+        """
+        return db.delete(Timeline).where(
+            Timeline.owner_id == owner_id,
+            Timeline.post_id.in_(db.select(Post.id).where(Post.user_id == followed_id))
+        ).execution_options(synchronize_session=False)
+
+    def __repr__(self):
+        """
+        Representaion of a Timeline entry
+        """
+        return '<Timeline {} {}>'.format(self.owner_id, self.post_id)
+
+
 @login.user_loader
 def loader_user(id):
-    return User.query.get(int(id))
+    return identities.load(int(id), User.query.get)
@@ -0,0 +1,101 @@
+from datetime import datetime
+
+from app import db
+
+# cursors look like 20221125173546107065_42, the sort value then the id
+CURSOR_TIMESTAMP_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(value, id):
+    """
+    Url safe cursor for a (sort value, id) key
+    """
+    if isinstance(value, datetime):
+        value = value.strftime(CURSOR_TIMESTAMP_FORMAT)
+    return '{}_{}'.format(value, id)
+
+def decode_cursor(cursor, sort_column):
+    """
+    (sort value, id) key of a cursor, None when missing or malformed
+    """
+    try:
+        value, id = cursor.split('_')
+        if isinstance(sort_column.type, db.DateTime):
+            value = datetime.strptime(value, CURSOR_TIMESTAMP_FORMAT)
+        else:
+            value = sort_column.type.python_type(value)
+        return value, int(id)
+    except (AttributeError, ValueError, NotImplementedError):
+        return None
+
+
+class KeysetPagination(object):
+    """
+    One page of a keyset paginated query
+    """
+    def __init__(self, items, has_prev, has_next, key):
+        self.items = items
+        self.prev_cursor = encode_cursor(*key(items[0])) if has_prev and items else None
+        self.next_cursor = encode_cursor(*key(items[-1])) if has_next and items else None
+
+    @property
+    def has_prev(self):
+        """
+        True if items precede this page
+        """
+        return self.prev_cursor is not None
+
+    @property
+    def has_next(self):
+        """
+        True if items follow this page
+        """
+        return self.next_cursor is not None
+
+
+def _beyond(sort_column, id_column, key, greater):
+    """
+    Criterion for rows past key in the given direction
+    """
+    value, id = key
+    if greater:
+        return db.or_(sort_column > value, db.and_(sort_column == value, id_column > id))
+    return db.or_(sort_column < value, db.and_(sort_column == value, id_column < id))
+
+def _ordered(sort_column, id_column, ascending):
+    if ascending:
+        return sort_column.asc(), id_column.asc()
+    return sort_column.desc(), id_column.desc()
+
+def keyset_rows(query, sort_column, id_column, limit, key=None, backward=False,
+        descending=True):
+    """
+    Up to limit rows of query following key, or preceding it when backward,
+    nearest to key first. Without key rows start at the matching end.
+    """
+    query = query.order_by(None)
+    # rows preceding key sort in the opposite direction
+    ascending = descending if backward else not descending
+    if key is not None:
+        query = query.filter(_beyond(sort_column, id_column, key, ascending))
+    return query.order_by(*_ordered(sort_column, id_column, ascending)).limit(limit).all()
+
+def paginate_keyset(query, sort_column, id_column, per_page,
+        before=None, after=None, key=None, descending=True):
+    """
+    Paginates query on (sort_column, id_column), newest first by default.
+
+    before selects the page following a cursor, after the page preceding
+    it. No COUNT is issued, one extra row is fetched to tell whether a
+    further page exists. key maps an item to its (sort value, id).
+    """
+    if key is None:
+        key = lambda item: (getattr(item, sort_column.key), item.id)
+    before, after = decode_cursor(before, sort_column), decode_cursor(after, sort_column)
+    if after is not None:
+        rows = keyset_rows(query, sort_column, id_column, per_page + 1, after,
+            backward=True, descending=descending)
+        return KeysetPagination(rows[:per_page][::-1], len(rows) > per_page, True, key)
+    rows = keyset_rows(query, sort_column, id_column, per_page + 1, before,
+        descending=descending)
+    return KeysetPagination(rows[:per_page], before is not None, len(rows) > per_page, key)
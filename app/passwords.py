@@ -0,0 +1,95 @@
+import os
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash
+from werkzeug.security import generate_password_hash
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+
+
+def normalized_method(method):
+    """
+    Method as werkzeug records it in a hash, pbkdf2 iterations included
+    """
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return '{}:{}'.format(method, DEFAULT_PBKDF2_ITERATIONS)
+    return method
+
+
+class PasswordHasher(object):
+    """
+    Password hashing in a bounded pool of worker processes.
+
+    Hashing is deliberately slow, running it out of the request thread keeps
+    a burst of logins from starving other requests of the interpreter. At
+    most PASSWORD_HASH_WORKERS hashes run at once, further callers queue
+    in arrival order. A pool size of 0 hashes inline.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Bind hasher to application and stop the pool on interpreter shutdown
+        """
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+        app.config.setdefault('PASSWORD_SALT_LENGTH', 16)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.extensions['passwords'] = self
+        self.app = app
+        atexit.register(self.shutdown)
+
+    def _pool(self):
+        """
+        Executor of this process, created on first use so forked workers get their own
+        """
+        workers = self.app.config['PASSWORD_HASH_WORKERS']
+        if not workers:
+            return None
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=workers)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, function, *args):
+        executor = self._pool()
+        if executor is None:
+            return function(*args)
+        return executor.submit(function, *args).result()
+
+    def hash(self, password):
+        """
+        Hash of password with the configured method
+        """
+        return self._run(generate_password_hash, password,
+            self.app.config['PASSWORD_HASH_METHOD'], self.app.config['PASSWORD_SALT_LENGTH'])
+
+    def check(self, password_hash, password):
+        """
+        True if password matches password_hash
+        """
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """
+        True if password_hash was made with other parameters than the configured ones
+        """
+        method, salt = password_hash.split('$')[:2]
+        return method != normalized_method(self.app.config['PASSWORD_HASH_METHOD']) \
+            or len(salt) != self.app.config['PASSWORD_SALT_LENGTH']
+
+    def shutdown(self):
+        """
+        Stop the worker processes of this process
+        """
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._pid = None
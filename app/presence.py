@@ -0,0 +1,111 @@
+import atexit
+import threading
+from datetime import datetime
+
+from app import db
+from app import identities
+from app.models import User
+
+
+class LastSeenBuffer(object):
+    """
+    Write-behind buffer for User.last_seen.
+
+    Requests only record the time in memory, a background thread writes
+    every pending value with one executemany UPDATE per flush interval.
+    The cached identities of the users written are dropped afterwards.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._stopped = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Bind buffer to application and flush it on interpreter shutdown
+        """
+        app.config.setdefault('LAST_SEEN_FLUSH_INTERVAL', 30)
+        app.config.setdefault('LAST_SEEN_THRESHOLD', 60)
+        app.extensions['last_seen'] = self
+        self.app = app
+        atexit.register(self.stop)
+
+    def touch(self, user, now=None):
+        """
+        Record that user was seen now if it moved past the threshold
+        """
+        now = now or datetime.utcnow()
+        with self._lock:
+            seen = self._pending.get(user.id)
+        if seen is None:
+            seen = user.last_seen
+        if seen is not None and \
+                (now - seen).total_seconds() < self.app.config['LAST_SEEN_THRESHOLD']:
+            return False
+        with self._lock:
+            self._pending[user.id] = now
+        self._start_flusher()
+        return True
+
+    def pending(self, user_id):
+        """
+        Last seen time of user not written to the database yet
+        """
+        with self._lock:
+            return self._pending.get(user_id)
+
+    def flush(self):
+        """
+        Write pending last seen times with a single bulk UPDATE
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        table = User.__table__
+        statement = table.update().where(table.c.id == db.bindparam('user_id')).values(
+            last_seen=db.bindparam('seen_at'))
+        with self.app.app_context():
+            try:
+                db.session.execute(statement, [{'user_id': user_id, 'seen_at': seen_at}
+                    for user_id, seen_at in pending.items()])
+                db.session.commit()
+                # the bulk UPDATE bypasses the flush events evicting changed users
+                identities.invalidate(*pending)
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception('Could not flush last seen of %d users', len(pending))
+                # keep values for the next flush unless newer ones arrived meanwhile
+                with self._lock:
+                    for user_id, seen_at in pending.items():
+                        self._pending.setdefault(user_id, seen_at)
+                return 0
+        return len(pending)
+
+    def _start_flusher(self):
+        """
+        Start the flush thread in this process, on first use so forked workers get their own
+        """
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._stopped.clear()
+                self._flusher = threading.Thread(
+                    target=self._run, name='last-seen-flusher', daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.app.config['LAST_SEEN_FLUSH_INTERVAL']):
+            self.flush()
+
+    def stop(self):
+        """
+        Stop the flush thread and write what is still pending
+        """
+        self._stopped.set()
+        self.flush()
@@ -0,0 +1,198 @@
+import os
+import sys
+import random
+import threading
+from time import perf_counter
+from datetime import datetime
+from collections import Counter
+
+from flask import g
+from flask import abort
+from flask import request
+from flask import current_app
+from flask import render_template
+from flask import send_from_directory
+from flask_login import current_user
+
+# profiles are asked for with this header or query argument set to 1
+TRIGGER_HEADER = 'X-Profile'
+TRIGGER_ARGUMENT = '_profile'
+PROFILE_SUFFIX = '.collapsed'
+
+
+def is_admin(user):
+    """
+    True if user is signed in with an address of ADMINS
+    """
+    admins = [address for address in current_app.config['ADMINS'] if address]
+    return user.is_authenticated and user.email in admins
+
+def collapse(frame):
+    """
+    Stack of frame, outermost first, as one line of the collapsed stack format
+    """
+    names = []
+    while frame is not None:
+        names.append('{}:{}'.format(frame.f_globals.get('__name__', '?'), frame.f_code.co_name))
+        frame = frame.f_back
+    # the format separates frames with ; and ends with the count after a space
+    return ';'.join(reversed(names)).replace(' ', '_')
+
+
+class StackSampler(object):
+    """
+    Counts the stacks of one thread, sampled every interval seconds from another.
+
+    The sampler needs the GIL to look, so it sees the thread at most once
+    per sys.getswitchinterval() while that thread runs Python code. This
+    is not free: each sample holds the GIL while sys._current_frames()
+    snapshots every thread and the stack is walked and formatted, and the
+    profiled request, like every other thread, waits for it. The cost grows
+    with the stack depth and the number of threads, and with the samples
+    taken, so a shorter interval slows the request more.
+    """
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+
+    def start(self):
+        self.started = perf_counter()
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            self.stacks[collapse(frame)] += 1
+
+    def stop(self):
+        """
+        Stop sampling, returns the stack counts
+        """
+        self._stopped.set()
+        self._thread.join()
+        self.elapsed = perf_counter() - self.started
+        return self.stacks
+
+
+class RequestProfiler(object):
+    """
+    Stack sampling profiles of live requests, written as collapsed stacks
+    that flamegraph.pl, speedscope or inferno read.
+
+    A request is profiled when an admin sends the X-Profile header or the
+    _profile query argument, or at random for PROFILER_SAMPLE_RATE of the
+    traffic. The sampler follows the request thread from the first before
+    request hook to teardown, view, SQL and template rendering included.
+    The newest PROFILER_KEEP profiles are kept in PROFILER_DIR and listed
+    at /admin/profiles. PROFILER_ENABLED is read on every request: while
+    it is off the hooks return at once and the routes answer 404.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Hook the sampler into the request lifecycle of app
+        """
+        app.config.setdefault('PROFILER_ENABLED', False)
+        app.config.setdefault('PROFILER_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILER_INTERVAL', 0.001)
+        app.config.setdefault('PROFILER_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.config.setdefault('PROFILER_KEEP', 50)
+        app.extensions['profiler'] = self
+        self.app = app
+        # first in line so the other before request hooks are profiled too
+        app.before_request_funcs.setdefault(None, []).insert(0, self._start)
+        app.after_request(self._tag)
+        app.teardown_request(self._finish)
+        app.add_url_rule('/admin/profiles', 'profiles', self.list_profiles)
+        app.add_url_rule('/admin/profiles/<name>', 'profile', self.download_profile)
+
+    def _wanted(self):
+        """
+        True if the request asked for a profile as an admin, or was sampled
+        """
+        rate = self.app.config['PROFILER_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            return True
+        if request.headers.get(TRIGGER_HEADER) == '1' or request.args.get(TRIGGER_ARGUMENT) == '1':
+            # only now is current_user loaded
+            return is_admin(current_user)
+        return False
+
+    @property
+    def enabled(self):
+        return self.app.config['PROFILER_ENABLED']
+
+    def _start(self):
+        if not self.enabled or request.endpoint in (None, 'static') or not self._wanted():
+            return
+        g._profile_name = '{:%Y%m%dT%H%M%S%f}_{}_{}{}'.format(datetime.utcnow(),
+            request.endpoint, os.getpid(), PROFILE_SUFFIX)
+        g._profile_sampler = StackSampler(threading.get_ident(),
+            self.app.config['PROFILER_INTERVAL'])
+        g._profile_sampler.start()
+
+    def _tag(self, response):
+        name = g.get('_profile_name')
+        if name is not None:
+            response.headers[TRIGGER_HEADER] = name
+        return response
+
+    def _finish(self, exception):
+        sampler = g.pop('_profile_sampler', None)
+        if sampler is None:
+            return
+        stacks = sampler.stop()
+        try:
+            self.write(g.pop('_profile_name'), stacks)
+        except OSError:
+            self.app.logger.exception('Could not write the profile of %s', request.full_path)
+        self.app.logger.info('Profiled %s %s: %d samples in %.3fs', request.method,
+            request.full_path, sum(stacks.values()), sampler.elapsed)
+
+    def profiles(self):
+        """
+        Profile file names, newest first
+        """
+        directory = self.app.config['PROFILER_DIR']
+        if not os.path.isdir(directory):
+            return []
+        return sorted((name for name in os.listdir(directory) if name.endswith(PROFILE_SUFFIX)),
+            reverse=True)
+
+    def write(self, name, stacks):
+        """
+        Write stacks as collapsed stack lines, then drop the oldest profiles past the limit
+        """
+        directory = self.app.config['PROFILER_DIR']
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, name), 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+        for old in self.profiles()[self.app.config['PROFILER_KEEP']:]:
+            os.remove(os.path.join(directory, old))
+
+    def list_profiles(self):
+        """
+        Recent profiles, for admins only
+        """
+        if not self.enabled or not is_admin(current_user):
+            abort(404)
+        return render_template('profiles.html', title='Profiles', profiles=self.profiles())
+
+    def download_profile(self, name):
+        """
+        One collapsed stack file, for admins only
+        """
+        if not self.enabled or not is_admin(current_user) or not name.endswith(PROFILE_SUFFIX):
+            abort(404)
+        return send_from_directory(self.app.config['PROFILER_DIR'], name,
+            mimetype='text/plain', as_attachment=True)
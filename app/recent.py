@@ -0,0 +1,179 @@
+import threading
+from time import monotonic
+
+from app import db
+from app.models import Post, PostArchive, User
+from app.feeds import explore_feed, PostView, ARCHIVE_CURSOR_PREFIX
+from app.pagination import decode_cursor, KeysetPagination
+
+
+def _key(post):
+    """
+    Explore sort key of a post, newest first when reversed
+    """
+    return (post.timestamp, post.id)
+
+
+class RecentPosts(object):
+    """
+    Newest RECENT_POSTS_SIZE posts of every user with their authors.
+
+    The first pages of explore are the same for every visitor, so they are
+    cut from this buffer without a query. Posts written in this process are
+    added once committed. Posts of other workers and profile edits are
+    picked up by a version query run at most every
+    RECENT_POSTS_CHECK_INTERVAL seconds.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self.hits = 0
+        self.misses = 0
+        # newest first tuple of PostView and whether it holds every post
+        self._buffer = None
+        # (newest id, newest timestamp, newest profile edit) of the buffer
+        self.version = None
+        self._checked_id = 0
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Bind buffer to application and its configuration
+        """
+        app.config.setdefault('RECENT_POSTS_SIZE', 200)
+        app.config.setdefault('RECENT_POSTS_CHECK_INTERVAL', 5)
+        app.extensions['recent_posts'] = self
+        self.app = app
+        metrics = app.extensions.get('metrics')
+        if metrics is not None:
+            metrics.register_collector(self.expose)
+
+    @property
+    def enabled(self):
+        return self.app.config['RECENT_POSTS_SIZE'] > 0
+
+    def refresh(self):
+        """
+        Version of the buffer, warming or updating it when the check interval elapsed
+        """
+        if self._buffer is not None and \
+                monotonic() - self._checked_at < self.app.config['RECENT_POSTS_CHECK_INTERVAL']:
+            return self.version
+        checked_at = monotonic()
+        newest_id, newest_timestamp, profile_updated, archived = db.session.query(
+            db.select(db.func.max(Post.id)).scalar_subquery(),
+            db.select(db.func.max(Post.timestamp)).scalar_subquery(),
+            db.select(db.func.max(User.profile_updated)).scalar_subquery(),
+            db.select(db.func.max(PostArchive.timestamp)).scalar_subquery()).one()
+        newest_id = newest_id or 0
+        # posts are only ever added, a rename changes the authors shown
+        reload = self._buffer is None or profile_updated != self.version[2]
+        if reload or newest_id > self._checked_id:
+            feed = explore_feed()
+            query = feed.query.order_by(None)
+            if not reload:
+                query = query.filter(feed.id_column > self._checked_id)
+            rows = query.order_by(feed.sort_column.desc(), feed.id_column.desc()).limit(
+                self.app.config['RECENT_POSTS_SIZE']).all()
+            # older explore pages go on in the archive
+            self._merge([PostView.from_row(row) for row in rows], reload, archived is not None)
+        with self._lock:
+            if archived is not None:
+                # hot posts as old as the archive are paged along with it
+                self._buffer = (tuple(post for post in self._buffer[0]
+                    if post.timestamp > archived), False)
+            self._checked_id = max(self._checked_id, newest_id)
+            self._checked_at = checked_at
+            self.version = (max(self.version[0], newest_id),
+                max(filter(None, (self.version[1], newest_timestamp)), default=None),
+                profile_updated)
+            return self.version
+
+    def _merge(self, posts, reload=False, archived=False):
+        """
+        Add posts to the buffer, or replace it, keeping the newest
+        """
+        size = self.app.config['RECENT_POSTS_SIZE']
+        with self._lock:
+            if reload or self._buffer is None:
+                complete = len(posts) < size and not archived
+                self.version = (0, None, None)
+            else:
+                known = {post.id for post in self._buffer[0]}
+                complete = self._buffer[1]
+                posts = list(self._buffer[0]) + [post for post in posts if post.id not in known]
+            posts.sort(key=_key, reverse=True)
+            self._buffer = (tuple(posts[:size]), complete and len(posts) <= size)
+
+    def add(self, post):
+        """
+        Add a PostView committed by this process
+        """
+        if self._buffer is None or not self.enabled:
+            return
+        self._merge([post])
+        with self._lock:
+            self.version = (max(self.version[0], post.id),
+                max(filter(None, (self.version[1], post.timestamp))), self.version[2])
+
+    def expire(self):
+        """
+        Check the version on next use, after a profile edit in this process
+        """
+        self._checked_at = 0
+
+    def clear(self):
+        """
+        Drop every post, the buffer is warmed again on next use
+        """
+        with self._lock:
+            self._buffer = None
+            self.version = None
+            self._checked_id = 0
+            self._checked_at = 0
+
+    def page(self, per_page, before=None, after=None):
+        """
+        Keyset page of explore cut from the buffer, None when it reaches past it
+        """
+        if not self.enabled:
+            return None
+        # pages of archived posts are older than any buffered one
+        if any(cursor and cursor.startswith(ARCHIVE_CURSOR_PREFIX) for cursor in (before, after)):
+            self.misses += 1
+            return None
+        self.refresh()
+        posts, complete = self._buffer
+        before = decode_cursor(before, Post.timestamp)
+        after = decode_cursor(after, Post.timestamp)
+        if after is not None:
+            newer = [post for post in posts if _key(post) > after]
+            # posts between the cursor and the oldest buffered one are unknown
+            if len(newer) == len(posts) and not complete:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return KeysetPagination(newer[-per_page:], len(newer) > per_page, True, _key)
+        start = 0
+        if before is not None:
+            start = next((i for i, post in enumerate(posts) if _key(post) < before), len(posts))
+        rows = posts[start:start + per_page + 1]
+        if len(rows) <= per_page and not complete:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return KeysetPagination(list(rows[:per_page]), before is not None,
+            len(rows) > per_page, _key)
+
+    def expose(self):
+        """
+        Hit and miss counters in the Prometheus text exposition format
+        """
+        return ['# HELP infographics_recent_posts_hits_total Explore pages served from memory',
+            '# TYPE infographics_recent_posts_hits_total counter',
+            'infographics_recent_posts_hits_total {}'.format(self.hits),
+            '# HELP infographics_recent_posts_misses_total Explore pages reaching past the buffer',
+            '# TYPE infographics_recent_posts_misses_total counter',
+            'infographics_recent_posts_misses_total {}'.format(self.misses)]
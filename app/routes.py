@@ -1,33 +1,49 @@
 from datetime import datetime
 from flask import flash
+from flask import Blueprint
 from flask import url_for
 from flask import request
 from flask import redirect
+from flask import Response
 from flask import render_template
+from flask import current_app
 from flask_login import login_user
 from flask_login import current_user
 from flask_login import logout_user
 from flask_login import login_required
 from werkzeug.urls import url_parse
+from sqlalchemy.exc import IntegrityError
 
-from app import app
 from app import db
-from app.models import User, Post
+from app import timelines
+from app import last_seen
+from app import broker
+from app import recent_posts
+from app import names
+from app import trending
+from app.api import dumps, post_event, serialize_posts
+from app.models import follows, User, Post, Suggestion
+from app.feeds import explore_feed, home_feed, paginate_feed, search_feed, user_feed
+from app.feeds import PostAuthor, PostView
+from app.trending import extract_tags, index_tags
+from app.conditional import conditional, explore_validators, index_validators, user_validators
 from app.forms import LoginForm, RegistrationForm, EditProfileForm, FollowForm, PostForm
 
+bp = Blueprint('main', __name__)
 
-@app.before_request
+
+@bp.before_app_request
 def before_request():
     """
-    Invoke before a request. Updates current_user user last seen
+    Invoke before a request. Records current_user last seen, written in batches
     """
-    if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+    if request.endpoint not in (None, 'static') and current_user.is_authenticated:
+        last_seen.touch(current_user)
 
-@app.route('/', methods=['GET', 'POST'])
-@app.route('/index', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
+@bp.route('/index', methods=['GET', 'POST'])
 @login_required
+@conditional(index_validators)
 def index():
     """
     Handles post creation and displays post associated with logged in user
@@ -36,95 +52,188 @@ def index():
     if form.validate_on_submit():
         post = Post(body=form.post.data, author=current_user)
         db.session.add(post)
+        db.session.flush()
+        post_id = post.id
+        tags = extract_tags(post.body)
+        if tags:
+            index_tags({post_id: tags})
+        event = post_event(post, current_user)
+        view = PostView(post_id, post.body, post.timestamp,
+            PostAuthor(current_user.id, current_user.username, current_user.email))
+        timelines.add_own_post(post)
         db.session.commit()
+        timelines.fan_out(post_id)
+        recent_posts.add(view)
+        trending.add(tags, view.timestamp)
+        broker.publish(event)
         flash('You have just created a new post!')
-        return redirect(url_for('index'))
-    page = request.args.get('page', 1, type=int)
-    posts = current_user.followed_posts().paginate(
-        page=page, per_page=app.config['POSTS_PER_PAGE'], error_out=False)
-    prev_page = url_for('index', page=posts.prev_num) if posts.has_prev else None
-    next_page = url_for('index', page=posts.next_num) if posts.has_next else None
+        return redirect(url_for('main.index'))
+    posts = paginate_feed(home_feed(current_user), current_app.config['POSTS_PER_PAGE'],
+        before=request.args.get('before'), after=request.args.get('after'))
+    prev_page = url_for('main.index', after=posts.prev_cursor) if posts.has_prev else None
+    next_page = url_for('main.index', before=posts.next_cursor) if posts.has_next else None
     return render_template('index.html', title='Home Page',
         posts=posts.items, form=form, prev_page=prev_page, next_page=next_page)
 
-@app.route('/explore')
+@bp.route('/explore')
 @login_required
+@conditional(explore_validators)
 def explore():
     """
-    Get access to all users
+    Get access to all users, the first pages come from the recent posts buffer
     """
-    page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=app.config['POSTS_PER_PAGE'], error_out=False)
-    prev_page = url_for('explore', page=posts.prev_num) if posts.has_prev else None
-    next_page = url_for('explore', page=posts.next_num) if posts.has_next else None
-    return render_template('index.html', title="Explore",
+    before, after = request.args.get('before'), request.args.get('after')
+    posts = recent_posts.page(current_app.config['POSTS_PER_PAGE'], before=before, after=after)
+    if posts is None:
+        posts = paginate_feed(explore_feed(), current_app.config['POSTS_PER_PAGE'],
+            before=before, after=after)
+    prev_page = url_for('main.explore', after=posts.prev_cursor) if posts.has_prev else None
+    next_page = url_for('main.explore', before=posts.next_cursor) if posts.has_next else None
+    return render_template('index.html', title="Explore", trending=trending.top(),
         posts=posts.items, prev_page=prev_page, next_page=next_page)
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/stream')
+@login_required
+def stream():
+    """
+    Server-Sent Events of new posts in the home timeline of current_user.
+
+    A reconnecting client sends the id of the last post it got as
+    Last-Event-ID and first receives the posts it missed, at most the
+    newest STREAM_QUEUE_SIZE like a full queue would keep. The generator
+    holds no database connection while it waits.
+    """
+    user_id = current_user.id
+    authors = [id for id, in db.session.query(follows.c.followed_id).filter(
+        follows.c.follower_id == user_id)]
+    # subscribe before reading the backlog so no post falls in between
+    subscriber = broker.subscribe(user_id, authors)
+    missed = []
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id.isdigit():
+        feed = home_feed(current_user)
+        try:
+            missed = serialize_posts(feed.query.order_by(None).filter(
+                feed.id_column > int(last_event_id)).order_by(feed.id_column.desc()).limit(
+                current_app.config['STREAM_QUEUE_SIZE']).all()[::-1])
+        except Exception:
+            broker.unsubscribe(subscriber)
+            raise
+    heartbeat = current_app.config['STREAM_HEARTBEAT']
+
+    def events():
+        try:
+            for post in missed:
+                yield 'id: {}\nevent: post\ndata: {}\n\n'.format(post['id'],
+                    dumps(post).decode('utf-8'))
+            caught_up = missed[-1]['id'] if missed else 0
+            while True:
+                pending = subscriber.get_all(heartbeat)
+                if not pending:
+                    yield ': keepalive\n\n'
+                for event in pending:
+                    # posts of the backlog may have been queued too
+                    if event['id'] > caught_up:
+                        yield 'id: {}\nevent: post\ndata: {}\n\n'.format(event['id'], event['data'])
+        finally:
+            broker.unsubscribe(subscriber)
+
+    return Response(events(), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/search')
+@login_required
+def search():
+    """
+    Full-text search over posts
+    """
+    q = request.args.get('q', '')
+    posts = paginate_feed(search_feed(q), current_app.config['POSTS_PER_PAGE'],
+        before=request.args.get('before'), after=request.args.get('after'))
+    prev_page = url_for('main.search', q=q, after=posts.prev_cursor) if posts.has_prev else None
+    next_page = url_for('main.search', q=q, before=posts.next_cursor) if posts.has_next else None
+    return render_template('search.html', title='Search', q=q,
+        posts=posts.items, prev_page=prev_page, next_page=next_page)
+
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     """
     Register a new user
     """
     if current_user.is_authenticated:
-        redirect(url_for('index'))
+        redirect(url_for('main.index'))
     form = RegistrationForm()
     if form.validate_on_submit():
         user = User(username=form.username.data, email=form.email.data)
         user.set_password(form.password.data)
         db.session.add(user)
-        db.session.commit()
-        flash('Congratulations, you have successfully registered')
-        return redirect(url_for('login'))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # registered by another worker since the name index last synced
+            db.session.rollback()
+            if names.confirm('username', form.username.data):
+                form.username.errors.append('Please provide a different username')
+            if names.confirm('email', form.email.data):
+                form.email.errors.append('Please provide a different email address')
+        else:
+            flash('Congratulations, you have successfully registered')
+            return redirect(url_for('main.login'))
     return render_template('register.html', title='Register', form=form)
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     """
     Login form
     """
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
         if user is None or not user.check_password(form.password.data):
             flash('Invalid username or password')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
+        if user.upgrade_password(form.password.data):
+            db.session.commit()
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get('next')
         if not next_page or url_parse(next_page).netloc != '':
-            next_page = url_for('index')
+            next_page = url_for('main.index')
         return redirect(next_page)
     return render_template('login.html', title="Sign In", form=form)
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """
     Logout route
     """
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/user/<username>')
+@bp.route('/user/<username>')
 @login_required
+@conditional(user_validators)
 def user(username):
     """
     User profile endpoint
     """
     user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get('page', 1, type=int)
-    posts = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=app.config['POSTS_PER_PAGE'], error_out=False)
-    prev_page = url_for('user',
-        username=user.username, page=posts.prev_num) if posts.has_prev else None
-    next_page = url_for('user',
-        username=user.username, page=posts.next_num) if posts.has_next else None
+    posts = paginate_feed(user_feed(user), current_app.config['POSTS_PER_PAGE'],
+        before=request.args.get('before'), after=request.args.get('after'))
+    prev_page = url_for('main.user',
+        username=user.username, after=posts.prev_cursor) if posts.has_prev else None
+    next_page = url_for('main.user',
+        username=user.username, before=posts.next_cursor) if posts.has_next else None
     form = FollowForm()
-    return render_template('user.html', user=user,
+    # who to follow, computed offline by flask suggestions compute
+    suggestions = Suggestion.for_user(user.id).all() if user.id == current_user.id else []
+    is_following = user.id != current_user.id and current_user.following(user)
+    return render_template('user.html', user=user, suggestions=suggestions,
+        is_following=is_following,
         posts=posts.items, form=form, prev_page=prev_page, next_page=next_page)
 
-@app.route('/edit_profile', methods=['GET', 'POST'])
+@bp.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
     """
@@ -134,15 +243,23 @@ def edit_profile():
     if form.validate_on_submit():
         current_user.username = form.username.data
         current_user.about_me = form.about_me.data
-        db.session.commit()
-        flash('Your profile has been successfully edited')
-        redirect(url_for('edit_profile'))
+        current_user.profile_updated = datetime.utcnow()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # taken in another worker since the name index last synced
+            db.session.rollback()
+            form.username.errors.append('Please use a different username.')
+        else:
+            recent_posts.expire()
+            flash('Your profile has been successfully edited')
+            redirect(url_for('main.edit_profile'))
     elif request.method == 'GET':
         form.username.data = current_user.username
         form.about_me.data = current_user.about_me
     return render_template('edit_profile.html', title='Edit Profile', form=form)
 
-@app.route('/follow/<username>/', methods=['POST'])
+@bp.route('/follow/<username>/', methods=['POST'])
 @login_required
 def follow(username):
     """
@@ -153,18 +270,20 @@ def follow(username):
         user = User.query.filter_by(username=username).first()
         if user is None:
             flash('User {} not found'.format(username))
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         if user == current_user:
             flash('You can not follow you')
-            return redirect(url_for('user', username))
-        current_user.follow(user)
-        db.session.commit()
+            return redirect(url_for('main.user', username))
+        follower_id, followed_id = current_user.id, user.id
+        if current_user.follow(user):
+            db.session.commit()
+            broker.follow(follower_id, [followed_id])
         flash('You now follow {}'.format(username))
-        return redirect(url_for('user', username=username))
+        return redirect(url_for('main.user', username=username))
     else:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
-@app.route('/unfollow/<username>/', methods=['POST'])
+@bp.route('/unfollow/<username>/', methods=['POST'])
 @login_required
 def unfollow(username):
     """
@@ -175,13 +294,15 @@ def unfollow(username):
         user = User.query.filter_by(username=username).first()
         if user is None:
             flash('User {} not found'.format(username))
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         if user == current_user:
             flash('You can not unfollow you')
-            return redirect(url_for('user', username))
-        current_user.unfollow(user)
-        db.session.commit()
+            return redirect(url_for('main.user', username))
+        follower_id, followed_id = current_user.id, user.id
+        if current_user.unfollow(user):
+            db.session.commit()
+            broker.follow(follower_id, [followed_id], following=False)
         flash('You just unfollowed {}'.format(username))
-        return redirect(url_for('user', username=username))
+        return redirect(url_for('main.user', username=username))
     else:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
@@ -0,0 +1,157 @@
+import heapq
+from itertools import repeat
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from app import db
+from app.bulk import chunked
+from app.models import follows, Suggestion
+
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:  # pragma: no cover
+    numpy = sparse = None
+
+# follow graph of a worker process, set once by its initializer
+_graph = None
+
+
+def load_graph():
+    """
+    {follower id: tuple of followed ids} of every follow, read in one ordered scan
+    """
+    graph = {}
+    rows = db.session.execute(db.select(follows.c.follower_id, follows.c.followed_id).order_by(
+        follows.c.follower_id, follows.c.followed_id), execution_options={'stream_results': True})
+    for follower_id, followed_id in rows:
+        graph.setdefault(follower_id, []).append(followed_id)
+    return {follower_id: tuple(followed) for follower_id, followed in graph.items()}
+
+def adjacency_matrix(graph):
+    """
+    (sorted user ids, CSR matrix with a 1 at [follower, followed]) of graph
+    """
+    ids = numpy.unique(numpy.fromiter((id for follower_id, followed in graph.items()
+        for id in (follower_id,) + followed), dtype=numpy.int64))
+    rows = numpy.fromiter((follower_id for follower_id, followed in graph.items()
+        for _ in followed), dtype=numpy.int64)
+    columns = numpy.fromiter((id for followed in graph.values() for id in followed),
+        dtype=numpy.int64)
+    matrix = sparse.csr_matrix((numpy.ones(len(rows), dtype=numpy.int32),
+        (numpy.searchsorted(ids, rows), numpy.searchsorted(ids, columns))),
+        shape=(len(ids), len(ids)))
+    return ids, matrix
+
+def _init_worker(graph, vectorized):
+    global _graph
+    _graph = adjacency_matrix(graph) if vectorized else graph
+
+def _top(candidates, k):
+    """
+    k best (id, score) of candidates, ties to the lowest id
+    """
+    return heapq.nsmallest(k, candidates, key=lambda candidate: (-candidate[1], candidate[0]))
+
+def _count_scores(user_ids, k):
+    """
+    Scores of user_ids counted in pure Python from the worker graph
+    """
+    results = []
+    for user_id in user_ids:
+        followed = _graph[user_id]
+        scores = Counter(id for followed_id in followed for id in _graph.get(followed_id, ()))
+        for id in followed + (user_id,):
+            scores.pop(id, None)
+        results.append((user_id, _top(scores.items(), k)))
+    return results
+
+def _matrix_scores(user_ids, k):
+    """
+    Scores of user_ids from sparse matrix operations on the whole chunk
+    """
+    ids, matrix = _graph
+    rows = numpy.searchsorted(ids, user_ids)
+    followed = matrix[rows]
+    # one sparse product counts the two hop paths of the whole chunk
+    scores = (followed @ matrix).tocsr()
+    selves = sparse.csr_matrix((numpy.ones(len(rows), dtype=matrix.dtype),
+        (numpy.arange(len(rows)), rows)), shape=scores.shape)
+    scores = scores - scores.multiply((followed + selves).astype(bool))
+    scores.eliminate_zeros()
+    # rank the candidates of every row at once: by row, best score, lowest id
+    counts = numpy.diff(scores.indptr)
+    owners = numpy.repeat(numpy.arange(len(rows)), counts)
+    order = numpy.lexsort((scores.indices, -scores.data, owners))
+    best = order[numpy.arange(len(order)) - scores.indptr[owners] < k]
+    bounds = numpy.cumsum(numpy.minimum(counts, k))[:-1]
+    suggested = numpy.split(ids[scores.indices[best]], bounds)
+    values = numpy.split(scores.data[best], bounds)
+    return [(user_id, list(zip(top_ids.tolist(), top_scores.tolist())))
+        for user_id, top_ids, top_scores in zip(user_ids, suggested, values)]
+
+def _chunk_scores(user_ids, k):
+    """
+    [(user id, [(suggested id, score), ...])] of user_ids from the worker graph.
+
+    The score of a candidate is how many of the users followed by user
+    follow it, user itself and the users it already follows are left out.
+    """
+    if isinstance(_graph, dict):
+        return _count_scores(user_ids, k)
+    return _matrix_scores(user_ids, k)
+
+def compute_suggestions(graph, k, workers=0, chunk_size=1000, vectorized=None):
+    """
+    Yields chunks of [(user id, top k suggestions)] for every follower of graph.
+
+    Chunks are scored by a pool of worker processes, each given the graph
+    once, or inline when workers is 0. Vectorized, the default when NumPy
+    and SciPy are installed (requirements-optional.txt), a chunk is scored
+    with sparse matrix operations, otherwise it is counted in pure Python.
+    """
+    global _graph
+    if vectorized is None:
+        vectorized = sparse is not None
+    chunks = chunked(sorted(graph), chunk_size)
+    if not workers:
+        _init_worker(graph, vectorized)
+        try:
+            for chunk in chunks:
+                yield _chunk_scores(chunk, k)
+        finally:
+            _graph = None
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+            initargs=(graph, vectorized)) as executor:
+        yield from executor.map(_chunk_scores, chunks, repeat(k))
+
+def refresh_suggestions(k, workers=0, chunk_size=1000, report=None):
+    """
+    Replace the stored suggestions of every user with freshly computed ones.
+
+    Each chunk replaces the rows of its users in its own transaction, so
+    profiles keep showing suggestions while the job runs. report(users) is
+    called after each chunk, returns how many suggestions were stored.
+    """
+    graph = load_graph()
+    db.session.commit()
+    users, stored = 0, 0
+    for results in compute_suggestions(graph, k, workers, chunk_size):
+        db.session.execute(db.delete(Suggestion).where(
+            Suggestion.user_id.in_([user_id for user_id, top in results])))
+        rows = [{'user_id': user_id, 'rank': rank, 'suggested_id': suggested_id, 'score': score}
+            for user_id, top in results for rank, (suggested_id, score) in enumerate(top)]
+        if rows:
+            db.session.execute(db.insert(Suggestion), rows)
+        db.session.commit()
+        users += len(results)
+        stored += len(rows)
+        if report is not None:
+            report(users)
+    # users who stopped following anyone
+    db.session.execute(db.delete(Suggestion).where(
+        Suggestion.user_id.not_in(db.select(follows.c.follower_id))
+    ).execution_options(synchronize_session=False))
+    db.session.commit()
+    return stored
@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app import db
+from app.models import follows, Post, Timeline
+
+
+class TimelineFanout(object):
+    """
+    Delivers new posts into the materialized home timelines
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Bind fan-out to application and its configuration
+        """
+        app.config.setdefault('MATERIALIZED_TIMELINE', True)
+        app.config.setdefault('TIMELINE_FANOUT_ASYNC', True)
+        app.config.setdefault('TIMELINE_FANOUT_WORKERS', 2)
+        app.extensions['timeline'] = self
+        self.app = app
+
+    @property
+    def executor(self):
+        """
+        Fan-out worker pool, created on first use
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.app.config['TIMELINE_FANOUT_WORKERS'],
+                thread_name_prefix='timeline-fanout')
+        return self._executor
+
+    def add_own_post(self, post):
+        """
+        Adds post to its author timeline within the current transaction
+        """
+        db.session.execute(db.insert(Timeline).values(
+            owner_id=post.user_id, post_id=post.id, timestamp=post.timestamp))
+
+    def fan_out(self, post_id):
+        """
+        Delivers a committed post to its author followers timelines
+        """
+        if not self.app.config['TIMELINE_FANOUT_ASYNC']:
+            return self._fan_out(post_id)
+        return self.executor.submit(self._run_in_context, post_id)
+
+    def _run_in_context(self, post_id):
+        """
+        Background entry point, runs the fan-out inside an application context
+        """
+        with self.app.app_context():
+            try:
+                self._fan_out(post_id)
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception('Timeline fan-out failed for post %s', post_id)
+
+    def _fan_out(self, post_id):
+        """
+        Executes the fan-out statement and commits it
+        """
+        db.session.execute(Timeline.fan_out_statement(post_id))
+        db.session.commit()
+
+    def shutdown(self, wait=True):
+        """
+        Waits for pending fan-outs to complete
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+def rebuild_timelines(user_id=None):
+    """
+    Recomputes materialized timelines from follows and posts, for one user or everyone
+    """
+    delete = db.delete(Timeline)
+    followed = db.select(follows.c.follower_id, Post.id, Post.timestamp).join(
+        Post, follows.c.followed_id == Post.user_id)
+    own = db.select(Post.user_id, Post.id, Post.timestamp)
+    if user_id is not None:
+        delete = delete.where(Timeline.owner_id == user_id)
+        followed = followed.where(follows.c.follower_id == user_id)
+        own = own.where(Post.user_id == user_id)
+    db.session.execute(delete)
+    inserted = db.session.execute(Timeline.insert_select(followed)).rowcount
+    inserted += db.session.execute(Timeline.insert_select(own)).rowcount
+    db.session.commit()
+    return inserted
@@ -0,0 +1,255 @@
+import re
+import atexit
+import threading
+from time import monotonic
+from datetime import datetime
+from collections import Counter
+
+from sqlalchemy.dialects.sqlite import insert
+
+from app import db
+from app.models import post_tag, Post, Tag, TagCount
+
+# a # not preceded by a word character, then the tag
+TAG_PATTERN = re.compile(r'(?<!\w)#(\w+)')
+TAG_MAX_LENGTH = 64
+EPOCH = datetime(1970, 1, 1)
+
+# (name, bucket span in seconds, buckets summed) of each trending window
+WINDOWS = (('hour', 60, 60), ('day', 3600, 24))
+# buckets older than this many spans are pruned
+RETENTION = {60: 120, 3600: 48}
+
+
+def extract_tags(body):
+    """
+    Lowercase hashtags of body without the #, in order of first use
+    """
+    tags = []
+    for tag in TAG_PATTERN.findall(body or ''):
+        tag = tag.lower()
+        if len(tag) <= TAG_MAX_LENGTH and tag not in tags:
+            tags.append(tag)
+    return tags
+
+def bucket_of(timestamp, span):
+    """
+    Start of the span seconds bucket holding timestamp, in seconds since the epoch
+    """
+    return int((timestamp - EPOCH).total_seconds()) // span * span
+
+def index_tags(post_tags):
+    """
+    Add the tags of {post_id: tags} to the tag index with three statements,
+    skipping tags and post tags already present
+    """
+    names = sorted({tag for tags in post_tags.values() for tag in tags})
+    if not names:
+        return 0
+    db.session.execute(insert(Tag).on_conflict_do_nothing(), [{'name': name} for name in names])
+    ids = dict(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(names)))
+    rows = [{'post_id': post_id, 'tag_id': ids[tag]}
+        for post_id, tags in post_tags.items() for tag in tags]
+    db.session.execute(insert(post_tag).on_conflict_do_nothing(), rows)
+    return len(rows)
+
+def backfill_tags(batch_size=1000, report=None):
+    """
+    Index the tags of every post, streamed in batches of batch_size by id.
+
+    Each batch is committed, posts already indexed are skipped by the
+    index. report(posts) is called after each batch, returns how many
+    posts were read.
+    """
+    read, last_id = 0, 0
+    while True:
+        rows = db.session.query(Post.id, Post.body).filter(Post.id > last_id).order_by(
+            Post.id).limit(batch_size).all()
+        if not rows:
+            return read
+        index_tags({id: extract_tags(body) for id, body in rows})
+        db.session.commit()
+        read += len(rows)
+        last_id = rows[-1].id
+        if report is not None:
+            report(read)
+
+def rebuild_tag_counts(now=None):
+    """
+    Recompute the retained buckets of every window from the tag index.
+
+    Counts still pending in a worker are added on top when it flushes.
+    """
+    now = now or datetime.utcnow()
+    counted = 0
+    for span, kept in RETENTION.items():
+        since = bucket_of(now, span) - (kept - 1) * span
+        bucket = db.cast(db.func.strftime('%s', Post.timestamp), db.Integer) / span * span
+        db.session.execute(db.delete(TagCount).where(TagCount.span == span))
+        counted += db.session.execute(db.insert(TagCount).from_select(
+            ['span', 'bucket', 'tag_id', 'count'],
+            db.select(db.literal(span), bucket, post_tag.c.tag_id, db.func.count())
+            .join(Post, Post.id == post_tag.c.post_id)
+            .where(Post.timestamp >= datetime.utcfromtimestamp(since))
+            .group_by(bucket, post_tag.c.tag_id))).rowcount
+    db.session.commit()
+    return counted
+
+
+class TrendingTags(object):
+    """
+    Per minute and per hour counts of hashtags, for the trending panel.
+
+    New posts only count their tags in memory, a background thread adds
+    the pending counts to the tag_count buckets every
+    TRENDING_FLUSH_INTERVAL seconds with one executemany upsert. The
+    top TRENDING_SIZE tags of the last hour and day sum at most 60 and 24
+    buckets per tag, and are read again at most every
+    TRENDING_REFRESH_INTERVAL seconds.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self._pending = Counter()
+        self._top = None
+        self._checked_at = 0
+        # when the top tags last differed from the previous read
+        self.changed = None
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._stopped = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Bind counters to application and flush them on interpreter shutdown
+        """
+        app.config.setdefault('TRENDING_SIZE', 10)
+        app.config.setdefault('TRENDING_FLUSH_INTERVAL', 10)
+        app.config.setdefault('TRENDING_REFRESH_INTERVAL', 30)
+        app.extensions['trending'] = self
+        self.app = app
+        atexit.register(self.stop)
+
+    @property
+    def enabled(self):
+        return self.app.config['TRENDING_SIZE'] > 0
+
+    def add(self, tags, timestamp=None):
+        """
+        Count tags of a post committed at timestamp
+        """
+        if not tags or not self.enabled:
+            return
+        timestamp = timestamp or datetime.utcnow()
+        with self._lock:
+            for span in RETENTION:
+                bucket = bucket_of(timestamp, span)
+                self._pending.update((span, bucket, tag) for tag in tags)
+        self._start_flusher()
+
+    def flush(self, now=None):
+        """
+        Add pending counts to their buckets and prune expired buckets
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        now = now or datetime.utcnow()
+        table = TagCount.__table__
+        statement = insert(table).from_select(['span', 'bucket', 'tag_id', 'count'],
+            db.select(db.bindparam('span'), db.bindparam('bucket'), Tag.id,
+                db.bindparam('count')).where(Tag.name == db.bindparam('name')))
+        statement = statement.on_conflict_do_update(index_elements=table.primary_key.columns,
+            set_={'count': table.c.count + statement.excluded['count']})
+        with self.app.app_context():
+            try:
+                if pending:
+                    db.session.execute(statement, [{'span': span, 'bucket': bucket,
+                        'name': name, 'count': count}
+                        for (span, bucket, name), count in pending.items()])
+                for span, kept in RETENTION.items():
+                    db.session.execute(db.delete(TagCount).where(TagCount.span == span,
+                        TagCount.bucket <= bucket_of(now, span) - kept * span))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception('Could not flush %d tag counts', len(pending))
+                with self._lock:
+                    self._pending.update(pending)
+                return 0
+        return sum(pending.values())
+
+    def top(self, now=None):
+        """
+        {window: ((tag, posts), ...)} of the most used tags, None when disabled
+        """
+        if not self.enabled:
+            return None
+        if self._top is not None and \
+                monotonic() - self._checked_at < self.app.config['TRENDING_REFRESH_INTERVAL']:
+            return self._top
+        checked_at = monotonic()
+        now = now or datetime.utcnow()
+        total = db.func.sum(TagCount.count).label('total')
+        windows = []
+        for window, span, buckets in WINDOWS:
+            windows.append(db.select(db.literal(window).label('window'), Tag.name, total)
+                .join(Tag, Tag.id == TagCount.tag_id)
+                .where(TagCount.span == span,
+                    TagCount.bucket > bucket_of(now, span) - buckets * span)
+                .group_by(Tag.id).order_by(total.desc(), Tag.name)
+                .limit(self.app.config['TRENDING_SIZE']).subquery())
+        # a plain SELECT, routed to the replica like the other reads of a GET
+        rows = db.session.execute(db.select(
+            db.union_all(*[db.select(window) for window in windows]).subquery()))
+        top = {window: [] for window, span, buckets in WINDOWS}
+        for window, name, count in rows:
+            top[window].append((name, count))
+        top = {window: tuple(tags) for window, tags in top.items()}
+        with self._lock:
+            if top != self._top:
+                self._top = top
+                self.changed = now
+            self._checked_at = checked_at
+            return self._top
+
+    def expire(self):
+        """
+        Read the top tags again on next use
+        """
+        self._checked_at = 0
+
+    def clear(self):
+        """
+        Drop pending counts and the top tags
+        """
+        with self._lock:
+            self._pending = Counter()
+            self._top = None
+            self._checked_at = 0
+            self.changed = None
+
+    def _start_flusher(self):
+        """
+        Start the flush thread in this process, on first use so forked workers get their own
+        """
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._stopped.clear()
+                self._flusher = threading.Thread(
+                    target=self._run, name='trending-flusher', daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.app.config['TRENDING_FLUSH_INTERVAL']):
+            self.flush()
+
+    def stop(self):
+        """
+        Stop the flush thread and write what is still pending
+        """
+        self._stopped.set()
+        if self._pending:
+            self.flush()
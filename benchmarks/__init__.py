@@ -0,0 +1,3 @@
+"""
+Benchmarks of Infographics, run each module with python -m benchmarks.<name>
+"""
@@ -0,0 +1,111 @@
+"""
+Mixed read/write throughput with default and tuned SQLite settings.
+
+    python -m benchmarks.concurrency --readers 8 --writers 2 --seconds 10
+
+Every configuration runs in its own process on a fresh database, since
+engine options and PRAGMAs are fixed when the application is imported.
+Reader threads load /explore and profile pages while writer threads
+post, the report counts completed and failed requests of each kind.
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import threading
+import subprocess
+from time import perf_counter
+
+# environment of each configuration, on top of the current one
+CONFIGURATIONS = {
+    # what SQLAlchemy and SQLite do out of the box
+    'default': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL',
+        'SQLITE_CACHE_SIZE': '-2000', 'SQLITE_MMAP_SIZE': '0', 'DATABASE_POOL_SIZE': '0'},
+    'tuned': {},
+    'tuned+replica': {'BENCHMARK_REPLICA': '1'},
+}
+
+
+def run_configuration(args):
+    """
+    Throughput of this process configuration, imports the application
+    """
+    from benchmarks.database import throwaway_database
+    throwaway_database(replica=bool(os.environ.get('BENCHMARK_REPLICA')))
+    from benchmarks.routes import app, build, percentile, signed_in
+    from app import last_seen
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    build(args)
+    stop = threading.Event()
+    results = {'read': [], 'write': []}
+    failures = {'read': 0, 'write': 0}
+
+    def worker(kind, id):
+        rng = random.Random(id)
+        client = signed_in('user{}'.format(id))
+        while not stop.is_set():
+            start = perf_counter()
+            if kind == 'read':
+                url = rng.choice(('/explore', '/user/user{}'.format(rng.randint(1, args.users))))
+                response = client.get(url)
+            else:
+                response = client.post('/index', data={'post': 'Concurrent post'})
+            elapsed = perf_counter() - start
+            if response.status_code >= 400:
+                failures[kind] += 1
+            else:
+                results[kind].append(elapsed)
+
+    threads = [threading.Thread(target=worker, args=('read', id + 1))
+        for id in range(args.readers)]
+    threads += [threading.Thread(target=worker, args=('write', args.readers + id + 1))
+        for id in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    stop.wait(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    last_seen.stop()
+    report = {}
+    for kind, timings in results.items():
+        timings.sort()
+        report[kind] = {'per_second': round(len(timings) / args.seconds, 1),
+            'failed': failures[kind],
+            'p50_ms': round(percentile(timings, 0.50) * 1000, 3) if timings else None,
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 3) if timings else None}
+    return report
+
+def run(args, argv):
+    """
+    Run every configuration in a child process and collect their reports
+    """
+    results = {'readers': args.readers, 'writers': args.writers, 'seconds': args.seconds,
+        'configurations': {}}
+    for name, environment in CONFIGURATIONS.items():
+        if args.only and name not in args.only:
+            continue
+        child = subprocess.run([sys.executable, '-m', 'benchmarks.concurrency', '--child'] + argv,
+            env=dict(os.environ, **environment), capture_output=True, text=True, check=True)
+        results['configurations'][name] = json.loads(child.stdout)
+    return results
+
+
+if __name__ == '__main__':
+    from benchmarks import datagen
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    datagen.add_arguments(parser)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--only', nargs='*', choices=list(CONFIGURATIONS))
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    argv = sys.argv[1:]
+    args = parser.parse_args(argv)
+    if args.child:
+        json.dump(run_configuration(args), sys.stdout)
+    else:
+        json.dump(run(args, argv), sys.stdout, indent=2)
+        sys.stdout.write('\n')
@@ -0,0 +1,27 @@
+"""
+Throwaway SQLite database for benchmarks that drive the application
+"""
+import os
+import atexit
+import shutil
+import tempfile
+
+_path = None
+
+
+def throwaway_database(replica=False):
+    """
+    Point the application at a temporary file, before app is first imported.
+
+    With replica, GET requests read through a second, read-only connection
+    to the same file. Later calls return the path of the first one.
+    """
+    global _path
+    if _path is None:
+        directory = tempfile.mkdtemp(prefix='infographics-benchmark-')
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+        _path = os.path.join(directory, 'benchmark.db')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + _path
+        if replica:
+            os.environ['DATABASE_REPLICA_URL'] = 'sqlite:///file:{}?mode=ro&uri=true'.format(_path)
+    return _path
@@ -0,0 +1,84 @@
+"""
+Seeded synthetic social graph in the format of flask data import.
+
+    python -m benchmarks.datagen --users 10000 --posts 1000000 > graph.ndjson
+    flask data import graph.ndjson
+
+Users are ranked by popularity: the user of rank r is followed and posts
+in proportion to 1 / (r + 1) ** exponent, which gives the power-law
+follower distribution of real networks. Post timestamps increase with
+their id and spread evenly over the last --days days before --end.
+"""
+import sys
+import json
+import random
+import argparse
+import itertools
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+# every generated user signs in with this password
+PASSWORD = 'password'
+
+
+def popularity(count, exponent):
+    """
+    Cumulative power-law weights of count users, rank 0 the most popular
+    """
+    return list(itertools.accumulate(1.0 / (rank + 1) ** exponent for rank in range(count)))
+
+def generate(users, posts, seed=1, mean_follows=20, exponent=1.0, days=365,
+        end=datetime(2022, 12, 1)):
+    """
+    Yields (kind, row) records of users, then follows, then posts
+    """
+    rng = random.Random(seed)
+    start = end - timedelta(days=days)
+    span = (end - start).total_seconds()
+    password_hash = generate_password_hash(PASSWORD)
+    for id in range(1, users + 1):
+        yield 'users', {'id': id, 'username': 'user{}'.format(id),
+            'email': 'user{}@example.com'.format(id), 'password_hash': password_hash,
+            'about_me': None, 'profile_updated': None,
+            'last_seen': (end - timedelta(seconds=rng.random() * span)).isoformat()}
+    cum_weights = popularity(users, exponent)
+    ids = range(1, users + 1)
+    for follower_id in ids:
+        wanted = min(users - 1, int(rng.expovariate(1.0 / mean_follows)))
+        followed = set(rng.choices(ids, cum_weights=cum_weights, k=wanted))
+        followed.discard(follower_id)
+        for followed_id in sorted(followed):
+            yield 'follows', {'follower_id': follower_id, 'followed_id': followed_id}
+    authors = rng.choices(ids, cum_weights=cum_weights, k=posts) if posts else []
+    for id, user_id in enumerate(authors, 1):
+        timestamp = start + timedelta(seconds=span * (id - 1 + rng.random()) / posts)
+        yield 'posts', {'id': id, 'body': 'Post {} of user{}'.format(id, user_id),
+            'timestamp': timestamp.isoformat(), 'user_id': user_id}
+
+
+def add_arguments(parser):
+    """
+    Options shared by the benchmarks that generate a graph
+    """
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mean-follows', type=int, default=20)
+    parser.add_argument('--exponent', type=float, default=1.0,
+        help='Power-law exponent of follower and post counts.')
+    parser.add_argument('--days', type=int, default=365, help='Timestamp spread of posts.')
+
+def generate_from(args):
+    return generate(args.users, args.posts, args.seed, args.mean_follows, args.exponent, args.days)
+
+
+if __name__ == '__main__':
+    from app.bulk import RECORD_TYPES
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    args = parser.parse_args()
+    for kind, row in generate_from(args):
+        row['type'] = RECORD_TYPES[kind]
+        sys.stdout.write(json.dumps(row, separators=(',', ':')))
+        sys.stdout.write('\n')
@@ -0,0 +1,92 @@
+"""
+Login throughput under concurrency for several password hashing pool sizes.
+
+    python -m benchmarks.login --threads 8 --logins 200 --pool-sizes 0 1 2 4
+
+Threads sign in as random users through the Flask test client while one
+more thread keeps loading /explore, so the report shows both how fast
+logins complete and how much they slow unrelated requests down.
+"""
+import sys
+import json
+import random
+import argparse
+import threading
+from time import perf_counter
+
+from benchmarks.routes import app, build, percentile, signed_in
+from benchmarks import datagen
+from app import passwords, last_seen
+
+
+def run_pool_size(args, pool_size):
+    """
+    Logins per second and latencies with pool_size hashing workers
+    """
+    app.config['PASSWORD_HASH_WORKERS'] = pool_size
+    passwords.shutdown()
+    # start the pool before timing
+    passwords.hash(datagen.PASSWORD)
+    usernames = ['user{}'.format(id) for id in random.Random(args.seed).choices(
+        range(1, args.users + 1), k=args.logins)]
+    login_timings, explore_timings = [], []
+    done = threading.Event()
+
+    def sign_in(names):
+        for name in names:
+            client = app.test_client()
+            start = perf_counter()
+            response = client.post('/login', data={'username': name,
+                'password': datagen.PASSWORD})
+            login_timings.append(perf_counter() - start)
+            if response.status_code != 302:
+                raise RuntimeError('login of {} answered {}'.format(name, response.status_code))
+
+    def probe():
+        reader = signed_in(usernames[0])
+        while not done.is_set():
+            start = perf_counter()
+            reader.get('/explore')
+            explore_timings.append(perf_counter() - start)
+
+    prober = threading.Thread(target=probe)
+    threads = [threading.Thread(target=sign_in, args=(usernames[i::args.threads],))
+        for i in range(args.threads)]
+    prober.start()
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+    done.set()
+    prober.join()
+    login_timings.sort()
+    explore_timings.sort()
+    return {'pool_size': pool_size,
+        'logins_per_second': round(args.logins / elapsed, 1),
+        'login_p50_ms': round(percentile(login_timings, 0.50) * 1000, 3),
+        'login_p95_ms': round(percentile(login_timings, 0.95) * 1000, 3),
+        'explore_p50_ms': round(percentile(explore_timings, 0.50) * 1000, 3),
+        'explore_p95_ms': round(percentile(explore_timings, 0.95) * 1000, 3)}
+
+def run(args):
+    app.config['WTF_CSRF_ENABLED'] = False
+    build(args)
+    results = {'method': app.config['PASSWORD_HASH_METHOD'], 'threads': args.threads,
+        'logins': args.logins, 'runs': [run_pool_size(args, size) for size in args.pool_sizes]}
+    passwords.shutdown()
+    last_seen.stop()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    datagen.add_arguments(parser)
+    parser.set_defaults(users=200, posts=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[0, 1, 2, 4])
+    args = parser.parse_args()
+    json.dump(run(args), sys.stdout, indent=2)
+    sys.stdout.write('\n')
@@ -0,0 +1,186 @@
+"""
+Latency, queries and memory of the main routes on a synthetic graph.
+
+    python -m benchmarks.routes --users 1000 --posts 20000 --output HEAD.json
+    python -m benchmarks.routes --baseline HEAD.json
+
+Loads a seeded graph from benchmarks.datagen into a throwaway database
+and drives every scenario through the Flask test client. Each scenario
+reports p50/p95/p99 latency, SQL queries per request and the peak memory
+traced while serving one request. The latter is measured in a separate,
+shorter pass because tracing slows every allocation.
+"""
+import sys
+import json
+import random
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from time import perf_counter
+
+from benchmarks.database import throwaway_database
+throwaway_database()
+
+from sqlalchemy import event
+
+from app import create_app, db, bulk, last_seen
+from app.models import Post, User
+from app.timeline import rebuild_timelines
+from benchmarks import datagen
+
+app = create_app()
+
+
+def percentile(ordered, fraction):
+    """
+    Nearest rank percentile of sorted values
+    """
+    return ordered[max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))]
+
+def build(args):
+    """
+    Create the schema and load the graph with derived data
+    """
+    with app.app_context():
+        db.create_all()
+        bulk.drop_search_triggers()
+        bulk.import_rows(datagen.generate_from(args), 50000)
+        Post.reindex_search()
+        User.reconcile_follow_counts()
+        rebuild_timelines()
+
+def signed_in(username):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': datagen.PASSWORD})
+    return client
+
+
+def scenarios(args):
+    """
+    Mapping of scenario names to a function of the iteration doing one request
+    """
+    rng = random.Random(args.seed)
+    cum_weights = datagen.popularity(args.users, args.exponent)
+    ids = range(1, args.users + 1)
+    with app.app_context():
+        # the viewer with the busiest home timeline
+        viewer = User.query.order_by(User.following_count.desc(), User.id).first().username
+    reader = signed_in(viewer)
+    profiles = ['user{}'.format(id) for id in rng.choices(ids, cum_weights=cum_weights,
+        k=args.requests + args.warmup)]
+
+    def follow(iteration):
+        # every other request unfollows the user followed just before
+        name = profiles[iteration // 2]
+        action = 'unfollow' if iteration % 2 else 'follow'
+        return reader.post('/{}/{}/'.format(action, name))
+
+    return {
+        'index': lambda iteration: reader.get('/index'),
+        'explore': lambda iteration: reader.get('/explore'),
+        'user': lambda iteration: reader.get('/user/{}'.format(profiles[iteration])),
+        'follow': follow,
+        'login': lambda iteration: app.test_client().post('/login', data={
+            'username': profiles[iteration], 'password': datagen.PASSWORD}),
+    }
+
+def measure(engine, request, requests, warmup, memory_requests):
+    """
+    Latency percentiles, queries per request and peak traced memory of request
+    """
+    queries = []
+
+    def count(*args):
+        queries[-1] += 1
+
+    for iteration in range(warmup):
+        request(iteration)
+    timings = []
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for iteration in range(warmup, warmup + requests):
+            queries.append(0)
+            start = perf_counter()
+            response = request(iteration)
+            timings.append(perf_counter() - start)
+            if response.status_code >= 400:
+                raise RuntimeError('{} answered {}'.format(request, response.status_code))
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    peak = 0
+    tracemalloc.start()
+    try:
+        for iteration in range(warmup, warmup + memory_requests):
+            tracemalloc.reset_peak()
+            request(iteration)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+    timings.sort()
+    return {'requests': requests,
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'max_queries': max(queries),
+        'peak_memory_kib': round(peak / 1024, 1)}
+
+def commit():
+    """
+    Checked out commit, None outside a git work tree
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """
+    Relative change of every latency and query count against a previous run
+    """
+    changes = {}
+    for name, current in results['routes'].items():
+        previous = baseline['routes'].get(name)
+        if previous is None:
+            continue
+        changes[name] = {key: round(current[key] / previous[key] - 1, 3) if previous[key] else None
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')}
+    return changes
+
+def run(args):
+    app.config['WTF_CSRF_ENABLED'] = False
+    start = perf_counter()
+    build(args)
+    results = {'commit': commit(), 'python': platform.python_version(),
+        'parameters': vars(args).copy(), 'build_seconds': round(perf_counter() - start, 2),
+        'routes': {}}
+    del results['parameters']['output'], results['parameters']['baseline']
+    with app.app_context():
+        engine = db.engine
+    for name, request in scenarios(args).items():
+        if args.only and name not in args.only:
+            continue
+        results['routes'][name] = measure(engine, request, args.requests, args.warmup,
+            min(args.requests, args.memory_requests))
+    last_seen.stop()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    datagen.add_arguments(parser)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--memory-requests', type=int, default=20)
+    parser.add_argument('--only', nargs='*', help='Scenarios to run, every one by default.')
+    parser.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout)
+    parser.add_argument('--baseline', type=argparse.FileType('r'),
+        help='Results of an earlier run to compare with.')
+    args = parser.parse_args()
+    results = run(args)
+    if args.baseline is not None:
+        results['change'] = compare(results, json.load(args.baseline))
+    json.dump(results, args.output, indent=2)
+    args.output.write('\n')
@@ -0,0 +1,101 @@
+"""
+Compare FTS5 search with a LIKE scan over Post.body.
+
+    python -m benchmarks.search --posts 1000000
+
+Builds a throwaway SQLite database with the application post table and
+full-text index, then times the first page of results for words of
+decreasing frequency with both strategies.
+"""
+import os
+import json
+import random
+import sqlite3
+import argparse
+import itertools
+import tempfile
+from time import perf_counter
+from datetime import datetime, timedelta
+
+from app.models import POST_FTS_TABLE, POST_FTS_TRIGGERS
+
+# a zipf distributed vocabulary, words[0] is the most frequent
+VOCABULARY_SIZE = 20000
+WORDS_PER_POST = 12
+
+
+def generate_posts(count, seed):
+    """
+    Yields (id, body, timestamp, user_id) rows of synthetic posts
+    """
+    rng = random.Random(seed)
+    words = ['w{}x'.format(i) for i in range(VOCABULARY_SIZE)]
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(VOCABULARY_SIZE)))
+    start = datetime(2022, 1, 1)
+    for id in range(1, count + 1):
+        body = ' '.join(rng.choices(words, cum_weights=cum_weights, k=WORDS_PER_POST))[:140]
+        yield id, body, start + timedelta(seconds=id), rng.randint(1, 1000)
+
+def build(path, count, seed, batch_size=50000):
+    """
+    Create and fill the post table and its full-text index
+    """
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=OFF')
+    connection.execute('CREATE TABLE post (id INTEGER PRIMARY KEY, body VARCHAR(140), '
+        'timestamp DATETIME, user_id INTEGER)')
+    connection.execute('CREATE INDEX ix_post_timestamp ON post (timestamp)')
+    rows = generate_posts(count, seed)
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            break
+        connection.executemany('INSERT INTO post VALUES (?, ?, ?, ?)', batch)
+    connection.execute(POST_FTS_TABLE)
+    for trigger in POST_FTS_TRIGGERS:
+        connection.execute(trigger)
+    connection.execute("INSERT INTO post_fts(post_fts) VALUES ('rebuild')")
+    connection.commit()
+    return connection
+
+def timed(connection, sql, parameters, repeat):
+    """
+    Median seconds of repeat runs of sql and the number of rows it returned
+    """
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        rows = connection.execute(sql, parameters).fetchall()
+        timings.append(perf_counter() - start)
+    return sorted(timings)[len(timings) // 2], len(rows)
+
+def run(count, seed, repeat, per_page):
+    with tempfile.TemporaryDirectory() as directory:
+        start = perf_counter()
+        connection = build(os.path.join(directory, 'search.db'), count, seed)
+        results = {'posts': count, 'build_seconds': round(perf_counter() - start, 2), 'words': []}
+        # None stands for a word no post contains
+        for rank in (0, 10, 100, 1000, 10000, None):
+            word = 'w{}x'.format(rank if rank is not None else 'absent')
+            like, like_rows = timed(connection,
+                'SELECT id FROM post WHERE body LIKE ? ORDER BY timestamp DESC LIMIT ?',
+                ('%{}%'.format(word), per_page + 1), repeat)
+            fts, fts_rows = timed(connection,
+                'SELECT rowid FROM post_fts WHERE post_fts MATCH ? ORDER BY rank LIMIT ?',
+                ('"{}"'.format(word), per_page + 1), repeat)
+            results['words'].append({'word': word, 'frequency_rank': rank,
+                'like_ms': round(like * 1000, 3), 'like_rows': like_rows,
+                'fts_ms': round(fts * 1000, 3), 'fts_rows': fts_rows})
+        connection.close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--per-page', type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(run(args.posts, args.seed, args.repeat, args.per_page), indent=2))
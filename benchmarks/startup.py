@@ -0,0 +1,98 @@
+"""
+Cold start time of a worker: importing the application and calling create_app.
+
+    python -m benchmarks.startup --runs 10 --budget-ms 250
+
+Every run is a fresh interpreter started with -X importtime, as a
+preforked worker or a CLI invocation would be. The report gives the
+median import and create_app times, the packages slowest to import, and
+fails when the median exceeds the budget or a module that should load
+lazily was imported at startup.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+# only loaded by the command, mail or log handler that needs them; the email
+# package is not among them, werkzeug imports it through http.server
+LAZY_MODULES = ('alembic', 'flask_migrate', 'flask_mail', 'smtplib')
+
+CHILD = '''
+import sys, json
+from time import perf_counter
+start = perf_counter()
+from app import create_app
+imported = perf_counter()
+create_app()
+created = perf_counter()
+json.dump({'import_ms': (imported - start) * 1000, 'create_app_ms': (created - imported) * 1000,
+    'modules': sorted(sys.modules)}, sys.stdout)
+'''
+
+
+def parse_importtime(stderr):
+    """
+    Microseconds spent importing the modules of each top level package
+    """
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+    return packages
+
+def run_once(environment):
+    """
+    Timings and loaded modules of one cold start
+    """
+    child = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD],
+        env=environment, capture_output=True, text=True, check=True)
+    result = json.loads(child.stdout)
+    result['packages'] = parse_importtime(child.stderr)
+    return result
+
+def run(runs, top):
+    """
+    Median cold start over runs fresh interpreters
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        environment = dict(os.environ, LOG_DIR=os.path.join(directory, 'logs'),
+            DATABASE_URL='sqlite:///' + os.path.join(directory, 'startup.db'))
+        results = [run_once(environment) for _ in range(runs)]
+    slowest = {}
+    for result in results:
+        for package, self_us in result['packages'].items():
+            slowest.setdefault(package, []).append(self_us / 1000)
+    return {
+        'runs': runs,
+        'import_ms': round(statistics.median(r['import_ms'] for r in results), 1),
+        'create_app_ms': round(statistics.median(r['create_app_ms'] for r in results), 1),
+        'total_ms': round(statistics.median(r['import_ms'] + r['create_app_ms']
+            for r in results), 1),
+        'slowest_packages_ms': dict(sorted(((name, round(statistics.median(times), 1))
+            for name, times in slowest.items()), key=lambda item: -item[1])[:top]),
+        'eager_lazy_modules': sorted({name for result in results for name in result['modules']
+            if name.split('.')[0] in LAZY_MODULES}),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15, help='Slowest packages shown.')
+    parser.add_argument('--budget-ms', type=float, default=None,
+        help='Fail when the median import and create_app time exceeds this.')
+    args = parser.parse_args()
+    report = run(args.runs, args.top)
+    print(json.dumps(report, indent=2))
+    if report['eager_lazy_modules']:
+        sys.exit('Imported at startup: {}'.format(', '.join(report['eager_lazy_modules'])))
+    if args.budget_ms is not None and report['total_ms'] > args.budget_ms:
+        sys.exit('Cold start took {}ms, over the {}ms budget'.format(report['total_ms'],
+            args.budget_ms))
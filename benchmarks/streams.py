@@ -0,0 +1,108 @@
+"""
+Idle live timeline streams held open by one gevent process.
+
+    python -m benchmarks.streams --streams 2000
+
+The run starts serve.py's server in a fresh interpreter, opens that many
+/stream connections to it, then publishes one post. The report gives
+the OS threads of the process before and with every stream open, how
+long opening them took and how many streams received the post. It fails
+when the streams did not all receive it or tied up a thread each.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+CHILD = '''
+import serve
+import os, sys, json, socket
+from time import perf_counter
+import gevent
+from gevent import monkey
+from app import create_app, db, broker
+from app.models import User
+
+def threads():
+    """
+    Threads of the operating system, patched threading only counts greenlets
+    """
+    try:
+        return len(os.listdir('/proc/self/task'))
+    except OSError:
+        return monkey.get_original('threading', 'active_count')()
+
+streams = int(sys.argv[1])
+app = create_app()
+with app.app_context():
+    db.create_all()
+    user = User(username='reader', email='reader@example.com')
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+cookie = app.session_interface.get_signing_serializer(app).dumps({'_user_id': str(user_id)})
+server = serve.make_server(app, '127.0.0.1', 0)
+server.start()
+threads_before = threads()
+
+def listen():
+    connection = socket.create_connection(server.address)
+    connection.sendall('GET /stream HTTP/1.1\\r\\nHost: localhost\\r\\nCookie: {}={}\\r\\n\\r\\n'.format(
+        app.config['SESSION_COOKIE_NAME'], cookie).encode())
+    received = b''
+    while b'event: post' not in received:
+        chunk = connection.recv(4096)
+        if not chunk:
+            break
+        received += chunk
+    connection.close()
+    return b'event: post' in received
+
+start = perf_counter()
+listeners = [gevent.spawn(listen) for _ in range(streams)]
+with gevent.Timeout(60, False):
+    while len(broker._subscribers) < streams:
+        gevent.sleep(0.01)
+opened = perf_counter()
+subscribed, threads_open = len(broker._subscribers), threads()
+broker.publish({'author_id': user_id, 'id': 1, 'data': '{}'})
+gevent.joinall(listeners, timeout=60)
+json.dump({'streams': streams, 'subscribed': subscribed, 'open_ms': (opened - start) * 1000,
+    'delivered': sum(1 for listener in listeners if listener.value),
+    'threads_before': threads_before, 'threads_open': threads_open}, sys.stdout)
+server.stop(timeout=1)
+'''
+
+
+def run_once(streams, environment):
+    """
+    Report of one process holding streams open streams
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    child = subprocess.run([sys.executable, '-c', CHILD, str(streams)], cwd=root,
+        env=dict(environment, STREAM_HEARTBEAT='3600'), capture_output=True, text=True,
+        check=True)
+    return json.loads(child.stdout)
+
+def run(streams):
+    """
+    run_once against a throwaway database
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        return run_once(streams, dict(os.environ, LOG_DIR=os.path.join(directory, 'logs'),
+            DATABASE_URL='sqlite:///' + os.path.join(directory, 'streams.db')))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--streams', type=int, default=1000)
+    args = parser.parse_args()
+    report = run(args.streams)
+    print(json.dumps(report, indent=2))
+    if report['delivered'] != report['streams']:
+        sys.exit('{} of {} streams received the post'.format(report['delivered'],
+            report['streams']))
+    if report['threads_open'] - report['threads_before'] >= report['streams']:
+        sys.exit('Streams held {} threads'.format(report['threads_open']))
@@ -4,16 +4,74 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or '87o8ugkytdn^%rfer%#gtgt%yhyy^j&juTj'
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
-            'sqlite:///' + os.path.join(basedir, 'app.db') \
-            if os.environ.get('ENV', None) == 'dev' else \
-            'sqlite:///' + os.path.join(basedir, 'test.db')
+    # DATABASE_URL wins in every environment
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + \
+            os.path.join(basedir, 'app.db' if os.environ.get('ENV') == 'dev' else 'test.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_BINDS = {'replica': os.environ.get('DATABASE_REPLICA_URL')} \
+            if os.environ.get('DATABASE_REPLICA_URL') else {}
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 5)
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW') or 10)
+    REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS') or 5)
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or -20000)
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000)
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
-    MAIL_PORT = int(os.environ.get('MAIL_PORT')) or 25
+    MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
     MAIL_USE_SSL = False
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = [os.environ.get('ADMIN')]
     POSTS_PER_PAGE = 10
+    POST_ARCHIVE_DAYS = int(os.environ.get('POST_ARCHIVE_DAYS') or 365)
+    API_PAGE_SIZE = 20
+    API_MAX_PAGE_SIZE = 100
+    API_FOLLOW_MANY_MAX = int(os.environ.get('API_FOLLOW_MANY_MAX') or 5000)
+    API_FOLLOW_BATCH_SIZE = 500
+    STREAM_TRANSPORT = os.environ.get('STREAM_TRANSPORT') or 'local'
+    STREAM_TRANSPORT_PATH = os.environ.get('STREAM_TRANSPORT_PATH') or \
+            os.path.join(basedir, 'instance', 'events.db')
+    STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE') or 100)
+    STREAM_HEARTBEAT = int(os.environ.get('STREAM_HEARTBEAT') or 15)
+    RECENT_POSTS_SIZE = int(os.environ.get('RECENT_POSTS_SIZE') or 200)
+    RECENT_POSTS_CHECK_INTERVAL = float(os.environ.get('RECENT_POSTS_CHECK_INTERVAL') or 5)
+    TRENDING_SIZE = int(os.environ.get('TRENDING_SIZE') or 10)
+    TRENDING_FLUSH_INTERVAL = float(os.environ.get('TRENDING_FLUSH_INTERVAL') or 10)
+    TRENDING_REFRESH_INTERVAL = float(os.environ.get('TRENDING_REFRESH_INTERVAL') or 30)
+    SUGGESTIONS_PER_USER = int(os.environ.get('SUGGESTIONS_PER_USER') or 5)
+    SUGGESTIONS_WORKERS = int(os.environ.get('SUGGESTIONS_WORKERS') or os.cpu_count() or 1)
+    SUGGESTIONS_CHUNK_SIZE = int(os.environ.get('SUGGESTIONS_CHUNK_SIZE') or 1000)
+    METRICS_ENABLED = os.environ.get('DISABLE_METRICS') is None
+    SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD') or 1.0)
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED') is not None
+    PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE') or 0)
+    PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL') or 0.001)
+    PROFILER_DIR = os.environ.get('PROFILER_DIR') or os.path.join(basedir, 'instance', 'profiles')
+    PROFILER_KEEP = int(os.environ.get('PROFILER_KEEP') or 50)
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 30)
+    LAST_SEEN_THRESHOLD = int(os.environ.get('LAST_SEEN_THRESHOLD') or 60)
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE') or 1024)
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL') or 60)
+    NAME_INDEX_CAPACITY = int(os.environ.get('NAME_INDEX_CAPACITY') or 100000)
+    NAME_INDEX_ERROR_RATE = float(os.environ.get('NAME_INDEX_ERROR_RATE') or 0.01)
+    NAME_INDEX_SYNC_INTERVAL = float(os.environ.get('NAME_INDEX_SYNC_INTERVAL') or 5)
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND') or 'memory'
+    FRAGMENT_CACHE_PATH = os.environ.get('FRAGMENT_CACHE_PATH') or \
+            os.path.join(basedir, 'instance', 'fragments.db')
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE') or 10000)
+    MATERIALIZED_TIMELINE = os.environ.get('DISABLE_MATERIALIZED_TIMELINE') is None
+    TIMELINE_FANOUT_ASYNC = os.environ.get('TIMELINE_FANOUT_SYNC') is None
+    TIMELINE_FANOUT_WORKERS = int(os.environ.get('TIMELINE_FANOUT_WORKERS') or 2)
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:260000'
+    PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH') or 16)
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)
+    LOG_DIR = os.environ.get('LOG_DIR') or os.path.join(basedir, 'logs')
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE') or 10000)
+    LOG_FILE_MAX_BYTES = int(os.environ.get('LOG_FILE_MAX_BYTES') or 10 * 1024 * 1024)
+    LOG_FILE_BACKUP_COUNT = int(os.environ.get('LOG_FILE_BACKUP_COUNT') or 10)
+    LOG_BUFFER_CAPACITY = int(os.environ.get('LOG_BUFFER_CAPACITY') or 100)
+    LOG_FLUSH_INTERVAL = int(os.environ.get('LOG_FLUSH_INTERVAL') or 5)
+    ERROR_MAIL_WINDOW = int(os.environ.get('ERROR_MAIL_WINDOW') or 60)
@@ -0,0 +1,41 @@
+"""post full-text search
+
+Revision ID: d27b5f9a4c18
+Revises: a3d8e61f0c95
+Create Date: 2026-10-18 14:58:09.117482
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd27b5f9a4c18'
+down_revision = 'a3d8e61f0c95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "CREATE VIRTUAL TABLE post_fts "
+        "USING fts5(body, content='post', content_rowid='id')")
+    op.execute(
+        "CREATE TRIGGER post_fts_insert AFTER INSERT ON post BEGIN "
+        "INSERT INTO post_fts(rowid, body) VALUES (new.id, new.body); END")
+    op.execute(
+        "CREATE TRIGGER post_fts_delete AFTER DELETE ON post BEGIN "
+        "INSERT INTO post_fts(post_fts, rowid, body) VALUES ('delete', old.id, old.body); END")
+    op.execute(
+        "CREATE TRIGGER post_fts_update AFTER UPDATE OF body ON post BEGIN "
+        "INSERT INTO post_fts(post_fts, rowid, body) VALUES ('delete', old.id, old.body); "
+        "INSERT INTO post_fts(rowid, body) VALUES (new.id, new.body); END")
+    # index existing posts
+    op.execute("INSERT INTO post_fts(post_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    op.execute('DROP TRIGGER post_fts_update')
+    op.execute('DROP TRIGGER post_fts_delete')
+    op.execute('DROP TRIGGER post_fts_insert')
+    op.execute('DROP TABLE post_fts')
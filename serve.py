@@ -0,0 +1,38 @@
+"""
+Serve the application from a gevent WSGI server, one greenlet per connection.
+
+    python serve.py --host 0.0.0.0 --port 8000
+
+Live timeline streams spend their life waiting for the next post. Under
+the threaded development server or a sync worker each open /stream holds
+a thread. Here the process is monkey patched before the application is
+imported, so the threading.Condition a stream waits on, the locks of the
+broker and the background flush threads all become greenlets: an idle
+stream costs a greenlet and a socket, and one process keeps thousands
+open. Run one process per core behind a proxy with STREAM_TRANSPORT=sqlite
+so their streams share posts. gunicorn -k gevent infographics:app patches
+the same way.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+
+from gevent.pywsgi import WSGIServer
+
+
+def make_server(app, host, port):
+    """
+    Unstarted gevent server of app, port 0 picks a free one
+    """
+    # requests are already counted by the metrics hooks, only errors are logged
+    return WSGIServer((host, port), app, log=None, error_log=app.logger)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    from infographics import app
+    make_server(app, args.host, args.port).serve_forever()
@@ -1,11 +1,75 @@
 import os
+import re
+import random
+import time
+import json
+import queue
+import logging
+import tempfile
 import unittest
+from flask import Flask, before_render_template
 from datetime import datetime, timedelta
+from sqlalchemy import event, create_engine
+from flask_mail import email_dispatched
 
-from app import app, db
+from app import create_app, db, timelines, last_seen, identities, fragments, outbox, broker
+from app import recent_posts, names, trending
+from app import database
 from app.models import md5
-from app.models import User, Post
-from config import basedir
+from app.models import follows, post_tag, User, Post, PostArchive, Tag, TagCount, Timeline
+from app.archive import archive_cutoff, archive_posts
+from app.timeline import rebuild_timelines
+from app.trending import extract_tags
+from app.suggestions import compute_suggestions, load_graph, sparse
+from app.pagination import paginate_keyset
+from app.feeds import explore_feed, home_feed, paginate_feed, search_feed
+from app.fragments import SqliteBackend
+from app.broker import Broker, SqliteTransport, Subscriber
+from app.availability import BloomFilter
+from app.log import BatchingSMTPHandler, JsonFormatter, PicklableQueueHandler, TimedMemoryHandler
+from app.log import configure_logging
+from benchmarks.startup import LAZY_MODULES, run_once
+from benchmarks import streams
+from config import basedir, Config
+try:
+    import gevent
+except ImportError:  # pragma: no cover
+    gevent = None
+
+
+class QueryCounter(object):
+    """
+    Counts SQL statements sent to the database engine
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+class TestConfig(Config):
+    """
+    Tests run against their own database, without log handlers or mail delivery
+    """
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'test.db')
+    SQLALCHEMY_BINDS = {}
+
+
+app = create_app(TestConfig)
 
 
 class UserModelTest(unittest.TestCase):
@@ -17,6 +81,7 @@ class UserModelTest(unittest.TestCase):
         Configure app context and create a new database for each test
         """
         # app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'test.db')
+        app.config['TIMELINE_FANOUT_ASYNC'] = False
         self.app_context = app.app_context()
         self.app_context.push()
         db.create_all()
@@ -41,6 +106,59 @@ class UserModelTest(unittest.TestCase):
         self.assertFalse(user.check_password('slam'))
         self.assertTrue(user.check_password('mendy'))
 
+    def test_password_upgrade(self):
+        """
+        Test hashes made with outdated parameters are replaced, inline or in the pool
+        """
+        workers, method = app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_METHOD']
+        user = User(username='mendy', email='mendy@gmail.com')
+        try:
+            for app.config['PASSWORD_HASH_WORKERS'] in (0, 1):
+                app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+                user.set_password('mendy')
+                self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+                self.assertFalse(user.upgrade_password('mendy'))
+                app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+                self.assertTrue(user.upgrade_password('mendy'))
+                self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:2000$'))
+                self.assertTrue(user.check_password('mendy'))
+        finally:
+            app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_METHOD'] = workers, method
+
+    def test_lazy_startup(self):
+        """
+        Test a cold start leaves migrations, mail and SMTP modules unimported
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            result = run_once(dict(os.environ, LOG_DIR=os.path.join(directory, 'logs'),
+                DATABASE_URL='sqlite:///' + os.path.join(directory, 'startup.db')))
+        self.assertFalse([name for name in result['modules']
+            if name.split('.')[0] in LAZY_MODULES])
+        self.assertIn('sqlalchemy', result['packages'])
+
+    @unittest.skipIf(gevent is None, 'gevent is not installed')
+    def test_idle_streams(self):
+        """
+        Test one gevent process holds many open streams without a thread each
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            report = streams.run_once(200, dict(os.environ, LOG_DIR=os.path.join(directory, 'logs'),
+                DATABASE_URL='sqlite:///' + os.path.join(directory, 'streams.db')))
+        self.assertEqual(report['subscribed'], 200)
+        self.assertEqual(report['delivered'], 200)
+        self.assertLess(report['threads_open'] - report['threads_before'], 10)
+
+    def test_bloom_filter(self):
+        """
+        Test added names are always found and few others are
+        """
+        names = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            names.add('user{}'.format(i))
+        self.assertTrue(all('user{}'.format(i) in names for i in range(1000)))
+        false_positives = sum('other{}'.format(i) in names for i in range(10000))
+        self.assertLess(false_positives, 300)
+
     def test_user_avatar(self):
         """
         Test user avatar
@@ -67,21 +185,154 @@ class UserModelTest(unittest.TestCase):
         #test is_following()
         self.assertEqual(user1.following(user2), False)
 
-        #test follow(user)
-        user1.follow(user2)
+        #test follow(user), one INSERT, one counters UPDATE and the timeline backfill
+        with QueryCounter(db.engine) as counter:
+            self.assertTrue(user1.follow(user2))
+        self.assertEqual(counter.count, 3, '\n'.join(counter.statements))
         db.session.commit()
         self.assertTrue(user1.following(user2))
         self.assertEqual(user1.followed.count(), 1)
         self.assertEqual(user1.followed.first().username, 'user2')
         self.assertEqual(user2.followers.count(), 1)
         self.assertEqual(user2.followers.first().username, 'user1')
+        self.assertEqual((user1.following_count, user1.followers_count), (1, 0))
+        self.assertEqual((user2.following_count, user2.followers_count), (0, 1))
+
+        # following twice changes nothing
+        with QueryCounter(db.engine) as counter:
+            self.assertFalse(user1.follow(user2))
+        self.assertEqual(counter.count, 1)
+        db.session.commit()
+        self.assertEqual(user1.followed.count(), 1)
+        self.assertEqual(user1.following_count, 1)
 
         # test unfollow(user)
-        user1.unfollow(user2)
+        self.assertTrue(user1.unfollow(user2))
+        self.assertFalse(user1.unfollow(user2))
         db.session.commit()
         self.assertFalse(user1.following(user2))
         self.assertEqual(user1.followed.count(), 0)
         self.assertEqual(user2.followers.count(), 0)
+        self.assertEqual((user1.following_count, user2.followers_count), (0, 0))
+
+    def test_insert_ignore(self):
+        """
+        Test duplicate follows and timeline rows are skipped on every backend path
+        """
+        users = [User(username='user{}'.format(i), email='user{}@gmail.com'.format(i))
+            for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        db.session.add_all([Post(body='Post {}'.format(i), user_id=users[i].id) for i in range(3)])
+        db.session.commit()
+        dialects = database.ON_CONFLICT_DIALECTS
+        try:
+            # other backends take the savepoint path
+            for supported in (dialects, ()):
+                database.ON_CONFLICT_DIALECTS = supported
+                db.session.execute(follows.delete())
+                rows = [{'follower_id': users[0].id, 'followed_id': user.id} for user in users[1:]]
+                self.assertEqual(database.insert_ignore(db.session, follows, rows[:1]), 1)
+                self.assertEqual(database.insert_ignore(db.session, follows, rows[:1]), 0)
+                database.insert_ignore(db.session, follows, rows)
+                db.session.commit()
+                self.assertEqual(db.session.query(follows).count(), 2)
+
+                # INSERT ... SELECT of rows partly in the timeline already
+                db.session.execute(Timeline.__table__.delete())
+                posts = db.select(Post.user_id, Post.id, Post.timestamp)
+                for select in (posts.where(Post.user_id == users[0].id), posts):
+                    db.session.execute(Timeline.insert_select(select))
+                db.session.commit()
+                self.assertEqual(Timeline.query.count(), 3)
+        finally:
+            database.ON_CONFLICT_DIALECTS = dialects
+
+    def test_suggestions(self):
+        """
+        Test two hop follows are scored the same inline and in worker processes
+        """
+        users = [User(username='user{}'.format(i), email='user{}@gmail.com'.format(i))
+            for i in range(6)]
+        db.session.add_all(users)
+        db.session.commit()
+        for follower, followed in ((0, 1), (0, 2), (1, 3), (1, 4), (2, 3), (2, 0), (3, 5)):
+            users[follower].follow(users[followed])
+        db.session.commit()
+        ids = [user.id for user in users]
+        graph = load_graph()
+        expected = [
+            (ids[0], [(ids[3], 2), (ids[4], 1)]),
+            (ids[1], [(ids[5], 1)]),
+            # ties go to the lowest id, user itself is never suggested
+            (ids[2], [(ids[1], 1), (ids[5], 1)]),
+            (ids[3], []),
+        ]
+        for workers, chunk_size in ((0, 3), (2, 1)):
+            chunks = list(compute_suggestions(graph, 2, workers, chunk_size))
+            self.assertEqual(len(chunks), -(-len(graph) // chunk_size))
+            self.assertEqual([result for chunk in chunks for result in chunk], expected)
+
+    @unittest.skipIf(sparse is None, 'NumPy and SciPy are not installed')
+    def test_suggestions_vectorized(self):
+        """
+        Test sparse matrix scoring suggests the same users as counting
+        """
+        generator = random.Random(7)
+        graph = {}
+        for follower_id in range(1, 80):
+            followed = generator.sample(range(1, 100), generator.randint(0, 12))
+            if followed:
+                graph[follower_id] = tuple(sorted(set(followed) - {follower_id}))
+        counted = list(compute_suggestions(graph, 5, chunk_size=16, vectorized=False))
+        self.assertEqual(list(compute_suggestions(graph, 5, chunk_size=16, vectorized=True)),
+            counted)
+        self.assertTrue(any(top for chunk in counted for user_id, top in chunk))
+
+    def test_last_seen_buffer(self):
+        """
+        Test last seen writes are coalesced and flushed in bulk
+        """
+        seen = datetime(2022, 11, 25, 12, 0, 0)
+        user1 = User(username='user1', email='user1@gmail.com', last_seen=seen)
+        user2 = User(username='user2', email='user2@gmail.com', last_seen=seen)
+        db.session.add_all([user1, user2])
+        db.session.commit()
+
+        # below the threshold nothing is recorded
+        self.assertFalse(last_seen.touch(user1, seen + timedelta(seconds=5)))
+        self.assertTrue(last_seen.touch(user1, seen + timedelta(minutes=5)))
+        self.assertTrue(last_seen.touch(user2, seen + timedelta(minutes=7)))
+        self.assertFalse(last_seen.touch(user1, seen + timedelta(minutes=5, seconds=5)))
+        self.assertEqual(last_seen.pending(user1.id), seen + timedelta(minutes=5))
+        self.assertEqual(user1.last_seen, seen)
+
+        # the flush evicts the cached identity of the users it wrote
+        user1 = identities.load(user1.id, User.query.get)
+        self.assertIsNotNone(identities.cache.get(user1.id))
+        self.assertEqual(last_seen.flush(), 2)
+        self.assertIsNone(identities.cache.get(user1.id))
+        self.assertEqual(last_seen.flush(), 0)
+        db.session.expire_all()
+        self.assertEqual(user1.last_seen, seen + timedelta(minutes=5))
+        self.assertEqual(user2.last_seen, seen + timedelta(minutes=7))
+
+    def test_reconcile_follow_counts(self):
+        """
+        Test counters are recomputed from follows
+        """
+        user1 = User(username='user1', email='user1@gmail.com')
+        user2 = User(username='user2', email='user2@gmail.com')
+        db.session.add_all([user1, user2])
+        db.session.commit()
+        user1.follow(user2)
+        db.session.commit()
+        user2.followers_count = 7
+        db.session.commit()
+        self.assertEqual(User.reconcile_follow_counts(), 1)
+        db.session.expire_all()
+        self.assertEqual(user2.followers_count, 1)
+        self.assertEqual(User.reconcile_follow_counts(), 0)
 
     def test_followed_posts(self):
         """
@@ -113,6 +364,983 @@ class UserModelTest(unittest.TestCase):
         self.assertEqual(user3.followed_posts().all(), [post4, post3])
         self.assertEqual(user4.followed_posts().all(), [post4])
 
+    def test_timeline(self):
+        """
+        Test materialized timeline stays in step with followed posts
+        """
+        user1 = User(username='user1', email='user1@gmail.com')
+        user2 = User(username='user2', email='user2@gmail.com')
+        user3 = User(username='user3', email='user3@gmail.com')
+        db.session.add_all([user1, user2, user3])
+        db.session.commit()
+
+        # backfill on follow
+        now = datetime.utcnow()
+        post1 = Post(body='Post from user2', timestamp = now + timedelta(seconds=1), user_id=user2.id)
+        db.session.add(post1)
+        db.session.commit()
+        user1.follow(user2)
+        user1.follow(user3)
+        db.session.commit()
+        self.assertEqual(user1.timeline().all(), [post1])
+
+        # fan-out on post creation
+        post2 = Post(body='Post from user3', timestamp = now + timedelta(seconds=5), user_id=user3.id)
+        post3 = Post(body='Post from user1', timestamp = now + timedelta(seconds=3), user_id=user1.id)
+        db.session.add_all([post2, post3])
+        db.session.flush()
+        for post in (post2, post3):
+            timelines.add_own_post(post)
+        db.session.commit()
+        timelines.fan_out(post2.id)
+        timelines.fan_out(post3.id)
+        self.assertEqual(user1.timeline().all(), [post2, post3, post1])
+        self.assertEqual(user1.timeline().all(), user1.followed_posts().all())
+        self.assertEqual(user3.timeline().all(), [post2])
+
+        # prune on unfollow
+        user1.unfollow(user3)
+        db.session.commit()
+        self.assertEqual(user1.timeline().all(), [post3, post1])
+
+        # rebuild from scratch
+        rebuild_timelines()
+        for user in (user1, user2, user3):
+            self.assertEqual(user.timeline().all(), user.followed_posts().all())
+
+    def test_keyset_pagination(self):
+        """
+        Test walking pages forwards and backwards with cursors
+        """
+        user1 = User(username='user1', email='user1@gmail.com')
+        user2 = User(username='user2', email='user2@gmail.com')
+        db.session.add_all([user1, user2])
+        db.session.commit()
+        user1.follow(user2)
+        now = datetime.utcnow()
+        # two posts share each timestamp to exercise the id tie breaker
+        posts = [Post(body='Post {}'.format(i), timestamp=now + timedelta(seconds=i // 2),
+            user_id=(user1.id, user2.id)[i % 2]) for i in range(7)]
+        db.session.add_all(posts)
+        db.session.commit()
+        newest_first = sorted(posts, key=lambda post: (post.timestamp, post.id), reverse=True)
+
+        for query in (Post.query, user1.followed_posts()):
+            page1 = paginate_keyset(query, Post.timestamp, Post.id, 3)
+            self.assertEqual(page1.items, newest_first[:3])
+            self.assertFalse(page1.has_prev)
+            page2 = paginate_keyset(query, Post.timestamp, Post.id, 3, before=page1.next_cursor)
+            self.assertEqual(page2.items, newest_first[3:6])
+            page3 = paginate_keyset(query, Post.timestamp, Post.id, 3, before=page2.next_cursor)
+            self.assertEqual(page3.items, newest_first[6:])
+            self.assertTrue(page3.has_prev)
+            self.assertFalse(page3.has_next)
+            back = paginate_keyset(query, Post.timestamp, Post.id, 3, after=page3.prev_cursor)
+            self.assertEqual(back.items, page2.items)
+            back = paginate_keyset(query, Post.timestamp, Post.id, 3, after=back.prev_cursor)
+            self.assertEqual(back.items, page1.items)
+            self.assertFalse(back.has_prev)
+            self.assertTrue(back.has_next)
+
+        # malformed cursors fall back to the first page
+        page = paginate_keyset(Post.query, Post.timestamp, Post.id, 3, before='bogus')
+        self.assertEqual(page.items, newest_first[:3])
+
+    def test_search(self):
+        """
+        Test full-text search is kept in sync, ranked and paginated
+        """
+        user = User(username='user1', email='user1@gmail.com')
+        db.session.add(user)
+        db.session.commit()
+        posts = [Post(body=body, user_id=user.id) for body in (
+            'flask talk', 'flask flask flask', 'django talk', 'Flask and sqlite', 'flask')]
+        db.session.add_all(posts)
+        db.session.commit()
+
+        found = Post.search('flask').all()
+        self.assertEqual(set(found), {posts[0], posts[1], posts[3], posts[4]})
+        self.assertEqual(Post.search('flask talk').all(), [posts[0]])
+        # FTS5 syntax in user input is not interpreted
+        self.assertEqual(set(Post.search('talk" *').all()), {posts[0], posts[2]})
+        self.assertEqual(Post.search('  ').all(), [])
+
+        # keyset pages follow the ranking
+        page1 = paginate_feed(search_feed('flask'), 2)
+        page2 = paginate_feed(search_feed('flask'), 2, before=page1.next_cursor)
+        self.assertEqual([post.id for post in page1.items + page2.items],
+            [post.id for post in found])
+        self.assertFalse(page2.has_next)
+        back = paginate_feed(search_feed('flask'), 2, after=page2.prev_cursor)
+        self.assertEqual([post.id for post in back.items], [post.id for post in page1.items])
+
+        # triggers follow updates and deletes
+        posts[2].body = 'flask now'
+        db.session.delete(posts[4])
+        db.session.commit()
+        self.assertEqual(len(Post.search('flask').all()), 4)
+        self.assertEqual(Post.search('django').all(), [])
+        Post.reindex_search()
+        self.assertEqual(len(Post.search('flask').all()), 4)
+
+    def test_bulk_export_import(self):
+        """
+        Test data export streams rows that data import loads back with derived data
+        """
+        u1 = User(username='user1', email='user1@gmail.com')
+        u2 = User(username='user2', email='user2@gmail.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u1.follow(u2)
+        db.session.add_all([Post(body='bulk flask', author=u2), Post(body='other', author=u1)])
+        db.session.commit()
+        ids = u1.id, u2.id
+        runner = app.test_cli_runner(mix_stderr=False)
+        ndjson = runner.invoke(args=['data', 'export']).stdout
+        self.assertEqual(len(ndjson.splitlines()), 5)
+        posts_csv = runner.invoke(args=['data', 'export', '--format', 'csv', '--kind', 'posts']).stdout
+        self.assertEqual(posts_csv.splitlines()[0], 'id,body,timestamp,user_id')
+        self.assertNotEqual(runner.invoke(args=['data', 'export', '--format', 'csv']).exit_code, 0)
+
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        users_and_follows = '\n'.join(line for line in ndjson.splitlines() if '"post"' not in line)
+        pragmas = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('PRAGMA synchronous ='):
+                pragmas.append((conn.connection.dbapi_connection, statement))
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            result = runner.invoke(args=['data', 'import', '--batch-size', '2'],
+                input=users_and_follows)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(result.exit_code, 0, result.output)
+        # durability is turned off and restored once, on the same connection
+        self.assertEqual(len(pragmas), 2)
+        self.assertIs(pragmas[0][0], pragmas[1][0])
+        self.assertEqual(pragmas[0][1], 'PRAGMA synchronous = OFF')
+        result = runner.invoke(args=['data', 'import', '--format', 'csv', '--kind', 'posts'],
+            input=posts_csv)
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        u1, u2 = User.query.get(ids[0]), User.query.get(ids[1])
+        self.assertTrue(u1.following(u2))
+        self.assertEqual(u2.followers_count, 1)
+        self.assertEqual([post.body for post in u1.timeline()], ['other', 'bulk flask'])
+        self.assertEqual([post.body for post in Post.search('flask')], ['bulk flask'])
+        # triggers are back after the import
+        db.session.add(Post(body='flask again', author=u1))
+        db.session.commit()
+        self.assertEqual(Post.search('flask').count(), 2)
+
+    def test_error_mail_digest(self):
+        """
+        Test queued error records keep their traceback and are mailed once per place
+        """
+        records = queue.Queue()
+        logger = logging.getLogger('test_error_mail_digest')
+        logger.addHandler(PicklableQueueHandler(records))
+        for user_id in (1, 2, 3):
+            try:
+                raise ValueError('broken')
+            except ValueError:
+                logger.exception('Failed for user %s', user_id)
+        logger.error('Other failure')
+        handler = BatchingSMTPHandler(('localhost', 25), 'no-reply@localhost', ['admin@localhost'],
+            'Infographics Failure', window=3600)
+        while not records.empty():
+            handler.emit(records.get())
+        batch = list(handler.pending.values())
+        handler.pending.clear()
+        handler.timer.cancel()
+        self.assertEqual([count for record, count in batch], [3, 1])
+        message = handler.compose(batch)
+        self.assertEqual(message['Subject'], 'Infographics Failure (4 errors)')
+        body = message.get_content()
+        self.assertIn('3x Failed for user 1', body)
+        self.assertIn('ValueError: broken', body)
+
+        entry = json.loads(JsonFormatter().format(batch[0][0]))
+        self.assertEqual(entry['level'], 'ERROR')
+        self.assertEqual(entry['message'], 'Failed for user 1')
+        self.assertIn('ValueError: broken', entry['exception'])
+
+    def test_timed_log_flush(self):
+        """
+        Test a lone buffered record is written once the flush interval is over
+        """
+        records = []
+        target = logging.Handler()
+        target.emit = records.append
+        handler = TimedMemoryHandler(100, 0.05, target=target)
+        try:
+            handler.handle(logging.makeLogRecord({'msg': 'alone', 'levelno': logging.INFO}))
+            self.assertEqual(records, [])
+            time.sleep(0.3)
+            self.assertEqual([record.msg for record in records], ['alone'])
+            self.assertIsNone(handler.timer)
+        finally:
+            handler.close()
+        # closing stops the timer of a buffered record
+        handler = TimedMemoryHandler(100, 3600, target=target)
+        handler.handle(logging.makeLogRecord({'msg': 'closed', 'levelno': logging.INFO}))
+        timer = handler.timer
+        handler.close()
+        timer.join(1)
+        self.assertFalse(timer.is_alive())
+        self.assertEqual([record.msg for record in records], ['alone', 'closed'])
+
+    def test_log_shutdown(self):
+        """
+        Test stopping logging writes buffered records to the log file and closes it
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            logged = Flask('logged')
+            logged.config.update(MAIL_SERVER=None, LOG_DIR=directory, LOG_FLUSH_INTERVAL=3600)
+            configure_logging(logged)
+            file_handler = logged.extensions['log_listener'].handlers[-1].target
+            logged.logger.info('Buffered until shutdown')
+            logged.extensions['log_shutdown']()
+            with open(os.path.join(directory, 'infographics.log')) as f:
+                entry = json.loads(f.read())
+            self.assertEqual(entry['message'], 'Buffered until shutdown')
+            self.assertIsNone(file_handler.stream)
+
+    def test_mail_queue(self):
+        """
+        Test mail is sent from the background thread
+        """
+        sent = []
+        def record(message, app):
+            sent.append(message)
+        email_dispatched.connect(record)
+        try:
+            # testing applications only pretend to send
+            outbox.send_email('Hello', 'no-reply@localhost', ['user1@gmail.com'], 'Hi')
+            outbox.join()
+        finally:
+            email_dispatched.disconnect(record)
+        self.assertEqual([message.subject for message in sent], ['Hello'])
+
+    def test_broker_queues(self):
+        """
+        Test stream queues drop their oldest events and workers share events through SQLite
+        """
+        subscriber = Subscriber(1, [2], maxsize=2)
+        for id in range(3):
+            subscriber.put({'author_id': 2, 'id': id})
+        self.assertEqual([event['id'] for event in subscriber.get_all(0)], [1, 2])
+        self.assertEqual(subscriber.dropped, 1)
+        self.assertEqual(subscriber.get_all(0), [])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'events.db')
+            received = []
+            # the poll thread sleeps through the test, polls are explicit
+            worker1, worker2 = SqliteTransport(path, interval=3600), SqliteTransport(path)
+            # nothing is opened until a worker uses the transport
+            self.assertFalse(os.path.exists(path))
+            worker1.start(received.append)
+            worker2.publish({'author_id': 2, 'id': 7, 'data': '{}'})
+            self.assertEqual(worker1.poll(), 1)
+            self.assertEqual(received, [{'author_id': 2, 'id': 7, 'data': '{}'}])
+            self.assertEqual(worker1.poll(), 0)
+
+            # a follow of many authors reaches the streams of the other worker as one event
+            local, remote = Broker(), Broker()
+            local.app, local.transport = app, worker1
+            remote.transport = worker2
+            subscriber = local.subscribe(1, [])
+            remote.follow(1, [2, 3])
+            self.assertEqual(worker1.poll(), 1)
+            for author in (2, 3):
+                remote.publish({'author_id': author, 'id': 6 + author, 'data': '{}'})
+            self.assertEqual(worker1.poll(), 2)
+            self.assertEqual([event['id'] for event in subscriber.get_all(0)], [8, 9])
+            worker1.stop()
+
+    def test_feed_views(self):
+        """
+        Test projected feeds carry author data without ORM objects
+        """
+        user1 = User(username='user1', email='user1@gmail.com')
+        user2 = User(username='user2', email='user2@gmail.com')
+        db.session.add_all([user1, user2])
+        db.session.commit()
+        user1.follow(user2)
+        db.session.add(Post(body='Post from user2', user_id=user2.id))
+        db.session.commit()
+        rebuild_timelines()
+
+        for feed in (home_feed(user1), explore_feed()):
+            page = paginate_feed(feed, 10)
+            self.assertEqual(len(page.items), 1)
+            post = page.items[0]
+            self.assertEqual(post.body, 'Post from user2')
+            self.assertEqual(post.author.username, 'user2')
+            self.assertEqual(post.author.avatar(36), user2.avatar(36))
+            self.assertNotIsInstance(post, Post)
+
+
+class RouteTest(unittest.TestCase):
+    """
+    Test post list pages and the cost of serving them
+    """
+    def setUp(self):
+        """
+        Create users with posts and log one of them in
+        """
+        app.config['TIMELINE_FANOUT_ASYNC'] = False
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        users = [User(username='user{}'.format(i), email='user{}@gmail.com'.format(i))
+            for i in range(5)]
+        for user in users:
+            user.set_password('secret')
+        db.session.add_all(users)
+        db.session.commit()
+        for user in users[1:]:
+            users[0].follow(user)
+        db.session.add_all([Post(body='Post {}'.format(i), user_id=users[i % 5].id)
+            for i in range(60)])
+        db.session.commit()
+        rebuild_timelines()
+        self.engine = db.engine
+        # requests get their own app context and session, as in production
+        db.session.remove()
+        self.app_context.pop()
+        identities.clear()
+        fragments.clear()
+        recent_posts.clear()
+        names.clear()
+        trending.clear()
+        self.client = app.test_client()
+        self.client.post('/login', data={'username': 'user0', 'password': 'secret'})
+        # first request puts user0 in the identity cache
+        self.client.get('/metrics')
+
+    def tearDown(self):
+        """
+        Drop database tables
+        """
+        last_seen.flush()
+        with app.app_context():
+            db.drop_all()
+        app.config['WTF_CSRF_ENABLED'] = True
+
+    def assertQueries(self, url, expected):
+        """
+        Assert a GET of url renders a full page with expected queries
+        """
+        with QueryCounter(self.engine) as counter:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data.count(b'says:'), app.config['POSTS_PER_PAGE'])
+        self.assertEqual(counter.count, expected, '\n'.join(counter.statements))
+
+    def test_index_queries(self):
+        """
+        Test home page loads authors with its posts
+        """
+        self.assertQueries('/index', 2)
+
+    def test_explore_queries(self):
+        """
+        Test explore page loads authors with its posts and the trending tags
+        """
+        self.assertQueries('/explore', 3)
+
+    def test_recent_posts(self):
+        """
+        Test first explore pages are served from memory and kept up to date
+        """
+        self.assertQueries('/explore', 3)
+        response = self.client.get('/explore')
+        self.assertQueries('/explore', 0)
+        older = response.data.split(b'?before=')[1].split(b'"')[0].decode()
+        self.assertQueries('/explore?before=' + older, 0)
+
+        # a post written by another worker shows once the version is checked
+        with app.app_context():
+            db.session.add(Post(body='Elsewhere post', user_id=2))
+            db.session.commit()
+        self.assertNotIn(b'Elsewhere post', self.client.get('/explore').data)
+        recent_posts.expire()
+        self.assertIn(b'Elsewhere post', self.client.get('/explore').data)
+        self.client.post('/index', data={'post': 'Local post'})
+        self.assertIn(b'Local post', self.client.get('/explore').data)
+        self.assertQueries('/explore', 0)
+
+        # pages past the buffer come from the database
+        size = app.config['RECENT_POSTS_SIZE']
+        app.config['RECENT_POSTS_SIZE'] = 15
+        recent_posts.clear()
+        try:
+            response = self.client.get('/explore')
+            older = response.data.split(b'?before=')[1].split(b'"')[0].decode()
+            self.assertQueries('/explore?before=' + older, 1)
+            response = self.client.get('/explore?before=' + older)
+            newer = response.data.split(b'?after=')[1].split(b'"')[0].decode()
+            self.assertQueries('/explore?after=' + newer, 0)
+        finally:
+            app.config['RECENT_POSTS_SIZE'] = size
+
+    def test_post_archive(self):
+        """
+        Test old posts move to the archive and feeds page on into it
+        """
+        with app.app_context():
+            old = datetime.utcnow() - timedelta(days=400)
+            for post in Post.query.order_by(Post.id).limit(30):
+                post.timestamp = old + timedelta(seconds=post.id)
+            db.session.commit()
+            moved = []
+            self.assertEqual(archive_posts(archive_cutoff(365), batch_size=7,
+                report=moved.append), 30)
+            self.assertEqual(moved, [7, 14, 21, 28, 30])
+            self.assertEqual((Post.query.count(), PostArchive.query.count()), (30, 30))
+            self.assertEqual(Timeline.query.filter(Timeline.post_id <= 30).count(), 0)
+            self.assertEqual(archive_posts(archive_cutoff(365)), 0)
+
+        for url in ('/explore', '/index'):
+            bodies, link, cursors = [], '', []
+            for _ in range(6):
+                response = self.client.get(url + link)
+                bodies += [int(body) for body in
+                    re.findall(rb'says:<br />Post (\d+)', response.data)]
+                if b'?before=' not in response.data:
+                    break
+                cursor = response.data.split(b'?before=')[1].split(b'"')[0].decode()
+                cursors.append(cursor)
+                link = '?before=' + cursor
+            # hot posts first, then the archive newest first
+            self.assertEqual(bodies, list(range(59, -1, -1)))
+            self.assertEqual([cursor.startswith('a') for cursor in cursors],
+                [False, False, False, True, True])
+            response = self.client.get(url + '?before=' + cursors[2])
+            newer = response.data.split(b'?after=')[1].split(b'"')[0].decode()
+            self.assertTrue(newer.startswith('a'))
+            response = self.client.get(url + '?after=' + newer)
+            self.assertIn(b'Post 30\n', response.data)
+            self.assertNotIn(b'Post 29\n', response.data)
+
+        # API pages go on in the archive, polls for new posts stay in the hot table
+        page = self.client.get('/api/v1/users/user1/posts?count=100').get_json()
+        self.assertEqual(len(page['posts']), 12)
+        page = self.client.get('/api/v1/explore?count=25&max_id=40').get_json()
+        self.assertEqual([post['id'] for post in page['posts']], list(range(40, 15, -1)))
+        with QueryCounter(self.engine) as counter:
+            self.client.get('/api/v1/explore?since_id=60')
+        self.assertEqual(counter.count, 1)
+
+    def test_post_archive_boundary(self):
+        """
+        Test posts written out of timestamp order are paged by id exactly once across the archive
+        """
+        with app.app_context():
+            old = datetime.utcnow() - timedelta(days=400)
+            for post in Post.query.filter(Post.id <= 30):
+                post.timestamp = old + timedelta(seconds=post.id)
+            # a recent post below old ones, and an old post above recent ones
+            db.session.get(Post, 10).timestamp = datetime.utcnow()
+            db.session.get(Post, 40).timestamp = old
+            db.session.commit()
+            rebuild_timelines()
+            self.assertEqual(archive_posts(archive_cutoff(365)), 9)
+            self.assertEqual(db.session.query(db.func.max(PostArchive.id)).scalar(), 9)
+            self.assertIsNotNone(db.session.get(Post, 40))
+
+        ids, max_id = [], ''
+        while True:
+            page = self.client.get('/api/v1/explore?count=1' + max_id).get_json()
+            ids += [post['id'] for post in page['posts']]
+            if not page['has_more']:
+                break
+            max_id = '&max_id={}'.format(page['oldest_id'] - 1)
+        self.assertEqual(ids, list(range(60, 0, -1)))
+
+        # HTML pages stay in timestamp order, the old hot post comes after the archive
+        with app.app_context():
+            posts = [(post.timestamp, post.id, post.user_id) for model in (Post, PostArchive)
+                for post in model.query]
+        posts.sort(reverse=True)
+        self.assertEqual(posts[-1][1], 40)
+        for url, authors in (('/explore', range(1, 6)), ('/index', range(1, 6)),
+                ('/user/user4', [5])):
+            bodies, link = [], ''
+            while True:
+                response = self.client.get(url + link)
+                bodies += [int(body) for body in
+                    re.findall(rb'says:<br />Post (\d+)', response.data)]
+                if b'?before=' not in response.data:
+                    break
+                link = '?before=' + response.data.split(b'?before=')[1].split(b'"')[0].decode()
+            self.assertEqual(bodies, [id - 1 for timestamp, id, user_id in posts
+                if user_id in authors])
+
+    def test_archive_everything(self):
+        """
+        Test archiving every old post keeps the newest so new ids stay above the archive
+        """
+        with app.app_context():
+            self.assertEqual(archive_posts(archive_cutoff(-1)), 59)
+            self.assertEqual([post.id for post in Post.query], [60])
+        self.client.post('/index', data={'post': 'After the archive'})
+        with app.app_context():
+            self.assertEqual(db.session.query(db.func.max(Post.id)).scalar(), 61)
+        ids, max_id = [], ''
+        while True:
+            page = self.client.get('/api/v1/explore?count=25' + max_id).get_json()
+            ids += [post['id'] for post in page['posts']]
+            if not page['has_more']:
+                break
+            max_id = '&max_id={}'.format(page['oldest_id'] - 1)
+        self.assertEqual(ids, list(range(61, 0, -1)))
+
+    def test_trending(self):
+        """
+        Test hashtags are indexed, counted in buckets and shown on explore
+        """
+        self.assertEqual(extract_tags('#Flask and #flask, a#b #sqlite_3'), ['flask', 'sqlite_3'])
+        for body in ('Learning #Flask', '#flask with #sqlite', 'No tags'):
+            self.client.post('/index', data={'post': body})
+        with app.app_context():
+            self.assertEqual(sorted(name for name, in db.session.query(Tag.name)),
+                ['flask', 'sqlite'])
+            self.assertEqual(db.session.query(post_tag).count(), 3)
+        self.assertEqual(trending.flush(), 6)
+        trending.expire()
+        response = self.client.get('/explore')
+        self.assertIn(b'Trending this hour:', response.data)
+        self.assertIn(b'#flask</a> (2)', response.data)
+        self.assertIn(b'#sqlite</a> (1)', response.data)
+        self.assertQueries('/explore', 0)
+
+        # windows only sum their own buckets, expired ones are pruned
+        later = datetime.utcnow() + timedelta(hours=3)
+        trending.expire()
+        with app.app_context():
+            top = trending.top(later)
+        self.assertEqual(top, {'hour': (), 'day': (('flask', 2), ('sqlite', 1))})
+        trending.flush(later)
+        with app.app_context():
+            self.assertEqual(TagCount.query.filter_by(span=60).count(), 0)
+            self.assertEqual(TagCount.query.filter_by(span=3600).count(), 2)
+
+        # the backfill indexes existing posts and recounts the buckets
+        with app.app_context():
+            db.session.execute(db.delete(post_tag))
+            db.session.execute(db.delete(TagCount))
+            db.session.add(Post(body='Imported #flask post', user_id=2,
+                timestamp=datetime.utcnow() - timedelta(minutes=90)))
+            db.session.commit()
+            result = app.test_cli_runner(mix_stderr=False).invoke(
+                args=['tags', 'backfill', '--batch-size', '7'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Indexed hashtags of 64 posts', result.stdout)
+            self.assertEqual(db.session.query(post_tag).count(), 4)
+            trending.expire()
+            top = trending.top()
+        self.assertEqual(top['hour'], (('flask', 2), ('sqlite', 1)))
+        self.assertEqual(dict(top['day'])['flask'], 3)
+
+    def test_who_to_follow(self):
+        """
+        Test stored suggestions show on the profile of current_user until followed
+        """
+        with app.app_context():
+            user0, user1, user4 = (User.query.filter_by(username=username).first()
+                for username in ('user0', 'user1', 'user4'))
+            user0.unfollow(user4)
+            user1.follow(user4)
+            db.session.commit()
+            result = app.test_cli_runner(mix_stderr=False).invoke(
+                args=['suggestions', 'compute', '--workers', '0'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Stored 1 suggestions', result.stdout)
+        response = self.client.get('/user/user0')
+        self.assertIn(b'Who to follow:', response.data)
+        self.assertIn(b'>user4</a>\n    (1 followed)', response.data)
+        self.assertNotIn(b'Who to follow:', self.client.get('/user/user1').data)
+        self.client.post('/follow/user4/', data={})
+        self.assertNotIn(b'Who to follow:', self.client.get('/user/user0').data)
+
+    def test_follow_many(self):
+        """
+        Test contacts are followed in one transaction by username or email
+        """
+        with app.app_context():
+            db.session.add_all([User(username='user{}'.format(i),
+                email='user{}@gmail.com'.format(i)) for i in range(5, 7)])
+            db.session.commit()
+        self.client.post('/unfollow/user1/', data={})
+        response = self.client.post('/api/v1/follow', json={
+            'usernames': ['user1', 'user2', 'user5', 'nobody', 'user0'],
+            'emails': ['user6@gmail.com', 'user5@gmail.com']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(),
+            {'followed': ['user1', 'user5', 'user6'], 'not_found': ['nobody']})
+        with app.app_context():
+            user0, user5 = (User.query.filter_by(username=username).first()
+                for username in ('user0', 'user5'))
+            self.assertEqual(user0.following_count, 6)
+            self.assertEqual(user5.followers_count, 1)
+            self.assertEqual(user0.followed.count(), 6)
+        # posts of the followed users are backfilled into the timeline
+        page = self.client.get('/api/v1/timeline?count=100').get_json()
+        self.assertEqual(len(page['posts']), 60)
+
+        response = self.client.post('/api/v1/follow', json={'usernames': ['user1']})
+        self.assertEqual(response.get_json(), {'followed': [], 'not_found': []})
+        response = self.client.post('/api/v1/follow', data={'usernames': 'user1'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/v1/follow', json={'usernames': 'user1'})
+        self.assertEqual(response.get_json(), {'error': 'usernames must be a list of strings'})
+
+    def test_profiler(self):
+        """
+        Test admins and sampled requests get collapsed stack profiles
+        """
+        config = {name: app.config[name] for name in ('ADMINS', 'PROFILER_DIR',
+            'PROFILER_ENABLED', 'PROFILER_KEEP', 'PROFILER_SAMPLE_RATE')}
+
+        def slow_render(sender, template, context, **extra):
+            time.sleep(0.02)
+
+        with tempfile.TemporaryDirectory() as directory:
+            app.config['PROFILER_DIR'] = directory
+            # give the sampler something to see while templates render
+            before_render_template.connect(slow_render, app)
+            try:
+                # disabled, not even admins get profiles
+                app.config['ADMINS'] = ['user0@gmail.com']
+                response = self.client.get('/explore', headers={'X-Profile': '1'})
+                self.assertNotIn('X-Profile', response.headers)
+                self.assertEqual(self.client.get('/admin/profiles').status_code, 404)
+                self.assertEqual(os.listdir(directory), [])
+
+                app.config['PROFILER_ENABLED'] = True
+                app.config['ADMINS'] = config['ADMINS']
+                # only admins can ask for a profile or see them
+                response = self.client.get('/explore', headers={'X-Profile': '1'})
+                self.assertNotIn('X-Profile', response.headers)
+                self.assertEqual(self.client.get('/admin/profiles').status_code, 404)
+
+                app.config['ADMINS'] = ['user0@gmail.com']
+                response = self.client.get('/explore?_profile=1')
+                name = response.headers['X-Profile']
+                self.assertTrue(name.endswith('_main.explore_{}.collapsed'.format(os.getpid())))
+                with open(os.path.join(directory, name)) as f:
+                    lines = f.read().splitlines()
+                self.assertTrue(all(re.match(r'^\S+ \d+$', line) for line in lines), lines)
+                # view and template rendering frames are in the stacks
+                self.assertTrue(any('app.routes:explore' in line
+                    and 'flask.templating:_render' in line for line in lines), lines)
+                self.assertIn(name.encode(), self.client.get('/admin/profiles').data)
+                response = self.client.get('/admin/profiles/' + name)
+                self.assertEqual(response.data.decode().splitlines(), lines)
+                self.assertIn('attachment', response.headers['Content-Disposition'])
+                response.close()
+
+                # sampled requests are profiled for everyone, the newest are kept
+                app.config['ADMINS'] = []
+                app.config['PROFILER_SAMPLE_RATE'] = 1.0
+                app.config['PROFILER_KEEP'] = 2
+                names = [self.client.get(url).headers['X-Profile']
+                    for url in ('/index', '/user/user1')]
+                self.assertEqual(sorted(os.listdir(directory), reverse=True), names[::-1])
+            finally:
+                before_render_template.disconnect(slow_render, app)
+                app.config.update(config)
+
+    def test_user_queries(self):
+        """
+        Test user profile page loads authors with its posts
+        """
+        self.assertQueries('/user/user1', 4)
+
+    def test_metrics(self):
+        """
+        Test request costs are exposed per endpoint
+        """
+        def explore_samples():
+            response = self.client.get('/metrics')
+            self.assertEqual(response.status_code, 200)
+            return dict(line.rsplit(' ', 1) for line in response.get_data(as_text=True).splitlines()
+                if '{endpoint="main.explore"' in line)
+
+        before = explore_samples()
+        self.client.get('/explore')
+        after = explore_samples()
+        count = 'infographics_request_duration_seconds_count{endpoint="main.explore"}'
+        self.assertEqual(int(after[count]), int(before.get(count, 0)) + 1)
+        queries = 'infographics_request_sql_queries_sum{endpoint="main.explore"}'
+        self.assertEqual(float(after[queries]) - float(before.get(queries, 0)), 3)
+        self.assertIn('infographics_request_render_duration_seconds_bucket'
+            '{endpoint="main.explore",le="+Inf"}', after)
+
+    def test_identity_cache(self):
+        """
+        Test current_user is served from cache until the user changes
+        """
+        hits = identities.cache.hits
+        with QueryCounter(self.engine) as counter:
+            self.client.get('/metrics')
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(identities.cache.hits, hits + 1)
+
+        response = self.client.post('/edit_profile', data={'username': 'renamed', 'about_me': ''})
+        self.assertEqual(response.status_code, 200)
+        with QueryCounter(self.engine) as counter:
+            response = self.client.get('/index')
+        self.assertIn(b'Hello, renamed!', response.data)
+        self.assertEqual(counter.count, 3)
+
+    def test_conditional_get(self):
+        """
+        Test unchanged pages are answered with 304 after one small query
+        """
+        for url in ('/index', '/explore', '/user/user1', '/explore?before=bogus'):
+            etag = self.client.get(url).headers['ETag']
+            with QueryCounter(self.engine) as counter:
+                response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.data, b'')
+            self.assertLessEqual(counter.count, 1, '\n'.join(counter.statements))
+
+        last_modified = self.client.get('/explore').headers['Last-Modified']
+        response = self.client.get('/explore', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+        # a new post changes every validator
+        etags = {url: self.client.get(url).headers['ETag']
+            for url in ('/index', '/explore', '/user/user0')}
+        self.client.post('/index', data={'post': 'Fresh post'})
+        for url, etag in etags.items():
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200, url)
+            self.assertIn(b'Fresh post', response.data)
+
+        # following one user and unfollowing another keeps the count and newest post
+        self.client.post('/unfollow/user2/', follow_redirects=True)
+        etag = self.client.get('/index').headers['ETag']
+        self.client.post('/follow/user2/', follow_redirects=True)
+        self.client.post('/unfollow/user1/', follow_redirects=True)
+        response = self.client.get('/index', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b'Post 56\n', response.data)
+
+    def test_login_upgrades_password(self):
+        """
+        Test signing in rehashes a password made with outdated parameters
+        """
+        method = app.config['PASSWORD_HASH_METHOD']
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        try:
+            self.client.get('/logout')
+            self.client.post('/login', data={'username': 'user0', 'password': 'secret'})
+            with app.app_context():
+                user = User.query.filter_by(username='user0').first()
+                self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+            self.assertEqual(self.client.get('/index').status_code, 200)
+        finally:
+            app.config['PASSWORD_HASH_METHOD'] = method
+
+    def test_replica_routing(self):
+        """
+        Test GET requests read from the replica until their client writes
+        """
+        path = app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+        replica = create_engine('sqlite:///file:{}?mode=ro&uri=true'.format(path))
+        with app.app_context():
+            engines = db.engines
+        engines['replica'] = replica
+        try:
+            with QueryCounter(self.engine) as primary, QueryCounter(replica) as reads:
+                self.assertEqual(self.client.get('/explore').status_code, 200)
+            self.assertEqual(primary.count, 0)
+            self.assertEqual(reads.count, 3)
+
+            # the read-only replica would refuse the write
+            response = self.client.post('/index', data={'post': 'Routed post'})
+            self.assertEqual(response.status_code, 302)
+            with QueryCounter(self.engine) as primary, QueryCounter(replica) as reads:
+                response = self.client.get('/index')
+            self.assertIn(b'Routed post', response.data)
+            self.assertEqual(reads.count, 0)
+            self.assertGreater(primary.count, 0)
+        finally:
+            del engines['replica']
+            replica.dispose()
+
+    def test_available(self):
+        """
+        Test free names are answered without a query and taken ones are confirmed
+        """
+        url = '/api/v1/available?username={}&email={}'
+        self.assertEqual(self.client.get('/api/v1/available').status_code, 400)
+        self.client.get(url.format('free', 'free@gmail.com'))
+        with QueryCounter(self.engine) as counter:
+            response = self.client.get(url.format('newbie', 'newbie@gmail.com'))
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(response.json, {'username': {'value': 'newbie', 'available': True},
+            'email': {'value': 'newbie@gmail.com', 'available': True}})
+        with QueryCounter(self.engine) as counter:
+            response = self.client.get('/api/v1/available?username=user1')
+        self.assertEqual(counter.count, 1)
+        self.assertFalse(response.json['username']['available'])
+
+        # registered by another worker, unknown to the filter until it syncs
+        with app.app_context():
+            db.session.execute(db.insert(User).values(username='elsewhere',
+                email='elsewhere@gmail.com'))
+            db.session.commit()
+        self.client.get('/logout')
+        response = self.client.post('/register', data={'username': 'elsewhere',
+            'email': 'other@gmail.com', 'password': 'secret', 'password2': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Please provide a different username', response.data)
+        interval = app.config['NAME_INDEX_SYNC_INTERVAL']
+        app.config['NAME_INDEX_SYNC_INTERVAL'] = 0
+        try:
+            response = self.client.get('/api/v1/available?email=elsewhere@gmail.com')
+            self.assertFalse(response.json['email']['available'])
+        finally:
+            app.config['NAME_INDEX_SYNC_INTERVAL'] = interval
+
+        response = self.client.post('/register', data={'username': 'newbie',
+            'email': 'newbie@gmail.com', 'password': 'secret', 'password2': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(url.format('newbie', 'newbie@gmail.com'))
+        self.assertFalse(response.json['username']['available'])
+        self.assertFalse(response.json['email']['available'])
+
+    def test_api_polling(self):
+        """
+        Test JSON feeds page by post id and answer empty polls with one query
+        """
+        newest = {}
+        for url, total in (('/api/v1/explore', 60), ('/api/v1/timeline', 60),
+                ('/api/v1/users/user1/posts', 12)):
+            page = self.client.get(url + '?count=5').get_json()
+            newest[url] = page['newest_id']
+            self.assertEqual(len(page['posts']), 5)
+            self.assertTrue(page['has_more'])
+            ids = [post['id'] for post in page['posts']]
+            self.assertEqual(ids, sorted(ids, reverse=True))
+            self.assertEqual(page['newest_id'], ids[0])
+            rest = self.client.get('{}?count=100&max_id={}'.format(url, ids[-1] - 1)).get_json()
+            self.assertEqual(len(rest['posts']) + 5, total)
+            self.assertFalse(rest['has_more'])
+
+            with QueryCounter(self.engine) as counter:
+                poll = self.client.get('{}?since_id={}'.format(url, page['newest_id'])).get_json()
+            self.assertEqual(poll['posts'], [])
+            self.assertEqual(poll['newest_id'], page['newest_id'])
+            # an empty page of a user also checks that the user exists
+            self.assertEqual(counter.count, 2 if 'users' in url else 1,
+                '\n'.join(counter.statements))
+
+        post = page['posts'][0]
+        self.assertEqual(post['author']['username'], 'user1')
+        self.assertTrue(post['timestamp'].endswith('+00:00'))
+        self.client.post('/index', data={'post': 'Polled post'})
+        poll = self.client.get('/api/v1/timeline?since_id={}'.format(
+            newest['/api/v1/timeline'])).get_json()
+        self.assertEqual([post['body'] for post in poll['posts']], ['Polled post'])
+
+        self.assertEqual(self.client.get('/api/v1/users/nobody/posts').status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/explore?since_id=x').status_code, 400)
+        self.client.get('/logout')
+        response = self.client.get('/api/v1/explore')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.get_json(), {'error': 'Authentication required'})
+
+    def test_stream(self):
+        """
+        Test the event stream replays missed posts then pushes followed authors
+        """
+        newest = self.client.get('/api/v1/timeline?count=3').get_json()['posts']
+        response = self.client.get('/stream', headers={'Last-Event-ID': str(newest[-1]['id'])})
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = iter(response.response)
+        for post in reversed(newest[:-1]):
+            self.assertTrue(next(events).decode().startswith(
+                'id: {}\nevent: post\n'.format(post['id'])))
+
+        author = app.test_client()
+        author.post('/login', data={'username': 'user1', 'password': 'secret'})
+        author.post('/index', data={'post': 'Streamed post'})
+        event = next(events).decode()
+        self.assertIn('"body":"Streamed post"', event)
+        self.assertIn('"username":"user1"', event)
+        self.assertEqual(len(broker._subscribers), 1)
+        response.close()
+        self.assertEqual(len(broker._subscribers), 0)
+
+        # past a gap longer than the queue the newest posts are replayed
+        size = app.config['STREAM_QUEUE_SIZE']
+        app.config['STREAM_QUEUE_SIZE'] = 2
+        try:
+            response = self.client.get('/stream', headers={'Last-Event-ID': str(newest[-1]['id'])})
+            events = iter(response.response)
+            replayed = [re.match(r'id: (\d+)', next(events).decode()).group(1) for _ in range(2)]
+            response.close()
+        finally:
+            app.config['STREAM_QUEUE_SIZE'] = size
+        newest = self.client.get('/api/v1/timeline?count=2').get_json()['posts']
+        self.assertEqual(replayed, [str(post['id']) for post in reversed(newest)])
+
+    def test_search_page(self):
+        """
+        Test search results are rendered and paginated
+        """
+        response = self.client.get('/search?q=post')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data.count(b'says:'), app.config['POSTS_PER_PAGE'])
+        self.assertIn(b'more matches', response.data)
+        response = self.client.get('/search?q=nothing')
+        self.assertIn(b'No posts match nothing', response.data)
+
+    def test_fragment_cache(self):
+        """
+        Test post fragments are reused until their author is renamed
+        """
+        self.client.get('/explore')
+        hits = fragments.hits
+        response = self.client.get('/explore')
+        self.assertEqual(fragments.hits, hits + app.config['POSTS_PER_PAGE'])
+        self.assertIn(b'<a href="/user/user0">', response.data)
+
+        self.client.post('/edit_profile', data={'username': 'renamed', 'about_me': ''})
+        response = self.client.get('/explore')
+        self.assertIn(b'<a href="/user/renamed">', response.data)
+        self.assertNotIn(b'<a href="/user/user0">', response.data)
+
+    def test_sqlite_fragment_backend(self):
+        """
+        Test shared fragment store keeps the most recently used entries
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            backend = SqliteBackend(os.path.join(directory, 'fragments.db'), maxsize=3)
+            # nothing is opened until a worker uses the cache
+            self.assertFalse(os.path.exists(backend.path))
+            backend.set_many({'a': '<p>a</p>', 'b': '<p>b</p>'})
+            self.assertEqual(backend.get_many(['a', 'b', 'c']), {'a': '<p>a</p>', 'b': '<p>b</p>'})
+            other = SqliteBackend(backend.path, maxsize=3)
+            self.assertEqual(other.get_many(['b']), {'b': '<p>b</p>'})
+            # a forked worker opens its own connection instead of its parent's
+            connection = other._connect()
+            other._local.pid = None
+            self.assertIsNot(other._connect(), connection)
+            for key in 'cdef':
+                backend.set_many({key: key})
+            self.assertEqual(sorted(backend.get_many(list('abcdef'))), ['d', 'e', 'f'])
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)